@@ -0,0 +1,72 @@
+"""
+Benchmark: serial vs process-pool parsing of CVAT annotation files.
+
+Generates synthetic NHTyp*.xml files in a temporary directory and times
+DataLoader.load_annotations(use_cache=False) with and without `workers`.
+
+Usage:
+    python benchmarks/bench_annotation_parsing.py --files 24 --images 20000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.data_loader import DataLoader
+
+
+def write_synthetic_xml(path, dataset, images, seed):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<annotations>\n<version>1.1</version>\n')
+        for i in range(images):
+            f.write(f'<image id="{i}" name="{dataset}/ATT{10000 + i}.jpg" width="640" height="480">\n')
+            if rng.random() < 0.7:
+                f.write('<box label="expert_score" occluded="0" xtl="0" ytl="0" xbr="1" ybr="1">'
+                        f'<attribute name="score">{rng.randint(1, 5)}</attribute></box>\n')
+            f.write('</image>\n')
+        f.write('</annotations>\n')
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=24, help="Number of XML datasets")
+    parser.add_argument("--images", type=int, default=20000, help="Images per XML file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Process pool size")
+    parser.add_argument("--repeat", type=int, default=3, help="Best-of-N timing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(1, args.files + 1):
+            write_synthetic_xml(os.path.join(tmp, f"NHTyp{i}.xml"), f"NHTyp{i}", args.images, i)
+
+        loader = DataLoader()
+        loader.annotations_dir = tmp
+
+        serial, df_serial = timed(lambda: loader.load_annotations(use_cache=False), args.repeat)
+        parallel, df_parallel = timed(
+            lambda: loader.load_annotations(use_cache=False, workers=args.workers), args.repeat
+        )
+
+        assert df_serial.equals(df_parallel), "serial and parallel results differ"
+        print(f"\n{args.files} files x {args.images} images = {len(df_serial)} rows, "
+              f"{os.cpu_count()} CPUs")
+        print(f"serial:              {serial:6.2f} s")
+        print(f"parallel ({args.workers:>2} procs): {parallel:6.2f} s  ({serial / parallel:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: memory of the default vs compact annotation frame.
+
+Builds a synthetic annotation frame shaped like load_annotations() output and
+compares DataFrame.memory_usage(deep=True) before and after
+DataLoader.compact_annotations().
+
+Usage:
+    python benchmarks/bench_compact_annotations.py --rows 1000000
+"""
+import os
+import sys
+import random
+import argparse
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.data_loader import DataLoader
+
+
+def synthetic_annotations(rows, image_root, seed=0):
+    rng = random.Random(seed)
+    data = []
+    for i in range(rows):
+        dataset = f"NHTyp{i % 5 + 1}"
+        file_name = f"{dataset}/ATT{10000 + i // 3}_{i % 3}.jpg"
+        data.append({
+            "dataset": dataset,
+            "image_id": str(i),
+            "file_name": file_name,
+            "image_path": os.path.join(image_root, file_name),
+            "expert_score": rng.randint(1, 5) if rng.random() < 0.7 else None,
+        })
+    return pd.DataFrame(data)
+
+
+def megabytes(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    loader = DataLoader()
+    df = synthetic_annotations(args.rows, loader.image_root)
+    # pandas < 3 keeps strings as Python objects; measure that layout explicitly too
+    df_object = df.astype(object)
+    compact = loader.compact_annotations(df)
+
+    print(f"{args.rows:,} rows, pandas {pd.__version__}\n")
+    print(f"{'object columns (pandas 2 default)':<36} {megabytes(df_object):8.1f} MB")
+    print(f"{'default load_annotations() frame':<36} {megabytes(df):8.1f} MB")
+    print(f"{'compact_annotations() frame':<36} {megabytes(compact):8.1f} MB")
+    print("\nPer column (MB):")
+    per_column = pd.DataFrame({
+        "object": df_object.memory_usage(deep=True, index=False) / 1024 ** 2,
+        "default": df.memory_usage(deep=True, index=False) / 1024 ** 2,
+        "compact": compact.memory_usage(deep=True, index=False) / 1024 ** 2,
+    }).round(1)
+    print(per_column.to_string())
+
+    # The compact frame must still resolve to the same image paths
+    assert (loader.image_paths(compact).values == df["image_path"].map(os.path.normpath).values).all()
+
+
+if __name__ == "__main__":
+    main()
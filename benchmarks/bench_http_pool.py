@@ -0,0 +1,122 @@
+"""
+Benchmark: per-request latency with and without a pooled keep-alive session.
+
+Starts a local stand-in for the Ollama /api/generate endpoint and sends the same
+image N times, once with a fresh requests.post per call (the old behaviour) and once
+through LocalVLM, which reuses connections from its session pool.
+
+Usage:
+    python benchmarks/bench_http_pool.py --requests 1000
+    python benchmarks/bench_http_pool.py --requests 1000 --handshake-ms 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.providers.local import LocalVLM
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # like real API servers; avoids 40 ms delayed-ACK stalls
+
+    handshake_delay = 0.0
+
+    def setup(self):
+        # Emulate the TCP (+TLS) handshake round-trips of a remote endpoint; paid once per connection
+        time.sleep(self.handshake_delay)
+        super().setup()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = json.dumps({"response": '{"overall_score": 3}'}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def time_calls(fn, n):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(label, latencies):
+    print(f"{label:<28} mean {statistics.mean(latencies):7.3f} ms | "
+          f"p50 {statistics.median(latencies):7.3f} ms | "
+          f"total {sum(latencies) / 1000:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Number of images to send")
+    parser.add_argument("--image-kb", type=int, default=200, help="Size of the synthetic image payload")
+    parser.add_argument("--handshake-ms", type=float, default=0.0,
+                        help="Simulated connection setup cost (e.g. ~2 RTTs for TCP+TLS to a remote API)")
+    args = parser.parse_args()
+    StandInHandler.handshake_delay = args.handshake_ms / 1000
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        f.write(os.urandom(args.image_kb * 1024))
+        image_path = f.name
+
+    try:
+        provider = LocalVLM()
+        provider.api_url = url
+        provider.image_policy = None  # the synthetic payload isn't a decodable image; send it as is
+        # Every call must reach the server: no response cache hits, no throttling
+        provider.cache = None
+        provider.rate_limiter = None
+        prompt = "Rate this property."
+
+        def unpooled():
+            body = provider._build_payload(image_path, prompt)
+            requests.post(url, data=body, headers=body.headers).json()
+
+        def pooled():
+            provider.analyze(image_path, prompt)
+
+        # Warm up both paths
+        unpooled()
+        pooled()
+
+        print(f"{args.requests} requests, {args.image_kb} KB image, "
+              f"{args.handshake_ms} ms handshake, stand-in server at {url}\n")
+        baseline = time_calls(unpooled, args.requests)
+        summarize("requests.post (no session)", baseline)
+        pooled_latencies = time_calls(pooled, args.requests)
+        summarize("LocalVLM (pooled session)", pooled_latencies)
+
+        saved = statistics.mean(baseline) - statistics.mean(pooled_latencies)
+        print(f"\nSaved per request: {saved:.3f} ms "
+              f"({saved * args.requests / 1000:.2f} s over {args.requests} images)")
+        print("Note: against a remote TLS endpoint (Together) the saving also includes the TLS handshake.")
+    finally:
+        os.unlink(image_path)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark: JPEG downscaling with and without Pillow draft mode.
+
+Writes synthetic phone-sized JPEGs (smooth gradients plus sensor-like noise) to a
+temporary directory and runs prepare_image() over them twice: decoding every pixel
+before the LANCZOS resize, and decoding in draft mode (DCT-domain 1/2, 1/4, 1/8
+scaling) first. Reports images/sec and the PSNR of the draft output against the
+full-decode output.
+
+Usage:
+    python benchmarks/bench_image_prep.py --images 50 --size 4032x3024 --max-edge 1024
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import PIL.Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.image_prep import ImagePolicy, prepare_image
+
+
+def write_synthetic_jpeg(path, width, height, seed):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 100 * np.sin(x / (width / (3 + seed % 5))),
+        128 + 100 * np.cos(y / (height / 4)),
+        128 + 60 * np.sin((x + y) / (width / 7)),
+    ], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    PIL.Image.fromarray(pixels, "RGB").save(path, format="JPEG", quality=92)
+
+
+def psnr(a, b):
+    a = np.asarray(PIL.Image.open(io.BytesIO(a)).convert("RGB"), dtype=np.float64)
+    b = np.asarray(PIL.Image.open(io.BytesIO(b)).convert("RGB"), dtype=np.float64)
+    if a.shape != b.shape:
+        return float("nan")
+    mse = np.mean((a - b) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def timed(paths, policy, draft, repeat):
+    best = float("inf")
+    outputs = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [prepare_image(path, policy, draft=draft) for path in paths]
+        best = min(best, time.perf_counter() - start)
+    return best, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=50, help="Number of synthetic JPEGs")
+    parser.add_argument("--size", default="4032x3024", help="WIDTHxHEIGHT of the synthetic photos")
+    parser.add_argument("--max-edge", type=int, default=1024, help="Policy max edge")
+    parser.add_argument("--quality", type=int, default=85, help="Policy JPEG quality")
+    parser.add_argument("--repeat", type=int, default=3, help="Best-of-N timing")
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split("x"))
+
+    policy = ImagePolicy(max_edge=args.max_edge, quality=args.quality)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(tmp, f"ATT{10000 + i}.jpg")
+            write_synthetic_jpeg(path, width, height, i)
+            paths.append(path)
+
+        full, full_out = timed(paths, policy, False, args.repeat)
+        fast, fast_out = timed(paths, policy, True, args.repeat)
+
+        scores = [psnr(a, b) for a, b in zip(full_out, fast_out)]
+        print(f"\n{args.images} JPEGs {width}x{height} -> max edge {args.max_edge}, quality {args.quality}")
+        print(f"full decode: {args.images / full:7.1f} images/sec")
+        print(f"draft mode:  {args.images / fast:7.1f} images/sec  ({full / fast:.1f}x)")
+        print(f"PSNR draft vs full decode: mean {np.mean(scores):.1f} dB, min {np.min(scores):.1f} dB")
+        print(f"output size: full {sum(map(len, full_out)) / len(full_out) / 1e3:.0f} KB, "
+              f"draft {sum(map(len, fast_out)) / len(fast_out) / 1e3:.0f} KB per image")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark: cold-start cost of `from src.providers import get_provider`.
+
+Each measurement runs in a fresh interpreter. "eager" runs what src/providers/__init__.py
+did before the lazy registry (import the four provider classes and Config up front);
+"lazy" imports the registry and resolves only the requested provider. Also lists which
+heavy third-party packages ended up in sys.modules.
+
+Usage:
+    python benchmarks/bench_provider_import.py --provider local --repeat 10
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["openai", "google.genai", "google.generativeai", "pandas", "numpy", "PIL"]
+
+# The body of the old eager src/providers/__init__.py
+EAGER = """
+from src.providers.local import LocalVLM
+from src.providers.openai import OpenAIVLM
+from src.providers.google import GoogleVLM
+from src.providers.together import TogetherVLM
+from src.config import Config
+"""
+
+LAZY = """
+from src.providers import get_provider_class
+get_provider_class({provider!r})
+"""
+
+TEMPLATE = """
+import json, sys, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run(body, repeat):
+    code = TEMPLATE.format(body=body, heavy=HEAVY_MODULES)
+    best, loaded = float("inf"), []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True,
+                             text=True, check=True)
+        # Warnings printed on import (e.g. missing google package) come before the JSON line
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        best = min(best, result["seconds"])
+        loaded = result["loaded"]
+    return best, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", default="local", help="Provider resolved in the lazy case")
+    parser.add_argument("--repeat", type=int, default=10, help="Best-of-N timing")
+    args = parser.parse_args()
+
+    eager, eager_loaded = run(EAGER, args.repeat)
+    lazy, lazy_loaded = run(LAZY.format(provider=args.provider), args.repeat)
+
+    eager_label, lazy_label = "eager (all providers):", f"lazy  ({args.provider}):"
+    width = max(len(eager_label), len(lazy_label)) + 2
+    print(f"{eager_label:<{width}}{eager * 1000:7.1f} ms  loads {', '.join(eager_loaded) or '-'}")
+    print(f"{lazy_label:<{width}}{lazy * 1000:7.1f} ms  loads {', '.join(lazy_loaded) or '-'}  ({eager / lazy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: peak memory of building and sending one request body with a large image.
+
+"json" is what LocalVLM/TogetherVLM did before: base64 string, data URL f-string,
+json.dumps and .encode() (what requests does for json=) all alive at once. "streamed"
+iterates a StreamingJSONBody the way the HTTP client writes it to the socket. Peaks are
+measured with tracemalloc on top of the raw image bytes, which both variants hold.
+
+Usage:
+    python benchmarks/bench_request_memory.py --image-mb 1 5 20
+"""
+import os
+import sys
+import json
+import base64
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.providers.request_body import Splice, StreamingJSONBody
+
+
+def payload_for(url):
+    return {
+        "model": "stand-in",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "Rate this property."},
+            {"type": "image_url", "image_url": {"url": url}},
+        ]}],
+        "max_tokens": 512,
+    }
+
+
+def send_json(image_data):
+    b64 = base64.b64encode(image_data).decode("utf-8")
+    body = json.dumps(payload_for(f"data:image/jpeg;base64,{b64}")).encode("utf-8")
+    return len(body)
+
+
+def send_streamed(image_data):
+    image = Splice(image_data)
+    body = StreamingJSONBody(payload_for(f"data:image/jpeg;base64,{image.token}"), [image])
+    sent = 0
+    for chunk in body:  # stands in for sock.sendall(chunk)
+        sent += len(chunk)
+    assert sent == len(body)
+    return sent
+
+
+def peak_bytes(fn, image_data):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    size = fn(image_data)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-mb", type=float, nargs="+", default=[1, 5, 20], help="Image sizes to test")
+    args = parser.parse_args()
+
+    print(f"{'image':>8} {'body':>9} {'json peak':>10} {'streamed peak':>14}")
+    for mb in args.image_mb:
+        image_data = os.urandom(int(mb * 1024 * 1024))
+        json_peak, json_size = peak_bytes(send_json, image_data)
+        stream_peak, stream_size = peak_bytes(send_streamed, image_data)
+        assert json_size == stream_size, "bodies differ in length"
+        print(f"{mb:>6.1f}MB {json_size / 2**20:>7.1f}MB {json_peak / 2**20:>8.1f}MB "
+              f"{stream_peak / 2**20:>12.2f}MB  ({json_peak / max(stream_peak, 1):.0f}x less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmark: src.parsing.parse_response against the per-script extract_score_from_response.
+
+Uses the responses recorded in together_ai_image_script/logs (benchmarks/fixtures/
+recorded_responses.jsonl) plus JSON responses in the pipeline schema (bare, fenced and
+embedded in prose, with subscores) and a few responses cut off around the score.
+Checks every parse against the expected score and reports microseconds per response
+for both parsers.
+
+Then cuts the JSON responses off at several points (like a max_tokens limit) and
+reports how many objects repair_json() recovers with the score still present, where
+json.loads gets none of them.
+
+Usage:
+    python benchmarks/bench_response_parsing.py --repeat 2000
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.parsing import HAS_ORJSON, parse_response
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "recorded_responses.jsonl")
+
+CATEGORIES = ["exterior", "porch_entryway", "landscaping", "roof_gutters", "windows", "personal_touches"]
+
+# Responses cut off around the score; a subscore must never be reported as the overall score
+EDGE_CASES = [
+    ('{"subscores": {"roof": {"score": 5}, "yard": {"score": 1}}, "sco', None),
+    ('```json\n{"subscores": {"roof": {"score": 4}}, "justification": "Peeling paint', None),
+    ('{"score": 2, "subscores": {"roof": {"score": 5}, "yard": {"sc', 2),
+    ('OVERALL DSM SCORE: 4\n{"subscores": {"roof": {"score": 2', 4),
+]
+
+
+def legacy_extract(response_text):
+    """The regex loop copied across together_ai_image_script/ plus pipeline 02's ```json split."""
+    try:
+        if "```json" in response_text:
+            parsed = json.loads(response_text.split("```json")[1].split("```")[0].strip())
+            return parsed.get("score") or parsed.get("overall_score")
+        if response_text.lstrip().startswith("{"):
+            parsed = json.loads(response_text)
+            return parsed.get("score") or parsed.get("overall_score")
+    except ValueError:
+        pass
+    patterns = [
+        r'OVERALL DSM SCORE:\s*(\d+)',
+        r'Score:\s*(\d+)',
+        r'SCORE:\s*(\d+)',
+        r'(\d+)\s*-\s*SLIPPING',
+        r'(\d+)\s*-\s*HEALTHY',
+        r'(\d+)\s*-\s*UNHEALTHY',
+        r'(\d+)\s*-\s*IN-BETWEEN',
+        r'(\d+)\s*-\s*VERY HEALTHY',
+        r'DSM SCORE:\s*(\d+)',
+        r'Property Score:\s*(\d+)',
+        r'Assessment Score:\s*(\d+)',
+        r'Rating:\s*(\d+)',
+        r'(\d+)\s*out of 5',
+        r'(\d+)/5'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, response_text, re.IGNORECASE)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def json_cases(n, seed=0):
+    rng = random.Random(seed)
+    cases = []
+    for i in range(n):
+        score = rng.randint(1, 5)
+        body = json.dumps({
+            "score": score,
+            "subscores": {c: {"score": rng.randint(1, 5), "notes": "Looks " + "fine " * rng.randint(5, 40)}
+                          for c in CATEGORIES},
+            "justification": "The property " + "shows some wear. " * rng.randint(5, 30),
+        }, indent=2)
+        wrapper = i % 3
+        if wrapper == 1:
+            body = f"```json\n{body}\n```"
+        elif wrapper == 2:
+            body = f"Here is my assessment of the property:\n\n{body}\n\nLet me know if you need more detail."
+        cases.append({"source": "synthetic_json", "response": body, "expected_score": score})
+    return cases
+
+
+def truncation_report(cases, fractions, repeat):
+    print(f"\nTruncated JSON ({len(cases)} responses per cut, required key: score)")
+    for fraction in fractions:
+        truncated = [(case["response"][:int(len(case["response"]) * fraction)], case) for case in cases]
+        results = [parse_response(text, required=("score",)) for text, _ in truncated]
+        recovered = sum(result.data is not None for result in results)
+        correct = sum(result.score == case["expected_score"] for result, (_, case) in zip(results, truncated))
+        subscores = sum(len(result.subscores) for result in results) / len(results)
+        methods = Counter(result.method for result in results)
+        us = timed(lambda text: parse_response(text, required=("score",)), [t for t, _ in truncated], repeat)
+        print(f"  cut at {fraction:4.0%}: objects recovered {recovered:3d}/{len(cases)}  "
+              f"score correct {correct:3d}/{len(cases)}  subscores/row {subscores:3.1f}  {us:6.1f} us  "
+              f"{dict(methods)}")
+
+
+def timed(fn, responses, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in responses:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(responses) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="Best-of-N timing passes")
+    parser.add_argument("--json-cases", type=int, default=30, help="Synthetic JSON responses added to the corpus")
+    args = parser.parse_args()
+
+    with open(FIXTURES, encoding="utf-8") as f:
+        recorded = [json.loads(line) for line in f]
+    synthetic = json_cases(args.json_cases)
+    edge = [{"source": "edge_case", "response": text, "expected_score": score} for text, score in EDGE_CASES]
+    corpus = recorded + synthetic + edge
+
+    wrong = [case for case in corpus if parse_response(case["response"]).score != case["expected_score"]]
+    legacy_wrong = [case for case in corpus if legacy_extract(case["response"]) != case["expected_score"]]
+    methods = {}
+    for case in corpus:
+        method = parse_response(case["response"]).method
+        methods[method] = methods.get(method, 0) + 1
+
+    for name, group in (("recorded", [c["response"] for c in recorded]),
+                        ("json", [c["response"] for c in synthetic])):
+        legacy_us = timed(legacy_extract, group, args.repeat)
+        new_us = timed(parse_response, group, args.repeat)
+        print(f"{name:>8}: {len(group):3d} responses  legacy {legacy_us:6.1f} us  "
+              f"parse_response {new_us:6.1f} us  ({legacy_us / new_us:.1f}x)")
+
+    print(f"orjson: {'yes' if HAS_ORJSON else 'no'}; methods: {methods}")
+    print(f"mismatches: parse_response {len(wrong)}/{len(corpus)}, legacy {len(legacy_wrong)}/{len(corpus)}")
+    for case in wrong:
+        print(f"  {case['source']}: expected {case['expected_score']}, got {parse_response(case['response']).score}")
+
+    truncation_report(synthetic, (0.25, 0.5, 0.75, 0.9), max(1, args.repeat // 10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark: time to score and tokens generated with analyze(..., stop_at_score=True).
+
+Starts a local stand-in for the Together chat completions endpoint that "generates" a
+recorded response (benchmarks/fixtures/recorded_responses.jsonl) one token per
+--token-ms, either as a single JSON body or as server-sent events. Each response is
+scored once through TogetherVLM.analyze() and once with stop_at_score=True, which
+closes the connection as soon as the score has streamed; the server counts how many
+tokens it produced before noticing.
+
+Usage:
+    python benchmarks/bench_stream_early_stop.py --token-ms 20
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.parsing import parse_response
+from src.providers.together import TogetherVLM
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "recorded_responses.jsonl")
+
+# Roughly one token per word piece, enough to pace the stream like a real model
+_TOKEN_RE = re.compile(r"\s*\S{1,4}")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    token_delay = 0.02
+    responses = []
+    generated = []  # tokens produced per request
+    lock = threading.Lock()
+    counter = 0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with self.lock:
+            text = self.responses[StandInHandler.counter % len(self.responses)]
+            StandInHandler.counter += 1
+        tokens = _TOKEN_RE.findall(text)
+
+        if not payload.get("stream"):
+            time.sleep(self.token_delay * len(tokens))
+            self._record(len(tokens))
+            body = json.dumps({"choices": [{"message": {"content": text}}],
+                               "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens)}}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        sent = 0
+        try:
+            for token in tokens:
+                time.sleep(self.token_delay)
+                event = {"choices": [{"delta": {"content": token}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                sent += 1
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up: a real server stops generating here
+            pass
+        self._record(sent)
+        self.close_connection = True
+
+    def _record(self, n):
+        with self.lock:
+            self.generated.append(n)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(provider, image_path, responses, stop_at_score):
+    latencies, scores, generated = [], [], []
+    for _ in responses:
+        start = len(StandInHandler.generated)
+        t0 = time.perf_counter()
+        text = provider.analyze(image_path, "Score this property.", stop_at_score=stop_at_score)
+        latencies.append(time.perf_counter() - t0)
+        scores.append(parse_response(text).score)
+        # The server finishes its bookkeeping after the client has gone
+        while len(StandInHandler.generated) == start:
+            time.sleep(0.001)
+        generated.append(StandInHandler.generated[start])
+    return latencies, scores, generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token-ms", type=float, default=20.0, help="Simulated generation time per token")
+    args = parser.parse_args()
+    StandInHandler.token_delay = args.token_ms / 1000
+
+    with open(FIXTURES, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f]
+    # Only responses that carry a score
+    cases = [case for case in cases if case["expected_score"] is not None]
+    StandInHandler.responses = [case["response"] for case in cases]
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        f.write(os.urandom(50 * 1024))
+        image_path = f.name
+
+    try:
+        provider = TogetherVLM()
+        provider.url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+        provider.image_policy = None  # the synthetic payload isn't a decodable image; send it as is
+        provider.cache = None
+        provider.rate_limiter = None
+
+        print(f"{len(cases)} recorded responses, {args.token_ms} ms/token\n")
+        expected = [case["expected_score"] for case in cases]
+        results = {}
+        for label, stop in (("full completion", False), ("stop_at_score", True)):
+            StandInHandler.counter = 0
+            latencies, scores, generated = run(provider, image_path, cases, stop)
+            results[label] = (latencies, generated)
+            correct = sum(s == e for s, e in zip(scores, expected))
+            print(f"{label:<16} mean {statistics.mean(latencies):6.3f} s | p50 {statistics.median(latencies):6.3f} s | "
+                  f"tokens generated {sum(generated):6d} | scores correct {correct}/{len(cases)}")
+
+        full, early = results["full completion"], results["stop_at_score"]
+        print(f"\nLatency {statistics.mean(full[0]) / statistics.mean(early[0]):.1f}x lower, "
+              f"output tokens {1 - sum(early[1]) / sum(full[1]):.0%} fewer")
+    finally:
+        os.unlink(image_path)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
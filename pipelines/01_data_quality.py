@@ -1,17 +1,68 @@
 import os
-import json
+import sys
+import argparse
 import random
 import pandas as pd
 from src.data_loader import DataLoader
 from src.providers import get_provider
+from src.parsing import parse_response
+from src.executor import StagedExecutor
+from src.journal import RunJournal
 from src.config import Config
 
+# Fields a truncated quality-check response must still have to be used
+QUALITY_KEYS = ("is_clear", "house_visible", "address_visible")
+
 def load_quality_prompt():
     prompt_path = os.path.join(Config.PROMPTS_DIR, "quality_check.txt")
     with open(prompt_path, "r") as f:
         return f.read()
 
-def run_quality_check(image_paths, provider_name="local", sample_size=None):
+def check_image(provider, prompt, img_path):
+    """Runs the quality check on a single image and returns its result row."""
+    if not os.path.exists(img_path):
+        return {
+            "image_path": img_path,
+            "error": "File not found"
+        }
+
+    print(f"Processing: {os.path.basename(img_path)}")
+
+    try:
+        response = provider.analyze(img_path, prompt)
+        call_info = provider.last_call_info()
+
+        if response:
+            result = parse_response(response, required=QUALITY_KEYS)
+            parsed = result.data
+            if parsed is not None:
+                parsed["image_path"] = img_path
+                parsed["retries"] = call_info["retries"]
+                parsed["parse_repairs"] = ",".join(result.repairs)
+                # Intact JSON without the quality fields is still a failure for --retry-failed
+                missing = [key for key in QUALITY_KEYS if parsed.get(key) is None]
+                parsed["error"] = f"Missing fields: {', '.join(missing)}" if missing else None
+                return parsed
+            return {
+                "image_path": img_path,
+                "raw_response": response,
+                "retries": call_info["retries"],
+                "error": "Failed to parse JSON"
+            }
+        else:
+            return {
+                "image_path": img_path,
+                "error": call_info["error"] or "Empty response",
+                "retries": call_info["retries"]
+            }
+    except Exception as e:
+        return {
+            "image_path": img_path,
+            "error": str(e)
+        }
+
+def run_quality_check(image_paths, provider_name="local", sample_size=None, concurrency=None, use_cache=True,
+                      journal=None, retry_failed=False):
     """
     Run quality check on a list of images.
     
@@ -19,83 +70,94 @@ def run_quality_check(image_paths, provider_name="local", sample_size=None):
         image_paths: List of image file paths
         provider_name: Which VLM provider to use ("local", "openai", "google", "together")
         sample_size: If specified, randomly sample this many images
+        concurrency: Max parallel requests (defaults to the provider limit in Config)
+        use_cache: Set to False to bypass the persistent response cache
+        journal: Optional RunJournal; each row is flushed to it as soon as it finishes
+        retry_failed: With a journal, only re-run images whose journaled row errored
+            (refreshing their response cache entries)
         
     Returns:
-        DataFrame with quality check results
+        DataFrame with quality check results (in input order, including journaled rows)
     """
     if sample_size and len(image_paths) > sample_size:
-        image_paths = random.sample(image_paths, sample_size)
+        # Sorted first so the same seed gives the same sample whatever the input order
+        image_paths = random.sample(sorted(image_paths), sample_size)
     
     provider = get_provider(provider_name)
+    if not use_cache:
+        provider.cache = None
+    elif retry_failed:
+        # Ask again instead of getting the same cached bad response back, and replace it
+        provider.cache_refresh = True
     prompt = load_quality_prompt()
     
-    results = []
+    if journal is not None:
+        todo = journal.pending(image_paths, retry_failed=retry_failed)
+        print(f"Journal: {len(image_paths) - len(todo)} images already done, {len(todo)} to run")
+    else:
+        todo = image_paths
     
-    for img_path in image_paths:
-        if not os.path.exists(img_path):
-            results.append({
-                "image_path": img_path,
-                "error": "File not found"
-            })
-            continue
-            
-        print(f"Processing: {os.path.basename(img_path)}")
-        
-        try:
-            response = provider.analyze(img_path, prompt)
-            
-            # Try to parse JSON from response
-            if response:
-                # Clean response (remove markdown code blocks if present)
-                clean_response = response.strip()
-                if "```json" in clean_response:
-                    clean_response = clean_response.split("```json")[1].split("```")[0].strip()
-                elif "```" in clean_response:
-                    clean_response = clean_response.split("```")[1].split("```")[0].strip()
-                
-                try:
-                    parsed = json.loads(clean_response)
-                    parsed["image_path"] = img_path
-                    results.append(parsed)
-                except json.JSONDecodeError:
-                    results.append({
-                        "image_path": img_path,
-                        "raw_response": response,
-                        "error": "Failed to parse JSON"
-                    })
-            else:
-                results.append({
-                    "image_path": img_path,
-                    "error": "Empty response"
-                })
-        except Exception as e:
-            results.append({
-                "image_path": img_path,
-                "error": str(e)
-            })
+    # Images are decoded/resized in worker processes while earlier requests are in flight
+    executor = StagedExecutor(provider_name, concurrency=concurrency)
+    results = executor.map(
+        lambda img_path: check_image(provider, prompt, img_path),
+        todo,
+        on_result=journal.append if journal is not None else None,
+        prepare=provider.payload_loader(),
+        with_prepared=provider.prefetched
+    )
+    executor.report()
+    provider.report_uploads()
     
+    if journal is not None:
+        results = journal.results(image_paths)
     return pd.DataFrame(results)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the image quality check pipeline.")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Max parallel requests (defaults to the provider limit in Config)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the persistent response cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip images already recorded in the journal")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Re-run only images whose journaled row errored or failed to parse")
+    # Fixed by default so --resume and --retry-failed draw the same sample as the first run
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Random seed for the pilot sample (use the same seed with --resume)")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
     # Load annotations
     loader = DataLoader()
     df = loader.load_annotations()
     
-    # Get all image paths
-    all_images = df['image_path'].tolist()
+    # Filter to only existing images (one directory scan instead of a stat per row)
+    df = loader.add_file_info(df, with_stat=False)
+    existing_images = df.loc[df['exists'], 'image_path'].tolist()
     
-    # Filter to only existing images
-    existing_images = [img for img in all_images if os.path.exists(img)]
+    print(f"Found {len(existing_images)} existing images out of {len(df)} total")
+    loader.report_image_coverage(df)
     
-    print(f"Found {len(existing_images)} existing images out of {len(all_images)} total")
+    # Rows are journaled as they finish so a crash or Ctrl-C can be resumed
+    output_path = os.path.join(Config.OUTPUTS_DIR, "quality_check_pilot.csv")
+    journal = RunJournal(output_path.replace(".csv", ".jsonl"),
+                         fresh=not (args.resume or args.retry_failed))
     
     # Run pilot test on 10 random images
     print("\n=== Running Pilot Test (10 images) ===")
-    pilot_results = run_quality_check(existing_images, sample_size=10)
+    try:
+        pilot_results = run_quality_check(existing_images, sample_size=10, concurrency=args.concurrency,
+                                          use_cache=not args.no_cache, journal=journal,
+                                          retry_failed=args.retry_failed)
+    except KeyboardInterrupt:
+        journal.close()
+        print(f"Stopped. Finished rows are in {journal.path}; rerun with --resume to continue.")
+        sys.exit(130)
+    journal.close()
     
     # Save results
-    output_path = os.path.join(Config.OUTPUTS_DIR, "quality_check_pilot.csv")
-    os.makedirs(Config.OUTPUTS_DIR, exist_ok=True)
     pilot_results.to_csv(output_path, index=False)
     print(f"\n✅ Pilot results saved to: {output_path}")
     
@@ -1,8 +1,13 @@
 import os
-import json
+import sys
+import argparse
 import pandas as pd
 from src.data_loader import DataLoader
 from src.providers import get_provider
+from src.parsing import parse_response
+from src.executor import StagedExecutor
+from src.journal import RunJournal
+from src.dedup import DuplicatePlan
 from src.config import Config
 
 def load_scoring_prompt():
@@ -10,99 +15,160 @@ def load_scoring_prompt():
     with open(prompt_path, "r") as f:
         return f.read()
 
-def score_images(image_paths, provider_name="openai", batch_size=10):
+def score_image(provider, provider_name, prompt, img_path, stop_at_score=False):
+    """Scores a single image and returns its result row."""
+    if not os.path.exists(img_path):
+        return {
+            "image_path": img_path,
+            "provider": provider_name,
+            "error": "File not found"
+        }
+    
+    try:
+        response = provider.analyze(img_path, prompt, stop_at_score=stop_at_score)
+        call_info = provider.last_call_info()
+        
+        if response:
+            parsed = parse_response(response)
+
+            return {
+                "image_path": img_path,
+                "provider": provider_name,
+                "model": provider.model_name,
+                "raw_response": response,
+                "predicted_score": parsed.score,
+                "parse_method": parsed.method,
+                "parse_confidence": parsed.confidence,
+                "parse_repairs": ",".join(parsed.repairs),
+                "stopped_early": call_info["stopped_early"],
+                "retries": call_info["retries"],
+                # Marks the row as failed so --retry-failed re-runs it
+                "error": None if parsed.score is not None else "No score parsed"
+            }
+        else:
+            return {
+                "image_path": img_path,
+                "provider": provider_name,
+                "error": call_info["error"] or "Empty response",
+                "retries": call_info["retries"]
+            }
+    except Exception as e:
+        return {
+            "image_path": img_path,
+            "provider": provider_name,
+            "error": str(e)
+        }
+
+def score_images(image_paths, provider_name="openai", batch_size=10, concurrency=None, use_cache=True,
+                 journal=None, retry_failed=False, dedup=False, stop_at_score=False):
     """
     Score property images using zero-shot VLM.
     
     Args:
         image_paths: List of image file paths
         provider_name: Which VLM provider to use
-        batch_size: Process in batches (for progress tracking)
+        batch_size: Print progress every `batch_size` completed images
+        concurrency: Max parallel requests (defaults to the provider limit in Config)
+        use_cache: Set to False to bypass the persistent response cache
+        journal: Optional RunJournal; each row is flushed to it as soon as it finishes
+        retry_failed: With a journal, only re-run images whose journaled row errored
+            (refreshing their response cache entries)
+        dedup: Score one image per near-duplicate cluster and copy its row to the others
+        stop_at_score: Stream responses and cancel each one once the overall score is known
+            (raw_response then stops shortly after the score)
         
     Returns:
-        DataFrame with scoring results
+        DataFrame with scoring results (in input order, including journaled rows)
     """
     provider = get_provider(provider_name)
+    if not use_cache:
+        provider.cache = None
+    elif retry_failed:
+        # Ask again instead of getting the same cached bad response back, and replace it
+        provider.cache_refresh = True
     prompt = load_scoring_prompt()
     
-    results = []
-    total = len(image_paths)
+    if journal is not None:
+        todo = journal.pending(image_paths, retry_failed=retry_failed)
+        print(f"Journal: {len(image_paths) - len(todo)} images already done, {len(todo)} to run")
+    else:
+        todo = image_paths
     
-    for idx, img_path in enumerate(image_paths, 1):
-        if not os.path.exists(img_path):
-            results.append({
-                "image_path": img_path,
-                "provider": provider_name,
-                "error": "File not found"
-            })
-            continue
-        
-        if idx % batch_size == 0:
-            print(f"Progress: {idx}/{total} ({idx/total*100:.1f}%)")
-        
-        try:
-            response = provider.analyze(img_path, prompt)
-            
-            if response:
-                # Try to extract score from response
-                # The prompt should return a score, but we need to parse it
-                # This is a simple extraction - may need refinement based on actual responses
-                score = None
-                try:
-                    # Try to find score in JSON format
-                    if "```json" in response:
-                        json_str = response.split("```json")[1].split("```")[0].strip()
-                        parsed = json.loads(json_str)
-                        score = parsed.get("score") or parsed.get("overall_score")
-                    elif "score" in response.lower():
-                        # Try to extract number after "score"
-                        import re
-                        score_match = re.search(r'score[:\s]+(\d)', response, re.IGNORECASE)
-                        if score_match:
-                            score = int(score_match.group(1))
-                except:
-                    pass
-                
-                results.append({
-                    "image_path": img_path,
-                    "provider": provider_name,
-                    "model": provider.model_name,
-                    "raw_response": response,
-                    "predicted_score": score
-                })
-            else:
-                results.append({
-                    "image_path": img_path,
-                    "provider": provider_name,
-                    "error": "Empty response"
-                })
-        except Exception as e:
-            results.append({
-                "image_path": img_path,
-                "provider": provider_name,
-                "error": str(e)
-            })
+    # Shots of the same house are often near-identical; pay for one per cluster
+    plan = None
+    if dedup:
+        plan = DuplicatePlan(todo)
+        plan.report()
+        todo = plan.representatives
+    
+    # Images are decoded/resized in worker processes while earlier requests are in flight
+    executor = StagedExecutor(provider_name, concurrency=concurrency, progress_every=batch_size)
+    results = executor.map(
+        lambda img_path: score_image(provider, provider_name, prompt, img_path, stop_at_score),
+        todo,
+        on_result=journal.append if journal is not None else None,
+        prepare=provider.payload_loader(),
+        with_prepared=provider.prefetched
+    )
+    executor.report()
+    provider.report_uploads()
     
+    if plan is not None:
+        results = plan.expand(results)
+        if journal is not None:
+            for row in results:
+                if "duplicate_of" in row:
+                    journal.append(row)
+    
+    if journal is not None:
+        results = journal.results(image_paths)
     return pd.DataFrame(results)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run zero-shot DSM scoring.")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Max parallel requests (defaults to the provider limit in Config)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the persistent response cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip images already recorded in the journal")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Re-run only images whose journaled row errored or failed to parse")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Score one image per near-duplicate cluster and copy the result to the rest")
+    parser.add_argument("--stop-at-score", action="store_true",
+                        help="Stream responses and stop generating once the overall score is known")
+    args = parser.parse_args()
+
     # Load annotations
     loader = DataLoader()
     df = loader.load_annotations()
     
-    # Get scored images for testing
-    scored_images = [img for img in df[df['expert_score'].notna()]['image_path'].tolist() 
-                     if os.path.exists(img)]
+    # Get scored images for testing (existence checked with one directory scan)
+    df = loader.add_file_info(df, with_stat=False)
+    scored_images = df.loc[df['expert_score'].notna() & df['exists'], 'image_path'].tolist()
     
     print(f"Found {len(scored_images)} scored images")
     
+    # Rows are journaled as they finish so a crash or Ctrl-C can be resumed
+    output_path = os.path.join(Config.OUTPUTS_DIR, "zeroshot_scores_openai.csv")
+    journal = RunJournal(output_path.replace(".csv", ".jsonl"),
+                         fresh=not (args.resume or args.retry_failed))
+    
     # Test with OpenAI (you can change provider)
     print("\n=== Running Zero-Shot Scoring (OpenAI) ===")
-    results = score_images(scored_images[:10], provider_name="openai")  # Test on 10 first
+    try:
+        results = score_images(scored_images[:10], provider_name="openai", concurrency=args.concurrency,
+                               use_cache=not args.no_cache, journal=journal,
+                               retry_failed=args.retry_failed, dedup=args.dedup,
+                               stop_at_score=args.stop_at_score)  # Test on 10 first
+    except KeyboardInterrupt:
+        journal.close()
+        print(f"Stopped. Finished rows are in {journal.path}; rerun with --resume to continue.")
+        sys.exit(130)
+    journal.close()
     
     # Save results
-    output_path = os.path.join(Config.OUTPUTS_DIR, "zeroshot_scores_openai.csv")
-    os.makedirs(Config.OUTPUTS_DIR, exist_ok=True)
     results.to_csv(output_path, index=False)
     print(f"\n✅ Results saved to: {output_path}")
 
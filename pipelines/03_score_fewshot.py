@@ -1,66 +1,137 @@
 import os
-import json
+import sys
+import argparse
+import numpy as np
 import pandas as pd
+from src.annotation_index import extract_property_id
 from src.data_loader import DataLoader
 from src.providers import get_provider
+from src.parsing import parse_response
+from src.exemplars import ExemplarBank
+from src.executor import StagedExecutor
+from src.journal import RunJournal
+from src.dedup import DuplicatePlan
 from src.config import Config
-from src.data_loader import DataLoader
 
-def select_gold_standard_examples(df_annotations, examples_per_score=1):
+def select_gold_standard_examples(df_annotations, examples_per_score=1, exclude=(), loader=None):
     """
     Select representative images for each score (1-5) to use as examples.
     
     Args:
         df_annotations: DataFrame with annotations and expert scores
         examples_per_score: How many examples to select per score
+        exclude: Target image paths; no example is taken from their properties, so a
+            target (or another shot of the same house) is never shown with its score
+        loader: DataLoader whose image and group indexes are reused (a new one if None)
         
     Returns:
         Dictionary mapping score -> list of image paths
     """
     gold_standards = {}
+    loader = loader or DataLoader()
+    
+    # Check existence once for all rows rather than once per score
+    if 'exists' not in df_annotations:
+        df_annotations = loader.add_file_info(df_annotations, with_stat=False)
+    
+    # Score -> row positions index; each pick is a lookup instead of a frame scan
+    index = loader.build_indexes(df_annotations)
+    
+    excluded_ids = {extract_property_id(path) for path in exclude}
+    excluded = [index.by_property[pid] for pid in excluded_ids if pid in index.by_property]
+    excluded = np.concatenate(excluded) if excluded else np.array([], dtype=int)
     
     for score in [1, 2, 3, 4, 5]:
-        score_images = df_annotations[
-            (df_annotations['expert_score'] == str(score)) & 
-            (df_annotations['image_path'].apply(os.path.exists))
-        ]
-        
-        if len(score_images) > 0:
-            # Select first N examples (or random sample)
-            selected = score_images.head(examples_per_score)
-            gold_standards[score] = selected['image_path'].tolist()
-        else:
-            gold_standards[score] = []
+        # Select first N examples from properties that aren't being scored
+        positions = np.setdiff1d(index.positions(score=score, existing_only=True), excluded)
+        selected = df_annotations.iloc[positions[:examples_per_score]]
+        gold_standards[score] = loader.image_paths(selected).tolist()
     
     return gold_standards
 
-def build_fewshot_prompt(base_prompt, gold_standards, provider):
+def check_exemplars_disjoint(gold_standards, image_paths):
+    """Raises ValueError if an example image is also a target image."""
+    examples = {os.path.normpath(path) for paths in gold_standards.values() for path in paths}
+    overlap = examples & {os.path.normpath(path) for path in image_paths}
+    if overlap:
+        raise ValueError(f"{len(overlap)} example image(s) are also scored, e.g. {sorted(overlap)[0]}; "
+                         "their expert scores would leak into the few-shot prompt")
+
+FEWSHOT_INSTRUCTION = "Now analyze the target image using the same criteria as the examples above."
+
+def build_exemplar_bank(base_prompt, gold_standards, provider):
     """
-    Build a few-shot prompt by adding example images and their scores.
+    Build the few-shot exemplars shared by every request of a run.
+    
+    The example images are encoded once; each request then sends the same
+    prefix (rubric, examples with their scores) followed by the target image.
     
     Args:
         base_prompt: The zero-shot scoring prompt
         gold_standards: Dictionary mapping score -> list of image paths
-        provider: VLM provider instance (for encoding images if needed)
+        provider: VLM provider instance the exemplars are encoded for
         
     Returns:
-        Enhanced prompt string (or structured format depending on provider)
+        ExemplarBank
     """
-    # For now, we'll create a text-based few-shot prompt
-    # Some providers may need image embeddings injected differently
-    
-    fewshot_text = base_prompt + "\n\n## Examples:\n\n"
-    
+    examples = []
     for score in [1, 2, 3, 4, 5]:
-        if score in gold_standards and gold_standards[score]:
-            example_path = gold_standards[score][0]
-            fewshot_text += f"Example Score {score}: See image '{os.path.basename(example_path)}'\n"
+        for example_path in gold_standards.get(score, []):
+            examples.append((example_path, f"Example: expert score {score}"))
     
-    fewshot_text += "\nNow analyze the target image using the same criteria as the examples above."
+    return ExemplarBank(provider, examples, header=base_prompt + "\n\n## Examples:")
+
+def score_image_fewshot(provider, provider_name, exemplars, img_path):
+    """Scores a single image with the few-shot prompt and returns its result row."""
+    if not os.path.exists(img_path):
+        return {
+            "image_path": img_path,
+            "provider": provider_name,
+            "error": "File not found"
+        }
     
-    return fewshot_text
+    try:
+        response = provider.analyze(img_path, FEWSHOT_INSTRUCTION, exemplars=exemplars)
+        call_info = provider.last_call_info()
+        
+        if response:
+            # A response cut off after the score is kept (see parse_repairs)
+            result = parse_response(response, required=("score",))
+            parsed = result.data
+            if parsed is not None:
+                parsed["image_path"] = img_path
+                parsed["retries"] = call_info["retries"]
+                parsed["provider"] = provider_name
+                parsed["method"] = "fewshot"
+                parsed["parse_method"] = result.method
+                parsed["parse_repairs"] = ",".join(result.repairs)
+                # Marks the row as failed so --retry-failed re-runs it
+                parsed["error"] = None if result.score is not None else "No score parsed"
+                return parsed
+            return {
+                "image_path": img_path,
+                "provider": provider_name,
+                "error": "JSON parse error",
+                "raw_response": response,
+                "retries": call_info["retries"]
+            }
+        else:
+            return {
+                "image_path": img_path,
+                "provider": provider_name,
+                "error": call_info["error"] or "Empty response",
+                "retries": call_info["retries"]
+            }
+    except Exception as e:
+        return {
+            "image_path": img_path,
+            "provider": provider_name,
+            "error": str(e)
+        }
 
-def score_with_fewshot(image_paths, provider_name="openai", examples_per_score=1):
+def score_with_fewshot(image_paths, provider_name="openai", examples_per_score=1, use_cache=True,
+                       concurrency=None, journal=None, retry_failed=False, df_annotations=None,
+                       dedup=False, loader=None):
     """
     Score images using few-shot learning with gold standard examples.
     
@@ -68,17 +139,28 @@ def score_with_fewshot(image_paths, provider_name="openai", examples_per_score=1
         image_paths: List of target image paths to score
         provider_name: VLM provider to use
         examples_per_score: Number of examples per score category
+        use_cache: Set to False to bypass the persistent response cache
+        concurrency: Max parallel requests (defaults to the provider limit in Config)
+        journal: Optional RunJournal; each row is flushed to it as soon as it finishes
+        retry_failed: With a journal, only re-run images whose journaled row errored
+            (refreshing their response cache entries)
+        df_annotations: Annotations already loaded by the caller (loaded here if None)
+        dedup: Score one image per near-duplicate cluster and copy its row to the others
+        loader: DataLoader that loaded df_annotations; its indexes are reused
         
     Returns:
-        DataFrame with scoring results
+        DataFrame with scoring results (in input order, including journaled rows)
     """
     # Load annotations to get gold standards
-    loader = DataLoader()
-    df_annotations = loader.load_annotations()
-    df_scored = df_annotations[df_annotations['expert_score'].notna()]
+    loader = loader or DataLoader()
+    if df_annotations is None:
+        df_annotations = loader.load_annotations()
     
-    # Select gold standard examples
-    gold_standards = select_gold_standard_examples(df_scored, examples_per_score)
+    # Select gold standard examples from properties outside the target set. The score
+    # index only holds scored rows, so the full frame is indexed (and cached) as is
+    gold_standards = select_gold_standard_examples(df_annotations, examples_per_score,
+                                                   exclude=image_paths, loader=loader)
+    check_exemplars_disjoint(gold_standards, image_paths)
     
     # Load base prompt
     prompt_path = os.path.join(Config.PROMPTS_DIR, "prompt_zero_shot.txt")
@@ -86,80 +168,94 @@ def score_with_fewshot(image_paths, provider_name="openai", examples_per_score=1
         base_prompt = f.read()
     
     provider = get_provider(provider_name)
+    if not use_cache:
+        provider.cache = None
+    elif retry_failed:
+        # Ask again instead of getting the same cached bad response back, and replace it
+        provider.cache_refresh = True
     
-    # Build few-shot prompt
-    fewshot_prompt = build_fewshot_prompt(base_prompt, gold_standards, provider)
+    # Encode the exemplars once for the whole run
+    exemplars = build_exemplar_bank(base_prompt, gold_standards, provider)
     
-    results = []
+    if journal is not None:
+        todo = journal.pending(image_paths, retry_failed=retry_failed)
+        print(f"Journal: {len(image_paths) - len(todo)} images already done, {len(todo)} to run")
+    else:
+        todo = image_paths
     
-    for img_path in image_paths:
-        if not os.path.exists(img_path):
-            results.append({
-                "image_path": img_path,
-                "provider": provider_name,
-                "error": "File not found"
-            })
-            continue
-        
-        try:
-            # For providers that support multiple images, we could inject examples here
-            # For now, we'll use text-based few-shot prompting
-            response = provider.analyze(img_path, fewshot_prompt)
-            
-            if response:
-                # Parse JSON response
-                clean_response = response.strip()
-                if "```json" in clean_response:
-                    clean_response = clean_response.split("```json")[1].split("```")[0].strip()
-                elif "```" in clean_response:
-                    clean_response = clean_response.split("```")[1].split("```")[0].strip()
-                
-                try:
-                    parsed = json.loads(clean_response)
-                    parsed["image_path"] = img_path
-                    parsed["provider"] = provider_name
-                    parsed["method"] = "fewshot"
-                    results.append(parsed)
-                except json.JSONDecodeError:
-                    results.append({
-                        "image_path": img_path,
-                        "provider": provider_name,
-                        "error": "JSON parse error",
-                        "raw_response": response
-                    })
-            else:
-                results.append({
-                    "image_path": img_path,
-                    "provider": provider_name,
-                    "error": "Empty response"
-                })
-        except Exception as e:
-            results.append({
-                "image_path": img_path,
-                "provider": provider_name,
-                "error": str(e)
-            })
+    # Shots of the same house are often near-identical; pay for one per cluster
+    plan = None
+    if dedup:
+        plan = DuplicatePlan(todo)
+        plan.report()
+        todo = plan.representatives
+    
+    # Images are decoded/resized in worker processes while earlier requests are in flight
+    executor = StagedExecutor(provider_name, concurrency=concurrency)
+    results = executor.map(
+        lambda img_path: score_image_fewshot(provider, provider_name, exemplars, img_path),
+        todo,
+        on_result=journal.append if journal is not None else None,
+        prepare=provider.payload_loader(),
+        with_prepared=provider.prefetched
+    )
+    executor.report()
+    provider.report_uploads()
     
+    if plan is not None:
+        results = plan.expand(results)
+        if journal is not None:
+            for row in results:
+                if "duplicate_of" in row:
+                    journal.append(row)
+    
+    if journal is not None:
+        results = journal.results(image_paths)
     return pd.DataFrame(results)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run few-shot DSM scoring.")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Max parallel requests (defaults to the provider limit in Config)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the persistent response cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip images already recorded in the journal")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Re-run only images whose journaled row errored or failed to parse")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Score one image per near-duplicate cluster and copy the result to the rest")
+    args = parser.parse_args()
+
     # Load annotations
     loader = DataLoader()
     df = loader.load_annotations()
     
-    # Get scored images for testing
-    scored_images = [img for img in df[df['expert_score'].notna()]['image_path'].tolist() 
-                     if os.path.exists(img)]
+    # Get scored images for testing (existence checked with one directory scan)
+    df = loader.add_file_info(df, with_stat=False)
+    scored_images = df.loc[df['expert_score'].notna() & df['exists'], 'image_path'].tolist()
     
     print(f"Found {len(scored_images)} scored images")
     
+    # Rows are journaled as they finish so a crash or Ctrl-C can be resumed
+    output_path = os.path.join(Config.OUTPUTS_DIR, "fewshot_scores.csv")
+    journal = RunJournal(output_path.replace(".csv", ".jsonl"),
+                         fresh=not (args.resume or args.retry_failed))
+    
     # Test few-shot scoring
     print("\n=== Running Few-Shot Scoring ===")
-    results = score_with_fewshot(scored_images[:10], provider_name="openai")  # Test on 10 first
+    try:
+        results = score_with_fewshot(scored_images[:10], provider_name="openai",
+                                     use_cache=not args.no_cache, concurrency=args.concurrency,
+                                     journal=journal, retry_failed=args.retry_failed, dedup=args.dedup,
+                                     df_annotations=df, loader=loader)  # Test on 10 first
+    except KeyboardInterrupt:
+        journal.close()
+        print(f"Stopped. Finished rows are in {journal.path}; rerun with --resume to continue.")
+        sys.exit(130)
+    journal.close()
     
     # Save results
-    output_path = os.path.join(Config.OUTPUTS_DIR, "fewshot_scores.csv")
-    os.makedirs(Config.OUTPUTS_DIR, exist_ok=True)
     results.to_csv(output_path, index=False)
     print(f"\n✅ Results saved to: {output_path}")
 
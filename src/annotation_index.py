@@ -0,0 +1,123 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+
+# Property IDs look like "ATT10035"; several shots of one house share the ID
+# (e.g. "ATT10035_2.jpg"). Names that don't match fall back to the file stem.
+PROPERTY_ID_PATTERN = re.compile(r"(ATT\d+)", re.IGNORECASE)
+
+_EMPTY = np.array([], dtype=np.intp)
+
+
+def extract_property_id(file_name):
+    """Returns the property ID of an image file name (e.g. 'NHTyp1/ATT10035_2.jpg' -> 'ATT10035')."""
+    base = str(file_name).rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
+    match = PROPERTY_ID_PATTERN.search(base)
+    if match:
+        return match.group(1).upper()
+    return os.path.splitext(base)[0]
+
+
+def _group_positions(keys):
+    """Maps each distinct key to the sorted row positions holding it (missing keys are skipped)."""
+    codes, uniques = pd.factorize(keys)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    # Missing keys get code -1 and sort first
+    start = np.searchsorted(sorted_codes, 0)
+    bounds = np.flatnonzero(np.diff(sorted_codes[start:])) + 1
+    return dict(zip(uniques, np.split(order[start:], bounds)))
+
+
+class AnnotationIndex:
+    """
+    Precomputed group indexes over an annotation frame.
+
+    Maps each expert score, dataset and property ID to the row positions holding it,
+    so stratified sampling, few-shot exemplar picks and per-class evaluation are
+    dictionary lookups instead of boolean-mask scans of the whole frame.
+
+    Works with both regular and compact (see DataLoader.compact_annotations) frames.
+    If the frame has an `exists` column (DataLoader.add_file_info), lookups can be
+    restricted to images present on disk.
+
+    Args:
+        df: Annotation frame (row positions refer to df.iloc).
+    """
+
+    def __init__(self, df):
+        self.df = df
+        scores = pd.to_numeric(df["expert_score"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        self.by_score = {int(score): positions for score, positions in _group_positions(scores).items()}
+        self.by_dataset = {str(name): positions
+                           for name, positions in _group_positions(df["dataset"].to_numpy(dtype=object)).items()}
+        file_names = df["file_name"].astype(object).to_numpy()
+        self.by_property = _group_positions(
+            np.array([extract_property_id(name) for name in file_names], dtype=object))
+        self.exists = df["exists"].to_numpy(dtype=bool) if "exists" in df else None
+
+    @property
+    def scores(self):
+        return sorted(self.by_score)
+
+    @property
+    def datasets(self):
+        return sorted(self.by_dataset)
+
+    def positions(self, score=None, dataset=None, property_id=None, existing_only=False):
+        """
+        Returns sorted row positions matching every given key.
+
+        Args:
+            score: Expert score (int).
+            dataset: Dataset name (e.g. "NHTyp1").
+            property_id: Property ID (e.g. "ATT10035").
+            existing_only: Keep only rows whose image exists (needs an `exists` column).
+        """
+        groups = []
+        if score is not None:
+            groups.append(self.by_score.get(int(score), _EMPTY))
+        if dataset is not None:
+            groups.append(self.by_dataset.get(dataset, _EMPTY))
+        if property_id is not None:
+            groups.append(self.by_property.get(property_id, _EMPTY))
+
+        if not groups:
+            result = np.arange(len(self.df))
+        else:
+            result = groups[0]
+            for group in groups[1:]:
+                result = np.intersect1d(result, group, assume_unique=True)
+
+        if existing_only:
+            if self.exists is None:
+                raise ValueError("existing_only needs an 'exists' column; use DataLoader.add_file_info first")
+            result = result[self.exists[result]]
+        return result
+
+    def rows(self, **keys):
+        """Returns the frame rows matching positions(**keys)."""
+        return self.df.iloc[self.positions(**keys)]
+
+    def sample_stratified(self, n_per_score, scores=None, seed=None, **keys):
+        """
+        Samples up to `n_per_score` rows for every score (fewer if a score has fewer rows).
+
+        Args:
+            n_per_score: Rows to draw per score.
+            scores: Scores to include (defaults to all scores present).
+            seed: Random seed for reproducible samples.
+            **keys: Extra filters passed to positions() (dataset, existing_only, ...).
+
+        Returns:
+            DataFrame with the sampled rows, grouped by score.
+        """
+        rng = np.random.default_rng(seed)
+        picked = []
+        for score in scores if scores is not None else self.scores:
+            positions = self.positions(score=score, **keys)
+            if len(positions) > n_per_score:
+                positions = np.sort(rng.choice(positions, n_per_score, replace=False))
+            picked.append(positions)
+        return self.df.iloc[np.concatenate(picked) if picked else _EMPTY]
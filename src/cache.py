@@ -0,0 +1,472 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from src.config import Config
+
+# Digests of image files by (path, size, mtime), so each file is read and hashed once
+_digests = {}
+_digests_lock = threading.Lock()
+_DIGEST_MEMO_MAX = 100_000
+
+
+def _memo_key(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def _remember(memo_key, digest):
+    with _digests_lock:
+        if len(_digests) >= _DIGEST_MEMO_MAX:
+            _digests.clear()
+        _digests[memo_key] = digest
+
+
+def file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+
+    Memoized on the path, size and modification time, so the response cache key,
+    the payload cache key and repeated calls for the same image share one read.
+
+    Raises:
+        OSError: If the file can't be read.
+    """
+    memo_key = _memo_key(path)
+    with _digests_lock:
+        digest = _digests.get(memo_key)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    _remember(memo_key, digest)
+    return digest
+
+
+def digest_memo_entry(path):
+    """Returns (memo key, digest) if this process has hashed the file, else None."""
+    try:
+        memo_key = _memo_key(path)
+    except OSError:
+        return None
+    with _digests_lock:
+        digest = _digests.get(memo_key)
+    return (memo_key, digest) if digest is not None else None
+
+
+def remember_digest(entry):
+    """Adds an entry from digest_memo_entry() (e.g. made in a worker process) to this process's memo."""
+    _remember(*entry)
+
+
+def make_cache_key(image_path, prompt, provider_name, model_name, sampling_params=None):
+    """
+    Builds a content-addressed key for a provider call.
+
+    The key hashes the image bytes (not the path), the prompt text, the provider and
+    model names and the sampling parameters, so renamed or copied images still hit.
+
+    Returns:
+        str: Hex digest, or None if the image can't be read.
+    """
+    try:
+        image_digest = file_digest(image_path)
+    except OSError:
+        return None
+
+    h = hashlib.sha256()
+    for part in (
+        image_digest,
+        prompt,
+        provider_name or "",
+        model_name,
+        json.dumps(sampling_params or {}, sort_keys=True),
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# Connections a forked process inherited from its parent. They are never used or closed
+# in the child (either could touch the parent's locks and WAL); holding a reference
+# keeps them from being closed on garbage collection.
+_inherited_connections = []
+
+
+def _thread_connection(local):
+    """
+    Returns the calling thread's SQLite connection, or None if it has none yet.
+
+    A process forked with a connection open (e.g. StagedExecutor's prep workers) gets a
+    copy of it that must not be used, so a connection opened by another pid is dropped.
+    """
+    conn = getattr(local, "conn", None)
+    if conn is not None and local.pid != os.getpid():
+        _inherited_connections.append(conn)
+        local.conn = conn = None
+    return conn
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of raw VLM responses.
+
+    Each entry stores the raw response text, the token usage and the latency of the
+    original call. The database runs in WAL mode with a busy timeout, so several
+    threads and processes (e.g. a pipeline and a notebook) can share one file.
+    When the stored responses exceed `max_bytes`, the least recently used entries
+    are evicted.
+
+    Args:
+        path: SQLite file location (defaults to Config.CACHE_PATH).
+        max_bytes: Size cap for stored responses (defaults to Config.CACHE_MAX_BYTES).
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or Config.CACHE_PATH
+        self.max_bytes = Config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._local = threading.local()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                response TEXT NOT NULL,
+                usage TEXT,
+                latency REAL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)")
+        conn.commit()
+        # Running size of the stored entries; evict() rescans only once it passes max_bytes
+        self._size_lock = threading.Lock()
+        self._total = self._stored_bytes(conn)
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = _thread_connection(self._local)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """
+        Looks up a cached response.
+
+        Returns:
+            dict: {"response", "usage", "latency"} or None on a miss.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT response, usage, latency FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        return {
+            "response": row[0],
+            "usage": json.loads(row[1]) if row[1] else None,
+            "latency": row[2],
+        }
+
+    def put(self, key, response, provider=None, model=None, usage=None, latency=None):
+        """Stores a response and evicts least recently used entries if over the size cap."""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        conn = self._connect()
+        with conn:
+            previous = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, provider, model, response, usage, latency, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, json.dumps(usage) if usage else None,
+                 latency, size, now, now),
+            )
+        if self._grow(size - (previous[0] if previous else 0)):
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until the cache is within max_bytes."""
+        if not self.max_bytes:
+            return 0
+        conn = self._connect()
+        # Other processes may have written to the same file since the running total was set
+        total = self._stored_bytes(conn)
+        if total <= self.max_bytes:
+            with self._size_lock:
+                self._total = total
+            return 0
+
+        # Free a little more than needed so eviction doesn't run on every put
+        target = total - int(self.max_bytes * 0.9)
+        removed = 0
+        freed = 0
+        with conn:
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+            for key, size in rows:
+                if freed >= target:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                freed += size
+                removed += 1
+        with self._size_lock:
+            self._total = total - freed
+        return removed
+
+    def _stored_bytes(self, conn):
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _grow(self, change):
+        """Adds `change` bytes to the running total; returns True once it is over max_bytes."""
+        with self._size_lock:
+            self._total += change
+            return bool(self.max_bytes) and self._total > self.max_bytes
+
+    def stats(self):
+        """Returns the number of entries and total stored bytes."""
+        count, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        return {"entries": count, "bytes": total}
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM responses")
+        with self._size_lock:
+            self._total = 0
+
+
+def make_payload_key(image_digest, policy_params):
+    """
+    Builds the key of a preprocessed image payload.
+
+    Hashes the original image's digest (see file_digest) and the preprocessing
+    settings, so every provider with the same ImagePolicy shares one entry per image.
+
+    Returns:
+        str: Hex digest.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(image_digest.encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(policy_params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class PayloadCache:
+    """
+    On-disk cache of preprocessed (downscaled, re-encoded) image payloads.
+
+    Payloads are stored as raw JPEG files under `directory` (sharded by the first two
+    key characters); a small SQLite index next to them tracks sizes and last access
+    for LRU eviction once the files exceed `max_bytes`. Hits and misses of this
+    instance are counted for stats()/report().
+
+    Args:
+        directory: Cache location (defaults to Config.PAYLOAD_CACHE_DIR).
+        max_bytes: Size cap for stored payloads (defaults to Config.PAYLOAD_CACHE_MAX_BYTES).
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or Config.PAYLOAD_CACHE_DIR
+        self.max_bytes = Config.PAYLOAD_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS payloads (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_payloads_accessed ON payloads (accessed)")
+        conn.commit()
+        # Running size of the stored entries; evict() rescans only once it passes max_bytes
+        self._size_lock = threading.Lock()
+        self._total = self._stored_bytes(conn)
+
+    def _connect(self):
+        conn = _thread_connection(self._local)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), timeout=30)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".jpg")
+
+    def count(self, hit):
+        """Records a lookup; also used for lookups made in prefetch worker processes."""
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """Returns the cached payload bytes, or None on a miss."""
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            self.count(False)
+            return None
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO payloads (key, size, accessed) VALUES (?, ?, ?)",
+                (key, len(data), time.time()),
+            )
+        self.count(True)
+        return data
+
+    def put(self, key, data):
+        """Stores a payload and evicts least recently used entries if over the size cap."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        conn = self._connect()
+        with conn:
+            previous = conn.execute("SELECT size FROM payloads WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO payloads (key, size, accessed) VALUES (?, ?, ?)",
+                (key, len(data), time.time()),
+            )
+        if self._grow(len(data) - (previous[0] if previous else 0)):
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used payloads until the cache is within max_bytes."""
+        if not self.max_bytes:
+            return 0
+        conn = self._connect()
+        # Other processes may have written to the same file since the running total was set
+        total = self._stored_bytes(conn)
+        if total <= self.max_bytes:
+            with self._size_lock:
+                self._total = total
+            return 0
+
+        # Free a little more than needed so eviction doesn't run on every put
+        target = total - int(self.max_bytes * 0.9)
+        removed = 0
+        freed = 0
+        with conn:
+            rows = conn.execute("SELECT key, size FROM payloads ORDER BY accessed").fetchall()
+            for key, size in rows:
+                if freed >= target:
+                    break
+                conn.execute("DELETE FROM payloads WHERE key = ?", (key,))
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+                freed += size
+                removed += 1
+        with self._size_lock:
+            self._total = total - freed
+        return removed
+
+    def _stored_bytes(self, conn):
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM payloads").fetchone()[0]
+
+    def _grow(self, change):
+        """Adds `change` bytes to the running total; returns True once it is over max_bytes."""
+        with self._size_lock:
+            self._total += change
+            return bool(self.max_bytes) and self._total > self.max_bytes
+
+    def stats(self):
+        """Returns the number of entries, total stored bytes, and this instance's hits, misses and hit rate."""
+        count, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM payloads"
+        ).fetchone()
+        with self._counter_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {"entries": count, "bytes": total, "hits": hits, "misses": misses,
+                "hit_rate": hits / lookups if lookups else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        if not stats["hits"] and not stats["misses"]:
+            return
+        print(f"Payload cache: {stats['hit_rate']:.0%} hit rate ({stats['hits']} hits, "
+              f"{stats['misses']} misses), {stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            keys = [row[0] for row in conn.execute("SELECT key FROM payloads")]
+            conn.execute("DELETE FROM payloads")
+        with self._size_lock:
+            self._total = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+_default_payload_cache = None
+
+
+def get_response_cache():
+    """Returns the process-wide ResponseCache, or None when caching is disabled in Config."""
+    global _default_cache
+    if not Config.CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
+
+
+def get_payload_cache():
+    """Returns the process-wide PayloadCache, or None when it is disabled in Config."""
+    global _default_payload_cache
+    if not Config.PAYLOAD_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_payload_cache is None:
+            _default_payload_cache = PayloadCache()
+        return _default_payload_cache
@@ -27,6 +27,7 @@ class Config:
     
     PROMPTS_DIR = os.path.join("data", "prompts")
     OUTPUTS_DIR = os.path.join("data", "outputs")
+    CACHE_DIR = os.path.join("data", "cache")
 
     # API Keys
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -59,3 +60,69 @@ class Config:
     # Settings
     OLLAMA_BASE_URL = "http://localhost:11434"
 
+    # Concurrency - maximum number of in-flight analyze() calls per provider
+    # A local Ollama server usually serves one or two requests at a time; hosted APIs scale further
+    DEFAULT_CONCURRENCY = 4
+    PROVIDER_CONCURRENCY = {
+        "local": 2,
+        "openai": 16,
+        "google": 8,
+        "together": 8,
+    }
+
+    # Prefetching (StagedExecutor): processes that prepare images ahead of the provider calls
+    # (None = CPU count) and how many prepared images may wait for a free request slot
+    PREFETCH_WORKERS = None
+    PREFETCH_DEPTH = 32
+
+    # HTTP connection pooling (LocalVLM / TogetherVLM keep one keep-alive pool per instance)
+    # Timeouts are (connect, read) in seconds; local models can take minutes per image
+    HTTP_CONNECT_TIMEOUT = 10
+    HTTP_READ_TIMEOUT = {
+        "local": 600,
+        "together": 120,
+    }
+
+    # Retries - exponential backoff with jitter for 429s, 5xx and timeouts
+    RETRY_MAX_RETRIES = 5
+    RETRY_BASE_DELAY = 1.0  # seconds
+    RETRY_MAX_DELAY = 60.0  # seconds, per wait
+    RETRY_MAX_TOTAL_TIME = 300.0  # seconds spent on one call, including waits
+
+    # Client-side rate limits (requests and tokens per minute), per provider or "provider:model"
+    # Set these to your account tier; providers without an entry are not throttled
+    RATE_LIMITS = {
+        "openai": {"rpm": 500, "tpm": 30000},
+        "together": {"rpm": 600, "tpm": 180000},
+        "google": {"rpm": 60},
+    }
+    RATE_LIMIT_HEADROOM = 0.9  # use 90% of the limit to stay just below it
+
+    # Response cache - identical (image, prompt, model, sampling params) calls are answered from disk
+    # Set VLM_CACHE=0 to bypass it for a whole run
+    CACHE_ENABLED = os.getenv("VLM_CACHE", "1") != "0"
+    CACHE_PATH = os.path.join(CACHE_DIR, "responses.sqlite")
+    CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+    # Preprocessed image payloads, keyed by image content and ImagePolicy; set VLM_PAYLOAD_CACHE=0 to bypass
+    PAYLOAD_CACHE_ENABLED = os.getenv("VLM_PAYLOAD_CACHE", "1") != "0"
+    PAYLOAD_CACHE_DIR = os.path.join(CACHE_DIR, "payloads")
+    PAYLOAD_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+    # Content-hash manifest of the image corpus (python -m src.image_manifest); extension added by frame_store
+    IMAGE_MANIFEST_PATH = os.path.join(CACHE_DIR, "image_manifest")
+
+    # Near-duplicate detection (--dedup): max pHash/dHash Hamming distance of two shots treated as one image
+    DEDUP_MAX_DISTANCE = 6
+
+    # Image preprocessing before upload (src/image_prep.py), per provider; None sends the original file.
+    # max_edge in pixels, JPEG quality, PIL mode ("RGB" or "L") and max encoded size in bytes.
+    # OpenAI and Gemini downscale large images server-side anyway, so ~1024 px loses no detail.
+    IMAGE_POLICY_DEFAULT = {"max_edge": 1024, "quality": 85, "mode": "RGB", "max_bytes": 4 * 1024 * 1024}
+    IMAGE_POLICIES = {
+        "local": {"max_edge": 896, "quality": 85, "mode": "RGB", "max_bytes": 4 * 1024 * 1024},
+        "openai": {"max_edge": 1024, "quality": 85, "mode": "RGB", "max_bytes": 20 * 1024 * 1024},
+        "google": {"max_edge": 1024, "quality": 85, "mode": "RGB", "max_bytes": 20 * 1024 * 1024},
+        "together": {"max_edge": 1024, "quality": 85, "mode": "RGB", "max_bytes": 4 * 1024 * 1024},
+    }
+
@@ -1,9 +1,182 @@
 import os
+import json
+import hashlib
 import xml.etree.ElementTree as ET
 import pandas as pd
 from glob import glob
 import base64
+from concurrent.futures import ProcessPoolExecutor
 from src.config import Config
+from src.annotation_index import AnnotationIndex
+from src.frame_store import FRAME_EXT, HAS_PARQUET, read_frame, write_frame
+from src.image_prep import prepare_image
+
+# lxml's iterparse is faster and can drop processed elements; fall back to the stdlib parser
+try:
+    from lxml import etree as LXML_ET
+    HAS_LXML = True
+except ImportError:
+    LXML_ET = None
+    HAS_LXML = False
+
+ANNOTATION_COLUMNS = ["dataset", "image_id", "file_name", "image_path", "expert_score"]
+
+# Per-file parse cache kept next to the annotations
+ANNOTATION_CACHE_DIRNAME = ".annotation_cache"
+ANNOTATION_CACHE_VERSION = 1
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _image_row(image, dataset_name, images_dir):
+    """Builds the annotation row for one <image> element."""
+    image_id = image.get("id")
+    file_name = image.get("name")
+
+    # Construct full image path.
+    # Note: XML 'name' attribute might be like 'NHTyp1/ATT10035.jpg'
+    # We need to join this with images_dir.
+    # Handle both absolute and relative paths
+    if os.path.isabs(images_dir):
+        full_image_path = os.path.join(images_dir, file_name)
+    else:
+        # Relative to project root
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        full_image_path = os.path.join(base_dir, images_dir, file_name)
+
+    expert_score = None
+
+    # Extract expert score from boxes
+    # Look for a box with label="expert_score" and extract its score attribute
+    for box in image.findall("box"):
+        if box.get("label") == "expert_score":
+            # Score is stored in an attribute named "score"
+            for attr in box.findall("attribute"):
+                if attr.get("name") == "score":
+                    score_text = attr.text
+                    if score_text:
+                        try:
+                            expert_score = int(score_text.strip())
+                        except (ValueError, AttributeError):
+                            # If conversion fails, keep as string
+                            expert_score = score_text.strip()
+                    break
+            # Break out of outer loop once we found expert_score
+            if expert_score is not None:
+                break
+
+    return {
+        "dataset": dataset_name,
+        "image_id": image_id,
+        "file_name": file_name,
+        "image_path": full_image_path,
+        "expert_score": expert_score
+    }
+
+def iter_annotation_file(xml_file, images_dir):
+    """
+    Streams the rows of one CVAT XML file with iterparse, in constant memory.
+
+    Each <image> element is cleared (and detached from the tree) as soon as its row
+    has been built, so memory use doesn't grow with the file size. Uses lxml when
+    it is installed, otherwise xml.etree.ElementTree.
+
+    Yields:
+        dict: One row per <image> element.
+    """
+    dataset_name = os.path.basename(xml_file).replace(".xml", "")
+
+    if HAS_LXML:
+        for _, elem in LXML_ET.iterparse(xml_file, events=("end",), tag="image"):
+            yield _image_row(elem, dataset_name, images_dir)
+            elem.clear(keep_tail=True)
+            # Drop already processed siblings still referenced by the root
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return
+
+    root = None
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "end" and elem.tag == "image":
+            yield _image_row(elem, dataset_name, images_dir)
+            # Only the root is still open here, so every child it holds is processed
+            root.clear()
+
+def parse_annotation_file(xml_file, images_dir):
+    """
+    Parses one CVAT XML file into a list of row dicts.
+
+    Args:
+        xml_file: Path to the XML file.
+        images_dir: Root directory of the extracted images.
+
+    Returns:
+        list: One dict per <image> element.
+    """
+    return list(iter_annotation_file(xml_file, images_dir))
+
+def _chunked(rows, chunksize):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunksize:
+            yield pd.DataFrame(chunk, columns=ANNOTATION_COLUMNS)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=ANNOTATION_COLUMNS)
+
+def _with_text_scores(rows):
+    # Parquet columns must have one type, so store scores as text; ints round-trip via _from_cache_frame
+    for row in rows:
+        if row["expert_score"] is not None:
+            row["expert_score"] = str(row["expert_score"])
+        yield row
+
+def _to_cache_frame(xml_file, images_dir, chunksize=50000):
+    # Build the frame chunk by chunk so only `chunksize` row dicts are alive at once
+    rows = _with_text_scores(iter_annotation_file(xml_file, images_dir))
+    chunks = list(_chunked(rows, chunksize))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=ANNOTATION_COLUMNS)
+
+def _restore_score(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def _from_cache_frame(df):
+    # Rebuild from a list so dtype inference matches pd.DataFrame(rows) (e.g. ints + None -> float64)
+    scores = [_restore_score(v) for v in df["expert_score"].astype(object)]
+    df["expert_score"] = pd.Series(scores, index=df.index)
+    return df
+
+def scan_files(root):
+    """
+    Walks `root` iteratively with os.scandir; unreadable directories are skipped.
+
+    Yields:
+        os.DirEntry: One entry per regular file.
+    """
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry
 
 class DataLoader:
     def __init__(self, data_dir=None):
@@ -11,77 +184,316 @@ class DataLoader:
             data_dir = Config.DATA_DIR
         self.data_dir = data_dir
         self.annotations_dir = Config.ANNOTATIONS_DIR
-        self.images_dir = Config.RAW_IMAGES_DIR 
+        self.images_dir = Config.RAW_IMAGES_DIR
+        self.cache_dir = os.path.join(self.annotations_dir, ANNOTATION_CACHE_DIRNAME)
+        self._image_index = None
+        self._group_index = None
+
+    @property
+    def image_root(self):
+        """Absolute directory that annotation image paths are resolved against."""
+        if os.path.isabs(self.images_dir):
+            return self.images_dir
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return os.path.join(base_dir, self.images_dir)
+
+    def iter_annotations(self, chunksize=None):
+        """
+        Streams the annotations of every XML file without building full trees.
+
+        Args:
+            chunksize: If None, yield one row dict at a time. Otherwise yield
+                DataFrames of up to `chunksize` rows, so multi-GB annotation sets
+                can be processed in constant memory.
 
-    def load_annotations(self):
-        """Parses all XML files in the annotations directory."""
-        xml_files = glob(os.path.join(self.annotations_dir, "*.xml"))
-        data = []
+        Yields:
+            dict or DataFrame: Rows with dataset, image_id, file_name, image_path, expert_score.
+        """
+        xml_files = sorted(glob(os.path.join(self.annotations_dir, "*.xml")))
+        rows = (row for xml_file in xml_files for row in iter_annotation_file(xml_file, self.images_dir))
+        if chunksize is None:
+            yield from rows
+        else:
+            yield from _chunked(rows, chunksize)
+
+    def load_annotations(self, use_cache=True, workers=None, compact=False):
+        """
+        Parses all XML files in the annotations directory.
+
+        With use_cache=True, each file's parsed rows are stored in a columnar cache
+        (Parquet, or pickle without pyarrow) under annotation/.annotation_cache, keyed
+        by the file's size, mtime and SHA-256. Only new or changed XML files are
+        parsed again; unchanged ones are read straight from the cache.
+
+        Args:
+            use_cache: Set to False to always parse every XML file.
+            workers: Parse the XML files that need parsing in a pool of this many
+                processes (e.g. os.cpu_count()). None parses them serially.
+            compact: Return the memory-efficient typed frame (see compact_annotations).
+
+        Returns:
+            DataFrame with columns dataset, image_id, file_name, image_path, expert_score.
+        """
+        df = self._load_annotations(use_cache, workers)
+        return self.compact_annotations(df) if compact else df
+
+    def _load_annotations(self, use_cache, workers):
+        xml_files = sorted(glob(os.path.join(self.annotations_dir, "*.xml")))
+
+        if not use_cache:
+            if not workers or len(xml_files) < 2:
+                return pd.DataFrame(list(self.iter_annotations()))
+            frames = self._parse_files(xml_files, workers)
+            return _from_cache_frame(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame()
+
+        manifest = self._read_cache_manifest()
+        entries = manifest["files"]
+        frames = {}
+        to_parse = []
+        changed = False
 
         for xml_file in xml_files:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            
-            dataset_name = os.path.basename(xml_file).replace(".xml", "")
-
-            for image in root.findall("image"):
-                image_id = image.get("id")
-                file_name = image.get("name")
-                
-                # Construct full image path. 
-                # Note: XML 'name' attribute might be like 'NHTyp1/ATT10035.jpg'
-                # We need to join this with images_dir.
-                # Handle both absolute and relative paths
-                if os.path.isabs(self.images_dir):
-                    full_image_path = os.path.join(self.images_dir, file_name)
-                else:
-                    # Relative to project root
-                    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                    full_image_path = os.path.join(base_dir, self.images_dir, file_name)
-
-                expert_score = None
-                
-                # Extract expert score from boxes
-                # Look for a box with label="expert_score" and extract its score attribute
-                for box in image.findall("box"):
-                    if box.get("label") == "expert_score":
-                        # Score is stored in an attribute named "score"
-                        for attr in box.findall("attribute"):
-                            if attr.get("name") == "score":
-                                score_text = attr.text
-                                if score_text:
-                                    try:
-                                        expert_score = int(score_text.strip())
-                                    except (ValueError, AttributeError):
-                                        # If conversion fails, keep as string
-                                        expert_score = score_text.strip()
-                                break
-                        # Break out of outer loop once we found expert_score
-                        if expert_score is not None:
-                            break
-                
-                data.append({
-                    "dataset": dataset_name,
-                    "image_id": image_id,
-                    "file_name": file_name,
-                    "image_path": full_image_path,
-                    "expert_score": expert_score
-                })
-
-        return pd.DataFrame(data)
+            name = os.path.basename(xml_file)
+            stat = os.stat(xml_file)
+            entry = entries.get(name)
+            frame_path = os.path.join(self.cache_dir, name + FRAME_EXT)
+
+            fresh = (
+                entry is not None
+                and os.path.exists(frame_path)
+                and entry["size"] == stat.st_size
+                and entry["mtime_ns"] == stat.st_mtime_ns
+            )
+            if not fresh and entry is not None and os.path.exists(frame_path) and entry["size"] == stat.st_size:
+                # Touched but possibly unchanged (e.g. copied or re-exported): compare contents
+                sha256 = _file_sha256(xml_file)
+                if sha256 == entry["sha256"]:
+                    entry["mtime_ns"] = stat.st_mtime_ns
+                    fresh = changed = True
+
+            if fresh:
+                frames[xml_file] = read_frame(frame_path)
+            else:
+                to_parse.append(xml_file)
+
+        if to_parse:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for xml_file, frame in zip(to_parse, self._parse_files(to_parse, workers)):
+                name = os.path.basename(xml_file)
+                stat = os.stat(xml_file)
+                write_frame(frame, os.path.join(self.cache_dir, name + FRAME_EXT))
+                entries[name] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "sha256": _file_sha256(xml_file),
+                }
+                frames[xml_file] = frame
+            changed = True
+
+        # Forget files that were removed from the annotations directory
+        current = {os.path.basename(f) for f in xml_files}
+        for name in list(entries):
+            if name not in current:
+                del entries[name]
+                changed = True
+
+        if changed:
+            self._write_cache_manifest(manifest)
+
+        if not frames:
+            return pd.DataFrame()
+        return _from_cache_frame(pd.concat([frames[f] for f in xml_files], ignore_index=True))
+
+    def _parse_files(self, xml_files, workers=None):
+        """Parses XML files into cache frames, in a process pool when `workers` > 1. Keeps input order."""
+        for xml_file in xml_files:
+            print(f"Parsing annotations: {os.path.basename(xml_file)}")
+        if not workers or workers < 2 or len(xml_files) < 2:
+            return [_to_cache_frame(xml_file, self.images_dir) for xml_file in xml_files]
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(xml_files))) as pool:
+            return list(pool.map(_to_cache_frame, xml_files, [self.images_dir] * len(xml_files)))
+
+    def _read_cache_manifest(self):
+        manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        # Cached image paths are absolute, so they depend on where the project lives
+        image_root = self.image_root
+        empty = {"version": ANNOTATION_CACHE_VERSION, "image_root": image_root, "files": {}}
+        if not os.path.exists(manifest_path):
+            return empty
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return empty
+        if manifest.get("version") != ANNOTATION_CACHE_VERSION or manifest.get("image_root") != image_root:
+            return empty
+        return manifest
+
+    def _write_cache_manifest(self, manifest):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        tmp_path = f"{manifest_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def compact_annotations(self, df):
+        """
+        Converts an annotation frame to a compact typed schema.
+
+        - dataset becomes categorical
+        - expert_score becomes nullable Int8 (scores that aren't integers become <NA>)
+        - image_id becomes nullable Int32
+        - image_path is dropped; paths are rebuilt on demand from the shared root in
+          df.attrs["image_root"] plus the relative file_name (see image_paths())
+        - file_name uses Arrow-backed strings when pyarrow is installed
+
+        Measured at 1M rows (benchmarks/bench_compact_annotations.py): 334 MB with
+        object columns (pandas 2), 124 MB with pandas 3 string columns, 36 MB compact.
+        """
+        compact = pd.DataFrame(index=df.index)
+        compact["dataset"] = df["dataset"].astype("category")
+        compact["image_id"] = pd.to_numeric(df["image_id"], errors="coerce").astype("Int32")
+        compact["file_name"] = df["file_name"].astype("string[pyarrow]" if HAS_PARQUET else "string")
+
+        scores = pd.to_numeric(df["expert_score"], errors="coerce")
+        dropped = int((scores.isna() & df["expert_score"].notna()).sum())
+        if dropped:
+            print(f"Warning: {dropped} non-integer expert scores stored as <NA> in compact frame")
+        compact["expert_score"] = scores.astype("Int8")
+
+        compact.attrs["image_root"] = self.image_root
+        return compact
+
+    def build_indexes(self, df, refresh=False):
+        """
+        Returns the score/dataset/property-ID group index of an annotation frame.
+
+        The index of the most recent frame is cached, so repeated stratified picks
+        (few-shot exemplars, per-score evaluation sets) don't rescan the frame.
+        Pass refresh=True after modifying the frame in place.
+
+        Args:
+            df: Annotation frame (regular or compact, optionally with an exists column).
+            refresh: Rebuild even if an index is already cached for df.
+
+        Returns:
+            AnnotationIndex
+        """
+        cached = self._group_index
+        if cached is not None and cached.df is df and not refresh:
+            return cached
+
+        self._group_index = AnnotationIndex(df)
+        return self._group_index
+
+    def image_paths(self, df):
+        """Returns the absolute image paths of a (regular or compact) annotation frame."""
+        if "image_path" in df:
+            return df["image_path"]
+        root = df.attrs.get("image_root", self.image_root)
+        return (root + os.sep + df["file_name"].astype(object)).map(os.path.normpath)
+
+    def build_image_index(self, with_stat=True, refresh=False):
+        """
+        Lists every file under the images directory in one os.scandir walk.
+
+        The index replaces per-row os.path.exists calls, which take minutes on a
+        network filesystem with 100k images. It is built once per DataLoader and
+        reused until refresh=True.
+
+        Args:
+            with_stat: Also record size and mtime (one stat per file; skip it when
+                only existence is needed).
+            refresh: Rebuild even if an index is already cached.
+
+        Returns:
+            DataFrame indexed by normalized absolute path, with size and mtime columns
+            (NaN when with_stat=False).
+        """
+        cached = self._image_index
+        if cached is not None and not refresh and (cached[0] or not with_stat):
+            return cached[1]
+
+        paths, sizes, mtimes = [], [], []
+        for entry in scan_files(self.image_root):
+            paths.append(os.path.normpath(entry.path))
+            if with_stat:
+                st = entry.stat()
+                sizes.append(st.st_size)
+                mtimes.append(st.st_mtime)
+
+        index = pd.DataFrame(
+            {
+                "size": sizes if with_stat else float("nan"),
+                "mtime": pd.to_datetime(mtimes, unit="s") if with_stat else pd.NaT,
+            },
+            index=pd.Index(paths, name="image_path"),
+        )
+        self._image_index = (with_stat, index)
+        return index
+
+    def add_file_info(self, df, with_stat=True):
+        """
+        Adds exists, size and mtime columns to an annotation frame using the image index.
+
+        Args:
+            df: Frame with an image_path column (e.g. from load_annotations()).
+            with_stat: Include size and mtime (see build_image_index).
+
+        Returns:
+            A copy of df with the extra columns.
+        """
+        index = self.build_image_index(with_stat=with_stat)
+        keys = self.image_paths(df).map(os.path.normpath)
+        df = df.copy()
+        df["exists"] = keys.isin(index.index)
+        if with_stat:
+            df["size"] = keys.map(index["size"]).astype("Int64")
+            df["mtime"] = keys.map(index["mtime"])
+        return df
+
+    def missing_images(self, df):
+        """Returns the annotation rows whose image file is not on disk."""
+        index = self.build_image_index(with_stat=False)
+        return df[~self.image_paths(df).map(os.path.normpath).isin(index.index)]
+
+    def unannotated_images(self, df):
+        """Returns the image files on disk that no annotation row refers to."""
+        index = self.build_image_index(with_stat=False)
+        annotated = set(self.image_paths(df).map(os.path.normpath))
+        return [path for path in index.index if path not in annotated]
+
+    def report_image_coverage(self, df):
+        """Prints how many annotated images are missing and how many images have no annotation."""
+        missing = self.missing_images(df)
+        unannotated = self.unannotated_images(df)
+        print(f"Images: {len(df) - len(missing)}/{len(df)} annotated images found on disk")
+        if len(missing):
+            print(f"  {len(missing)} annotated but missing, e.g. {self.image_paths(missing).iloc[0]}")
+        if unannotated:
+            print(f"  {len(unannotated)} on disk without annotation, e.g. {unannotated[0]}")
+        return missing, unannotated
 
     @staticmethod
-    def encode_image(image_path):
-        """Encodes an image to base64."""
+    def encode_image(image_path, policy=None):
+        """
+        Encodes an image to base64.
+
+        Args:
+            image_path: Path to the image.
+            policy: Optional ImagePolicy (src/image_prep.py) to downscale and re-encode the
+                image first, e.g. ImagePolicy.for_provider("openai"); None encodes the file as is.
+        """
         if not os.path.exists(image_path):
             # Try fixing path if it's relative to the old 'Data' folder structure
             # e.g. if image_path is 'data/extractedimages/NHTyp1/img.jpg' but file is at
             # '/home/exouser/DSM.../Data/extractedimages/NHTyp1/img.jpg'
             # For now, we raise error or return None
             return None
-            
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+
+        return base64.b64encode(prepare_image(image_path, policy)).decode('utf-8')
 
 if __name__ == "__main__":
     # Test the loader
@@ -89,4 +501,3 @@ if __name__ == "__main__":
     df = loader.load_annotations()
     print(f"Loaded {len(df)} records.")
     print(df.head())
-
@@ -0,0 +1,229 @@
+import os
+import numpy as np
+from src.annotation_index import extract_property_id
+from src.config import Config
+
+try:
+    import PIL.Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+HASH_SIZE = 8  # 8x8 bits -> 64-bit hashes
+_PHASH_SAMPLE = 32  # pHash takes the low frequencies of a 32x32 DCT
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II basis, so the 2D transform is D @ x @ D.T
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    d[0] /= np.sqrt(2.0)
+    return d
+
+
+_DCT = _dct_matrix(_PHASH_SAMPLE)
+
+
+def dhash(img):
+    """Difference hash: 64 bits comparing horizontally adjacent pixels of a 9x8 grayscale thumbnail."""
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), PIL.Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(img):
+    """Perceptual hash: 64 bits comparing the low DCT frequencies of a 32x32 thumbnail to their median."""
+    small = img.convert("L").resize((_PHASH_SAMPLE, _PHASH_SAMPLE), PIL.Image.LANCZOS)
+    coeffs = _DCT @ np.asarray(small, dtype=np.float64) @ _DCT.T
+    low = coeffs[:HASH_SIZE, :HASH_SIZE]
+    # Leave the DC term (overall brightness) out of the median
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with Hamming distance.
+
+    A radius search only descends into children whose edge distance is within
+    `radius` of the query distance (triangle inequality), so small-radius lookups
+    visit a small fraction of the tree instead of comparing against every hash.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """Returns (distance, item) for every stored item within `radius` of value."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def cluster_near_duplicates(hashes, max_distance=None, group=extract_property_id):
+    """
+    Groups near-duplicate images.
+
+    Two images are linked when they belong to the same group (by default the same
+    property ID), their pHash distance is at most `max_distance` (found through a
+    BK-tree per group) and their dHash distance confirms it; clusters are the
+    connected components. Keeping links inside a property stops a chain of similar
+    shots from joining different houses, whose scores would then be copied across.
+    Images without hashes (unreadable) stay on their own.
+
+    Args:
+        hashes: Ordered mapping of image path -> (phash, dhash) or None.
+        max_distance: Hamming threshold (defaults to Config.DEDUP_MAX_DISTANCE).
+        group: Function of the image path; only images with equal values are linked.
+            None links across the whole corpus.
+
+    Returns:
+        dict: Representative path -> list of member paths (representative first).
+            The representative is the first member in `hashes` order.
+    """
+    if max_distance is None:
+        max_distance = Config.DEDUP_MAX_DISTANCE
+
+    paths = list(hashes)
+    parent = list(range(len(paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    trees = {}
+    for i, path in enumerate(paths):
+        value = hashes[path]
+        if value is None:
+            continue
+        tree = trees.setdefault(group(path) if group is not None else None, BKTree())
+        for _, j in tree.search(value[0], max_distance):
+            if hamming(value[1], hashes[paths[j]][1]) <= max_distance:
+                a, b = find(i), find(j)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+        tree.add(value[0], i)
+
+    clusters = {}
+    for i, path in enumerate(paths):
+        clusters.setdefault(paths[find(i)], []).append(path)
+    return clusters
+
+
+def image_hashes(image_paths, workers=None):
+    """
+    Returns {path: (phash, dhash) or None} for the given images.
+
+    Hashes are taken from the stored image manifest (python -m src.image_manifest)
+    when it has them; the remaining images are hashed here in a process pool and the
+    new hashes are written back to the manifest rows of those images.
+    """
+    import pandas as pd
+    from src.image_manifest import ImageManifest, describe_images
+
+    store = ImageManifest()
+    manifest = store.load()
+    known = {}
+    # Manifests built before hashes were added have no phash/dhash columns
+    if {"phash", "dhash"}.issubset(manifest.columns):
+        known = {
+            os.path.normpath(os.path.abspath(path)): (int(p), int(d))
+            for path, p, d in zip(manifest["image_path"], manifest["phash"], manifest["dhash"])
+            if not (pd.isna(p) or pd.isna(d))
+        }
+
+    keys = {path: os.path.normpath(os.path.abspath(path)) for path in image_paths}
+    missing = sorted({key for key in keys.values() if key not in known})
+    if missing and HAS_PIL:
+        computed = {}
+        for key, info in zip(missing, describe_images(missing, workers)):
+            if info["phash"] is not None:
+                computed[key] = (info["phash"], info["dhash"])
+        known.update(computed)
+        store.store_hashes(computed)
+    return {path: known.get(key) for path, key in keys.items()}
+
+
+class DuplicatePlan:
+    """
+    Which images of a run to send to the provider, and where to copy their results.
+
+    Args:
+        image_paths: Images of the run.
+        max_distance: Hamming threshold (defaults to Config.DEDUP_MAX_DISTANCE).
+        workers: Processes used to hash new images.
+    """
+
+    def __init__(self, image_paths, max_distance=None, workers=None):
+        self.image_paths = list(image_paths)
+        self.clusters = cluster_near_duplicates(image_hashes(image_paths, workers), max_distance)
+        self.representatives = list(self.clusters)
+        self.representative_of = {
+            member: rep for rep, members in self.clusters.items() for member in members
+        }
+
+    @property
+    def calls_saved(self):
+        return len(self.image_paths) - len(self.representatives)
+
+    def report(self):
+        grouped = sum(1 for members in self.clusters.values() if len(members) > 1)
+        print(f"Near-duplicates: {len(self.image_paths)} images in {len(self.clusters)} clusters "
+              f"({grouped} with duplicates); {self.calls_saved} provider calls saved")
+
+    def expand(self, results, key="image_path"):
+        """
+        Copies each representative's result row to the other members of its cluster.
+
+        Args:
+            results: Result rows (dicts) of the representatives.
+
+        Returns:
+            list: One row per image, in run order; copied rows carry duplicate_of = representative path.
+        """
+        by_rep = {row[key]: row for row in results}
+        expanded = []
+        for path in self.image_paths:
+            rep = self.representative_of[path]
+            row = by_rep.get(rep)
+            if row is None:
+                continue
+            expanded.append(row if path == rep else {**row, key: path, "duplicate_of": rep})
+        return expanded
@@ -0,0 +1,312 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from src.config import Config
+
+# One semaphore per provider, shared by every executor in the process, so that two
+# pipelines (or notebook cells) running side by side never exceed the provider limit.
+_provider_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+def get_provider_limit(provider_name):
+    """Returns the maximum number of in-flight calls allowed for a provider."""
+    return Config.PROVIDER_CONCURRENCY.get(provider_name, Config.DEFAULT_CONCURRENCY)
+
+
+def get_provider_semaphore(provider_name):
+    with _semaphores_lock:
+        if provider_name not in _provider_semaphores:
+            _provider_semaphores[provider_name] = threading.BoundedSemaphore(
+                get_provider_limit(provider_name)
+            )
+        return _provider_semaphores[provider_name]
+
+
+async def _acquire_async(semaphore, poll=0.01):
+    """Acquires a threading semaphore from a coroutine without blocking the event loop."""
+    # Polled rather than waited for in a thread, so a cancelled task can't end up holding it
+    while not semaphore.acquire(blocking=False):
+        await asyncio.sleep(poll)
+
+
+class BatchExecutor:
+    """
+    Runs per-image work (typically wrapping BaseVLM.analyze) on a bounded thread pool.
+
+    Results are returned in the same order as the input items. Progress is printed
+    every `progress_every` completed items together with the throughput in images/sec.
+
+    Example (pipelines or notebooks):
+        executor = BatchExecutor("openai", concurrency=8)
+        results = executor.map(lambda path: provider.analyze(path, prompt), image_paths)
+    """
+
+    def __init__(self, provider_name, concurrency=None, progress_every=10):
+        limit = get_provider_limit(provider_name)
+        if concurrency is None:
+            concurrency = limit
+        self.provider_name = provider_name
+        self.concurrency = max(1, min(int(concurrency), limit))
+        self.progress_every = progress_every
+        self._semaphore = get_provider_semaphore(provider_name)
+
+    def _run_one(self, fn, item):
+        with self._semaphore:
+            return fn(item)
+
+    def map(self, fn, items, on_result=None):
+        """
+        Applies `fn` to every item concurrently.
+
+        On Ctrl-C, queued items are cancelled, requests already in flight are allowed
+        to finish (and reach `on_result`), then KeyboardInterrupt is re-raised.
+
+        Args:
+            fn: Callable taking one item and returning a result.
+            items: Iterable of inputs (e.g. image paths).
+            on_result: Optional callable invoked with each result as soon as it is
+                ready (e.g. RunJournal.append). Called from worker threads.
+
+        Returns:
+            list: Results in input order.
+        """
+        items = list(items)
+        total = len(items)
+        results = [None] * total
+        if total == 0:
+            return results
+
+        start = time.monotonic()
+        completed = 0
+        lock = threading.Lock()
+
+        def task(index, item):
+            nonlocal completed
+            results[index] = self._run_one(fn, item)
+            if on_result is not None:
+                on_result(results[index])
+            with lock:
+                completed += 1
+                done = completed
+            if self.progress_every and (done % self.progress_every == 0 or done == total):
+                elapsed = time.monotonic() - start
+                rate = done / elapsed if elapsed > 0 else 0.0
+                print(f"Progress: {done}/{total} ({done/total*100:.1f}%) - {rate:.2f} images/sec")
+
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = [pool.submit(task, i, item) for i, item in enumerate(items)]
+            for future in futures:
+                # Re-raise worker exceptions in the caller
+                future.result()
+        except KeyboardInterrupt:
+            print("\nInterrupted - finishing in-flight requests (Ctrl-C again to abort)...")
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            pool.shutdown(wait=True)
+
+        return results
+
+    async def map_async(self, fn, items):
+        """
+        Async counterpart of map() for coroutine functions such as BaseVLM.analyze_async.
+
+        All calls run on the current event loop; at most `concurrency` are in flight at
+        once, without one thread per request. Calls also hold the provider's shared
+        semaphore, so sync and async runs side by side stay within the provider limit.
+
+        Args:
+            fn: Async callable taking one item and returning a result.
+            items: Iterable of inputs (e.g. image paths).
+
+        Returns:
+            list: Results in input order.
+        """
+        items = list(items)
+        total = len(items)
+        if total == 0:
+            return []
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.monotonic()
+        completed = 0
+
+        async def task(item):
+            nonlocal completed
+            async with semaphore:
+                await _acquire_async(self._semaphore)
+                try:
+                    result = await fn(item)
+                finally:
+                    self._semaphore.release()
+            completed += 1
+            if self.progress_every and (completed % self.progress_every == 0 or completed == total):
+                elapsed = time.monotonic() - start
+                rate = completed / elapsed if elapsed > 0 else 0.0
+                print(f"Progress: {completed}/{total} ({completed/total*100:.1f}%) - {rate:.2f} images/sec")
+            return result
+
+        return await asyncio.gather(*(task(item) for item in items))
+
+
+def _timed_call(fn, item):
+    # Runs in a prep worker process; exceptions come back as values so one bad image doesn't stop the stage
+    start = time.perf_counter()
+    try:
+        result, error = fn(item), None
+    except Exception as e:
+        result, error = None, e
+    return time.perf_counter() - start, result, error
+
+
+class StagedExecutor(BatchExecutor):
+    """
+    BatchExecutor with a CPU stage in front of the provider calls.
+
+    Stage 1 runs `prepare` (e.g. decode + resize + encode an image) in a process pool.
+    At most `prefetch` prepared results wait in a bounded window, so memory stays flat
+    however many items there are; new items are only submitted to the pool as the I/O
+    stage takes prepared ones. Stage 2 runs `fn` on a thread pool limited by the provider
+    concurrency, so image preparation for the next items overlaps the network waits of
+    the current ones. report() prints how busy each stage was.
+
+    Example:
+        executor = StagedExecutor("openai", concurrency=8)
+        results = executor.map(lambda path: provider.analyze(path, prompt), image_paths,
+                               prepare=provider.payload_loader(), with_prepared=provider.prefetched)
+        executor.report()
+    """
+
+    def __init__(self, provider_name, concurrency=None, progress_every=10, prep_workers=None, prefetch=None):
+        super().__init__(provider_name, concurrency=concurrency, progress_every=progress_every)
+        self.prep_workers = max(1, prep_workers or Config.PREFETCH_WORKERS or os.cpu_count() or 1)
+        self.prefetch = max(1, prefetch or Config.PREFETCH_DEPTH)
+        self.stats = None
+
+    def map(self, fn, items, on_result=None, prepare=None, with_prepared=None):
+        """
+        Applies `fn` to every item, with `prepare` run ahead of it in a process pool.
+
+        Args:
+            fn: Callable taking one item and returning a result (runs in a thread).
+            items: Iterable of inputs (e.g. image paths).
+            on_result: Optional callable invoked with each result as soon as it is ready.
+            prepare: Picklable callable taking one item, run in the process pool. Without
+                it this behaves like BatchExecutor.map.
+            with_prepared: Callable (item, prepared) returning a context manager that
+                `fn(item)` runs in, e.g. BaseVLM.prefetched. Not called for items whose
+                prepare step raised; `fn` then does the work itself.
+
+        Returns:
+            list: Results in input order.
+        """
+        if prepare is None:
+            return super().map(fn, items, on_result=on_result)
+
+        items = list(items)
+        total = len(items)
+        results = [None] * total
+        if total == 0:
+            return results
+
+        start = time.monotonic()
+        completed = 0
+        lock = threading.Lock()
+        stats = {"prep_busy": 0.0, "io_busy": 0.0, "wait_prep": 0.0, "wait_io": 0.0}
+        # Free I/O slots; the producer blocks on it, which is what bounds the prepared window
+        io_slots = threading.BoundedSemaphore(self.concurrency)
+
+        def task(index, item, prepared):
+            nonlocal completed
+            try:
+                task_start = time.perf_counter()
+                if prepared is not None and with_prepared is not None:
+                    with with_prepared(item, prepared):
+                        results[index] = self._run_one(fn, item)
+                else:
+                    results[index] = self._run_one(fn, item)
+                elapsed = time.perf_counter() - task_start
+                if on_result is not None:
+                    on_result(results[index])
+                with lock:
+                    stats["io_busy"] += elapsed
+                    completed += 1
+                    done = completed
+                if self.progress_every and (done % self.progress_every == 0 or done == total):
+                    elapsed = time.monotonic() - start
+                    rate = done / elapsed if elapsed > 0 else 0.0
+                    print(f"Progress: {done}/{total} ({done/total*100:.1f}%) - {rate:.2f} images/sec")
+            finally:
+                io_slots.release()
+
+        stats["prep_workers"] = min(self.prep_workers, total)
+        prep_pool = ProcessPoolExecutor(max_workers=stats["prep_workers"])
+        io_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        timed_prepare = partial(_timed_call, prepare)
+        window = deque()
+        futures = []
+        next_index = 0
+        try:
+            while next_index < total or window:
+                # Keep the prepared window full
+                while next_index < total and len(window) < self.prefetch:
+                    window.append((next_index, prep_pool.submit(timed_prepare, items[next_index])))
+                    next_index += 1
+
+                index, prep_future = window.popleft()
+                wait_start = time.perf_counter()
+                prep_time, prepared, error = prep_future.result()
+                stats["wait_prep"] += time.perf_counter() - wait_start
+                stats["prep_busy"] += prep_time
+                if error is not None:
+                    prepared = None
+
+                wait_start = time.perf_counter()
+                io_slots.acquire()
+                stats["wait_io"] += time.perf_counter() - wait_start
+                futures.append(io_pool.submit(task, index, items[index], prepared))
+
+            for future in futures:
+                # Re-raise worker exceptions in the caller
+                future.result()
+        except KeyboardInterrupt:
+            print("\nInterrupted - finishing in-flight requests (Ctrl-C again to abort)...")
+            prep_pool.shutdown(wait=False, cancel_futures=True)
+            io_pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            prep_pool.shutdown(wait=True, cancel_futures=True)
+            io_pool.shutdown(wait=True)
+
+        stats["wall"] = time.monotonic() - start
+        self.stats = stats
+        return results
+
+    def report(self):
+        """Prints per-stage utilization of the last map() call."""
+        stats = self.stats
+        if not stats or stats["wall"] <= 0:
+            return
+        prep_util = stats["prep_busy"] / (stats["prep_workers"] * stats["wall"])
+        io_util = stats["io_busy"] / (self.concurrency * stats["wall"])
+        print(f"Stages: prep {stats['prep_workers']} procs {prep_util:.0%} busy, "
+              f"I/O {self.concurrency} threads {io_util:.0%} busy; "
+              f"waited {stats['wait_prep']:.1f}s for prep, {stats['wait_io']:.1f}s for an I/O slot")
+
+
+def run_batch(fn, items, provider_name, concurrency=None, progress_every=10, on_result=None):
+    """Convenience wrapper around BatchExecutor.map."""
+    executor = BatchExecutor(provider_name, concurrency=concurrency, progress_every=progress_every)
+    return executor.map(fn, items, on_result=on_result)
+
+
+async def run_batch_async(fn, items, provider_name, concurrency=None, progress_every=10):
+    """Convenience wrapper around BatchExecutor.map_async."""
+    executor = BatchExecutor(provider_name, concurrency=concurrency, progress_every=progress_every)
+    return await executor.map_async(fn, items)
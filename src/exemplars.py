@@ -0,0 +1,57 @@
+import base64
+import hashlib
+import math
+from collections import namedtuple
+from src.rate_limit import CHARS_PER_TOKEN, estimate_image_tokens
+
+Exemplar = namedtuple("Exemplar", ["image_path", "caption", "data", "base64"])
+
+
+class ExemplarBank:
+    """
+    Few-shot exemplar images, encoded once and shared by every request of a run.
+
+    Each exemplar is prepared with the provider's ImagePolicy and base64-encoded when
+    the bank is built. The provider then turns the bank into an immutable prefix in its
+    own request format (BaseVLM._build_exemplar_prefix); every call reuses that prefix
+    and only adds the prompt and the target image.
+
+    Example:
+        bank = ExemplarBank(provider, [(path, "Expert score 1"), ...], header=rubric)
+        provider.analyze(target_path, "Now score this image.", exemplars=bank)
+
+    Args:
+        provider: BaseVLM instance the bank is built for.
+        examples: Iterable of (image_path, caption) pairs, in the order shown to the model.
+        header: Text sent before the first exemplar (e.g. the scoring rubric).
+    """
+
+    def __init__(self, provider, examples, header=""):
+        self.provider_name = provider.provider_name
+        self.header = header
+
+        items = []
+        original_bytes = 0
+        h = hashlib.sha256()
+        h.update(header.encode("utf-8"))
+        for image_path, caption in examples:
+            original_size, data = provider.load_image(image_path)
+            original_bytes += original_size
+            items.append(Exemplar(image_path, caption, data, base64.b64encode(data).decode("utf-8")))
+            h.update(b"\0")
+            h.update(hashlib.sha256(data).digest())
+            h.update((caption or "").encode("utf-8"))
+        self.items = tuple(items)
+
+        # Identifies the exemplar set in response cache keys
+        self.fingerprint = h.hexdigest()
+        self.original_bytes = original_bytes
+        self.payload_bytes = sum(len(item.data) for item in self.items)
+        text = header + "".join(item.caption or "" for item in self.items)
+        self.tokens = math.ceil(len(text) / CHARS_PER_TOKEN) + sum(
+            estimate_image_tokens(item.image_path) for item in self.items
+        )
+        self.prefix = provider._build_exemplar_prefix(self)
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,28 @@
+import os
+import pandas as pd
+
+# Columnar on-disk storage for cached DataFrames. Parquet needs pyarrow (or
+# fastparquet); without it frames are pickled so caching still works.
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+FRAME_EXT = ".parquet" if HAS_PARQUET else ".pkl"
+
+
+def write_frame(df, path):
+    """Writes a DataFrame atomically (temp file + rename) so readers never see a partial file."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    if path.endswith(".parquet"):
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_frame(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
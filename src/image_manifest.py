@@ -0,0 +1,256 @@
+import io
+import os
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from src.config import Config
+from src.dedup import dhash, phash
+from src.data_loader import DataLoader, scan_files
+from src.frame_store import FRAME_EXT, read_frame, write_frame
+
+# xxHash is several times faster than SHA-256 on large files; BLAKE2b is the stdlib fallback
+try:
+    import xxhash
+    HASH_ALGO = "xxh3_128"
+except ImportError:
+    xxhash = None
+    HASH_ALGO = "blake2b_128"
+
+try:
+    import PIL.Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+MANIFEST_COLUMNS = ["file_name", "size", "mtime_ns", "hash_algo", "content_hash",
+                    "width", "height", "format", "decodes", "error", "phash", "dhash"]
+
+
+def content_hash(data):
+    """Returns the hex content hash of a bytes object (see HASH_ALGO)."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def describe_image(image_path):
+    """
+    Hashes one image and reads its dimensions.
+
+    The file is read once; width, height and format come from the image header.
+    The pixel data is then decoded for the perceptual hashes (pHash/dHash, see
+    src/dedup.py), which also flags truncated or corrupt files that still have a
+    valid header.
+
+    Args:
+        image_path: Path to the image.
+
+    Returns:
+        dict: content_hash, width, height, format, decodes, error (None when the image
+            is fine), phash and dhash (None if the image doesn't decode).
+    """
+    row = {"content_hash": None, "width": None, "height": None, "format": None,
+           "decodes": None, "error": None, "phash": None, "dhash": None}
+    try:
+        with open(image_path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+        row["decodes"] = False
+        return row
+
+    row["content_hash"] = content_hash(data)
+    if not HAS_PIL:
+        return row
+
+    try:
+        with PIL.Image.open(io.BytesIO(data)) as img:
+            row["width"], row["height"] = img.size
+            row["format"] = img.format
+            img.load()
+            row["phash"] = phash(img)
+            row["dhash"] = dhash(img)
+            row["decodes"] = True
+    except Exception as e:
+        row["decodes"] = False
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def describe_images(paths, workers=None):
+    """Runs describe_image over `paths` in a process pool of `workers` (default: CPU count). Keeps order."""
+    workers = workers or os.cpu_count() or 1
+    if workers < 2 or len(paths) < 2:
+        return [describe_image(path) for path in paths]
+    # Large chunks keep inter-process overhead small next to the hashing work
+    chunksize = max(1, min(256, len(paths) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(describe_image, paths, chunksize=chunksize))
+
+
+class ImageManifest:
+    """
+    Content-hash manifest of every image under the images directory.
+
+    One row per image with its relative file_name, byte size, mtime, content hash,
+    pixel dimensions and whether it decodes cleanly. The manifest is stored with
+    frame_store (Parquet, or pickle without pyarrow) and updated incrementally:
+    files whose size and mtime are unchanged keep their row, and only new or
+    changed files are hashed again.
+
+    Args:
+        image_root: Directory to index (defaults to the DataLoader image root).
+        path: Manifest file without extension (defaults to Config.IMAGE_MANIFEST_PATH).
+    """
+
+    def __init__(self, image_root=None, path=None):
+        self.image_root = image_root or DataLoader().image_root
+        self.path = (path or Config.IMAGE_MANIFEST_PATH) + FRAME_EXT
+
+    def load(self):
+        """Returns the stored manifest (empty if it doesn't exist yet), with an image_path column."""
+        if os.path.exists(self.path):
+            manifest = read_frame(self.path)
+        else:
+            manifest = pd.DataFrame(columns=MANIFEST_COLUMNS)
+        return self._with_image_paths(manifest)
+
+    def build(self, workers=None):
+        """
+        Scans the images directory and hashes new or changed files.
+
+        Args:
+            workers: Size of the process pool (defaults to os.cpu_count()); 1 hashes serially.
+
+        Returns:
+            DataFrame: The updated manifest.
+        """
+        files = {}
+        for entry in scan_files(self.image_root):
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                st = entry.stat()
+                rel = os.path.relpath(entry.path, self.image_root).replace(os.sep, "/")
+                files[rel] = (entry.path, st.st_size, st.st_mtime_ns)
+
+        previous = self.load()
+        if not set(MANIFEST_COLUMNS).issubset(previous.columns):
+            # Written by an older version without some columns: describe every file again
+            previous = previous.iloc[0:0].reindex(columns=MANIFEST_COLUMNS + ["image_path"])
+        kept = previous[
+            previous["file_name"].isin(files)
+            & (previous["hash_algo"] == HASH_ALGO)
+        ]
+        if len(kept):
+            current = pd.DataFrame(
+                [(files[name][1], files[name][2]) for name in kept["file_name"]],
+                columns=["size", "mtime_ns"], index=kept.index,
+            )
+            kept = kept[(kept["size"] == current["size"]) & (kept["mtime_ns"] == current["mtime_ns"])]
+        known = set(kept["file_name"])
+        todo = sorted(name for name in files if name not in known)
+
+        removed = len(previous) - len(previous[previous["file_name"].isin(files)])
+        print(f"Image manifest: {len(files)} images, {len(known)} unchanged, "
+              f"{len(todo)} to hash, {removed} removed")
+
+        rows = []
+        if todo:
+            paths = [files[name][0] for name in todo]
+            described = describe_images(paths, workers)
+            for name, info in zip(todo, described):
+                _, size, mtime_ns = files[name]
+                rows.append({"file_name": name, "size": size, "mtime_ns": mtime_ns,
+                             "hash_algo": HASH_ALGO, **info})
+
+        if not todo and not removed and len(previous) == len(kept):
+            return previous
+
+        manifest = pd.concat(
+            [kept[MANIFEST_COLUMNS], pd.DataFrame(rows, columns=MANIFEST_COLUMNS)],
+            ignore_index=True,
+        ).sort_values("file_name", ignore_index=True)
+        manifest = manifest.astype({"size": "int64", "mtime_ns": "int64",
+                                    "width": "Int32", "height": "Int32", "decodes": "boolean",
+                                    "phash": "UInt64", "dhash": "UInt64"})
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_frame(manifest, self.path)
+        return self._with_image_paths(manifest)
+
+    def store_hashes(self, hashes):
+        """
+        Writes perceptual hashes into the stored manifest.
+
+        Adds the phash/dhash columns to a manifest saved without them. Images that have
+        no manifest row are skipped; build() adds them with their hashes.
+
+        Args:
+            hashes: {image path: (phash, dhash)}.
+
+        Returns:
+            int: Number of rows updated.
+        """
+        if not hashes or not os.path.exists(self.path):
+            return 0
+        manifest = read_frame(self.path)
+        for column in ("phash", "dhash"):
+            if column not in manifest.columns:
+                manifest[column] = pd.Series(pd.NA, index=manifest.index, dtype="UInt64")
+        keys = [os.path.normpath(os.path.abspath(path)) for path in self._with_image_paths(manifest)["image_path"]]
+        rows = [(i, hashes[key]) for i, key in zip(manifest.index, keys) if key in hashes]
+        if not rows:
+            return 0
+        index = [i for i, _ in rows]
+        manifest.loc[index, "phash"] = [value[0] for _, value in rows]
+        manifest.loc[index, "dhash"] = [value[1] for _, value in rows]
+        manifest = manifest.astype({"phash": "UInt64", "dhash": "UInt64"})
+        write_frame(manifest, self.path)
+        return len(rows)
+
+    def _with_image_paths(self, manifest):
+        manifest = manifest.copy()
+        manifest["image_path"] = [
+            os.path.normpath(os.path.join(self.image_root, name)) for name in manifest["file_name"]
+        ]
+        return manifest
+
+    def join(self, df, manifest=None):
+        """
+        Adds the manifest columns to an annotation frame (e.g. from load_annotations()).
+
+        Rows are matched on the normalized absolute image path, so regular and compact
+        frames both work. Annotated images missing from the manifest get <NA> values.
+
+        Args:
+            df: Annotation frame.
+            manifest: Manifest to join (defaults to the stored one).
+
+        Returns:
+            A copy of df with size, content_hash, width, height, format, decodes and error columns.
+        """
+        if manifest is None:
+            manifest = self.load()
+        columns = ["size", "content_hash", "width", "height", "format", "decodes", "error"]
+        info = manifest.set_index("image_path")[columns]
+        keys = DataLoader().image_paths(df).map(os.path.normpath)
+        joined = info.reindex(keys.to_numpy())
+        joined.index = df.index
+        joined["size"] = joined["size"].astype("Int64")
+        return pd.concat([df.drop(columns=[c for c in columns if c in df]), joined], axis=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the content-hash manifest of the image corpus.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes used for hashing (default: number of CPUs)")
+    args = parser.parse_args()
+
+    manifest = ImageManifest().build(workers=args.workers)
+    print(f"Manifest: {len(manifest)} images, "
+          f"{int(manifest['decodes'].eq(False).sum())} failed to decode, "
+          f"{int(manifest['content_hash'].duplicated().sum())} exact duplicates")
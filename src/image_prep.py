@@ -0,0 +1,186 @@
+import io
+import os
+import math
+import threading
+from src.config import Config
+from src.cache import digest_memo_entry, file_digest, get_payload_cache, make_payload_key
+
+try:
+    import PIL.Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale (DCT domain) to at least this many times the
+# target size. 1.0 takes the smallest DCT scale that still covers the target (4032x3024 ->
+# 2016x1512 for a 1024 edge); at 2.0 a phone photo would need 2048 and get no reduction
+DRAFT_REDUCING_GAP = 1.0
+
+# Re-encoding steps tried, in order, when an image is over its policy's max_bytes
+_MIN_QUALITY = 40
+_QUALITY_STEP = 10
+_EDGE_STEP = 0.75
+
+
+class ImagePolicy:
+    """
+    How an image is prepared before it is uploaded to a provider.
+
+    Args:
+        max_edge: Longest side in pixels; larger images are downscaled (None keeps the size).
+        quality: JPEG quality used when the image is re-encoded.
+        mode: PIL mode the image is converted to before encoding (e.g. "RGB", "L").
+        max_bytes: Upper bound for the encoded image; quality and then size are
+            reduced until it fits (None for no limit).
+    """
+
+    def __init__(self, max_edge=None, quality=85, mode="RGB", max_bytes=None):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.mode = mode
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def for_provider(cls, provider_name):
+        """Returns the policy configured for a provider, or None to upload original files."""
+        if provider_name in Config.IMAGE_POLICIES:
+            settings = Config.IMAGE_POLICIES[provider_name]
+        else:
+            settings = Config.IMAGE_POLICY_DEFAULT
+        if settings is None:
+            return None
+        return cls(**settings)
+
+    def as_dict(self):
+        """Settings that change the uploaded image; part of the response cache key."""
+        return {"max_edge": self.max_edge, "quality": self.quality,
+                "mode": self.mode, "max_bytes": self.max_bytes}
+
+
+def _encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def prepare_image(image_path, policy=None, draft=True):
+    """
+    Reads an image and applies `policy` to it.
+
+    The original bytes are returned unchanged when there is no policy, when Pillow
+    isn't installed, or when the file is already a JPEG in the right mode that
+    needs no downscaling and fits max_bytes, so no quality is lost to re-encoding.
+
+    Large JPEGs are decoded with Image.draft at the smallest DCT scale that is still at
+    least DRAFT_REDUCING_GAP times the target size, which skips most of the decoding
+    work, before the final LANCZOS resize.
+
+    Args:
+        image_path: Path to the image.
+        policy: ImagePolicy, or None to send the file as is.
+        draft: Use JPEG draft-mode decoding when downscaling (False decodes every pixel).
+
+    Returns:
+        bytes: The image data to upload.
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+    return prepare_image_data(data, policy, draft)
+
+
+def prepare_image_data(data, policy=None, draft=True):
+    """prepare_image() for image bytes already in memory."""
+    if policy is None or not HAS_PIL:
+        return data
+
+    with PIL.Image.open(io.BytesIO(data)) as img:
+        fits = (
+            (policy.max_edge is None or max(img.size) <= policy.max_edge)
+            and (policy.max_bytes is None or len(data) <= policy.max_bytes)
+        )
+        if fits and img.format == "JPEG" and img.mode == policy.mode:
+            return data
+
+        if draft and img.format == "JPEG" and policy.max_edge and max(img.size) > policy.max_edge:
+            # Must happen before anything loads the pixels (convert() does)
+            scale = DRAFT_REDUCING_GAP * policy.max_edge / max(img.size)
+            img.draft(policy.mode, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        if img.mode != policy.mode:
+            img = img.convert(policy.mode)
+        if policy.max_edge and max(img.size) > policy.max_edge:
+            # reducing_gap=None: draft (or not) was decided above
+            img.thumbnail((policy.max_edge, policy.max_edge), PIL.Image.LANCZOS, reducing_gap=None)
+
+        quality = policy.quality
+        encoded = _encode_jpeg(img, quality)
+        while policy.max_bytes is not None and len(encoded) > policy.max_bytes:
+            if quality - _QUALITY_STEP >= _MIN_QUALITY:
+                quality -= _QUALITY_STEP
+            else:
+                width, height = img.size
+                if max(width, height) <= 64:
+                    break
+                img = img.resize((max(1, int(width * _EDGE_STEP)), max(1, int(height * _EDGE_STEP))),
+                                 PIL.Image.LANCZOS)
+            encoded = _encode_jpeg(img, quality)
+        return encoded
+
+
+def load_payload(image_path, policy=None, cache=None):
+    """
+    Reads an image and applies `policy`, going through a PayloadCache when given.
+
+    Returns:
+        tuple: (size of the original file in bytes, image bytes to upload,
+            True/False for a cache hit/miss or None without a cache)
+    """
+    if policy is None or cache is None:
+        with open(image_path, "rb") as f:
+            original = f.read()
+        return len(original), prepare_image_data(original, policy), None
+    # Keyed by the memoized file digest, so a hit doesn't read the image again
+    key = make_payload_key(file_digest(image_path), policy.as_dict())
+    data = cache.get(key)
+    if data is not None:
+        return os.path.getsize(image_path), data, True
+    with open(image_path, "rb") as f:
+        original = f.read()
+    data = prepare_image_data(original, policy)
+    cache.put(key, data)
+    return len(original), data, False
+
+
+def prefetch_payload(image_path, policy=None, use_cache=True):
+    """
+    load_payload() for StagedExecutor worker processes, which open their own PayloadCache.
+
+    The image's file digest is returned as well (see cache.digest_memo_entry), so the
+    parent can build its response cache key without hashing the file again.
+    """
+    payload = load_payload(image_path, policy, get_payload_cache() if use_cache else None)
+    return (*payload, digest_memo_entry(image_path))
+
+
+class UploadStats:
+    """Thread-safe totals of the images a provider instance has uploaded."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+
+    def add(self, original_bytes, sent_bytes, images=1):
+        with self._lock:
+            self.images += images
+            self.original_bytes += original_bytes
+            self.sent_bytes += sent_bytes
+
+    def report(self, label="Uploads"):
+        with self._lock:
+            images, original, sent = self.images, self.original_bytes, self.sent_bytes
+        if not images:
+            return
+        saved = 1 - sent / original if original else 0.0
+        print(f"{label}: {images} images, {sent / 1e6:.1f} MB sent "
+              f"({original / 1e6:.1f} MB original, {saved:.0%} saved)")
@@ -0,0 +1,95 @@
+import json
+import math
+import os
+import threading
+
+
+def is_failed(record):
+    """True if a result row errored (API error, empty response, parse failure, ...)."""
+    error = record.get("error")
+    if error is None:
+        return False
+    # Rows that went through a DataFrame may carry NaN instead of None
+    return not (isinstance(error, float) and math.isnan(error))
+
+
+class RunJournal:
+    """
+    Append-only JSONL journal of per-image results for crash-safe pipeline runs.
+
+    Every record is written as one line and flushed to disk (fsync) as soon as the
+    image finishes, so a crash or Ctrl-C loses at most the requests still in flight.
+    Records are keyed by `key` (the image path); when an image appears more than
+    once, e.g. after --retry-failed, the latest record wins.
+
+    Args:
+        path: Location of the .jsonl file.
+        key: Record field identifying an image.
+        fresh: Truncate an existing journal instead of continuing it.
+    """
+
+    def __init__(self, path, key="image_path", fresh=False):
+        self.path = path
+        self.key = key
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._records = {} if fresh else self._read()
+        self._file = open(path, "w" if fresh else "a", encoding="utf-8")
+
+    def _read(self):
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a truncated last line
+                    continue
+                records[record.get(self.key)] = record
+        return records
+
+    def append(self, record):
+        """Writes one result row and flushes it to disk. Thread-safe."""
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._records[record.get(self.key)] = record
+
+    def pending(self, items, retry_failed=False):
+        """
+        Filters a list of image paths down to the ones that still need work.
+
+        Args:
+            items: Image paths for this run.
+            retry_failed: Only return images whose journaled result errored.
+                Otherwise return images that are not in the journal yet (resume).
+        """
+        if retry_failed:
+            return [item for item in items
+                    if item in self._records and is_failed(self._records[item])]
+        return [item for item in items if item not in self._records]
+
+    def results(self, items=None):
+        """Returns the latest record per image, in `items` order (or journal order)."""
+        if items is None:
+            return list(self._records.values())
+        return [self._records[item] for item in items if item in self._records]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,434 @@
+import json
+import math
+import re
+from collections import namedtuple
+
+# orjson parses the typical response several times faster; json is the fallback
+try:
+    import orjson
+    _loads = orjson.loads
+    HAS_ORJSON = True
+except ImportError:
+    orjson = None
+    _loads = json.loads
+    HAS_ORJSON = False
+
+# ValueError covers json.JSONDecodeError and orjson.JSONDecodeError
+_DECODE_ERRORS = (ValueError, TypeError)
+
+MIN_SCORE, MAX_SCORE = 1, 5
+
+# Keys holding the overall score in JSON responses, in order of preference
+SCORE_KEYS = ("score", "overall_score", "dsm_score", "overall_dsm_score")
+
+ParseResult = namedtuple("ParseResult", ["score", "subscores", "method", "confidence", "data", "repairs"],
+                         defaults=[()])
+ParseResult.__doc__ = """
+Result of parse_response().
+
+    score: Overall score 1-5, or None.
+    subscores: Category -> score from a JSON "subscores" object ({} if none).
+    method: How the score (or the JSON) was found; see METHOD_CONFIDENCE, "none" if nothing.
+    confidence: 0-1, how reliable that method is.
+    data: The parsed JSON object, or None if the response held no JSON object.
+    repairs: Fixes repair_json() applied to get `data`, e.g. ("closed_string",
+        "dropped_fields=1", "closed_brackets=2"); () when the JSON was intact.
+"""
+
+# How far each extraction method can be trusted
+METHOD_CONFIDENCE = {
+    "json": 1.0,           # the whole response is a JSON object
+    "json_fenced": 1.0,    # a ```json ... ``` block
+    "json_embedded": 0.9,  # a JSON object inside other text
+    "json_repaired": 0.9,  # malformed or truncated JSON, recovered without losing a field
+    "json_partial": 0.75,  # truncated JSON, recovered by dropping the incomplete trailing field(s)
+    "json_leading": 0.95,  # '{"score": 3, ...' seen while streaming, before the object is complete
+    "overall_label": 0.85,  # "OVERALL DSM SCORE: 3"
+    "label": 0.7,          # "Score: 3", '"score": 3' in broken JSON, "Rating: 3"
+    "category": 0.6,       # "3 - IN-BETWEEN"
+    "out_of": 0.5,         # "3/5", "3 out of 5"
+    "bare_digit": 0.2,     # a lone 1-5 anywhere (opt-in)
+    "none": 0.0,
+}
+
+_FENCED_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+# Label, optional markdown bold/quotes, ":" or "=", then the digit
+_OVERALL_RE = re.compile(
+    r"(?:overall[\s_]+(?:dsm[\s_]+)?score|dsm[\s_]+score)\W{0,4}?\s*[:=]\s*\**\s*([1-5])\b",
+    re.IGNORECASE,
+)
+_LABEL_RE = re.compile(
+    r"(?:\bscore|\brating)[\"'*]*\s*[:=]\s*\**\s*[\"']?([1-5])\b",
+    re.IGNORECASE,
+)
+_CATEGORY_RE = re.compile(
+    r"\b([1-5])\s*[-–—:]\s*(?:very\s+healthy|healthy|in[\s-]between|slipping|unhealthy)",
+    re.IGNORECASE,
+)
+_OUT_OF_RE = re.compile(r"\b([1-5])\s*(?:/\s*5|out\s+of\s+5)\b", re.IGNORECASE)
+_BARE_DIGIT_RE = re.compile(r"\b([1-5])\b")
+# A JSON response whose first key is the overall score (optionally fenced)
+_JSON_LEADING_RE = re.compile(
+    r"\s*(?:```(?:json|JSON)?\s*)?\{\s*\"(?:score|overall_score|dsm_score|overall_dsm_score)\"\s*:\s*\"?([1-5])\b"
+)
+
+# Text patterns, in order of preference
+_TEXT_PATTERNS = (
+    ("overall_label", _OVERALL_RE),
+    ("label", _LABEL_RE),
+    ("category", _CATEGORY_RE),
+    ("out_of", _OUT_OF_RE),
+)
+
+_decoder = json.JSONDecoder()
+
+
+def _as_number(value):
+    """Returns value as a float, or None (accepts 3, 3.7, "3.7", {"score": 3.7})."""
+    if isinstance(value, dict):
+        value = value.get("score")
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _as_score(value):
+    """Returns value rounded to an int score in range (3.7 -> 4, half up), or None."""
+    number = _as_number(value)
+    if number is None:
+        return None
+    score = math.floor(number + 0.5)
+    return score if MIN_SCORE <= score <= MAX_SCORE else None
+
+
+def parse_json(text, required=()):
+    """
+    Finds the JSON object in a model response.
+
+    Tries the whole response, then a fenced ``` block, then the first object in the
+    text. If that one is truncated or malformed it is recovered with repair_json(),
+    provided it has the `required` keys. Objects nested inside the broken one are
+    never taken for it; only objects after its end are tried.
+
+    Returns:
+        tuple: (dict, method, repairs) or (None, None, ()) if there is no JSON object.
+    """
+    data, method, repairs, _ = _find_json(text, required)
+    return data, method, repairs
+
+
+def _find_json(text, required=()):
+    """parse_json(), plus the (start, end) span of the first object if it failed to decode."""
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        try:
+            data = _loads(stripped)
+            if isinstance(data, dict):
+                return data, "json", (), None
+        except _DECODE_ERRORS:
+            pass
+
+    if "```" in text:
+        match = _FENCED_RE.search(text)
+        if match:
+            try:
+                data = _loads(match.group(1).strip())
+                if isinstance(data, dict):
+                    return data, "json_fenced", (), None
+            except _DECODE_ERRORS:
+                pass
+
+    start = text.find("{")
+    if start == -1:
+        return None, None, (), None
+    try:
+        data, _ = _decoder.raw_decode(text, start)
+        if isinstance(data, dict):
+            return data, "json_embedded", (), None
+    except ValueError:
+        pass
+
+    broken = (start, _object_end(text, start))
+    data, repairs = repair_json(text)
+    if data is not None and all(key in data for key in required):
+        dropped = any(repair.startswith("dropped_fields") for repair in repairs)
+        return data, "json_partial" if dropped else "json_repaired", repairs, broken
+
+    # Only after the broken object: before its end, "{" opens one of its nested objects
+    start = text.find("{", broken[1])
+    while start != -1:
+        try:
+            data, _ = _decoder.raw_decode(text, start)
+            if isinstance(data, dict):
+                return data, "json_embedded", (), broken
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None, None, (), broken
+
+
+def _object_end(text, start):
+    """Index just past the bracket closing the object at `start`, or len(text) if it never closes."""
+    depth = 0
+    in_string = escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(text)
+
+
+def _scan_json(text):
+    """
+    Walks a possibly truncated JSON object, dropping trailing commas on the way.
+
+    Returns:
+        tuple: (chars kept, open brackets, whether it ends inside a string,
+                cut points as (length, open brackets) before each field, trailing commas dropped,
+                whether the object was closed)
+    """
+    out = []
+    stack = []
+    cuts = []
+    in_string = escape = False
+    trailing_commas = 0
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch in "}]":
+            end = len(out) - 1
+            while end >= 0 and out[end].isspace():
+                end -= 1
+            if end >= 0 and out[end] == ",":
+                del out[end]
+                trailing_commas += 1
+            if not stack or stack[-1] != ("{" if ch == "}" else "["):
+                break
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                return out, stack, False, cuts, trailing_commas, True
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == ",":
+            cuts.append((len(out), tuple(stack)))
+        out.append(ch)
+        if ch in "{[":
+            stack.append(ch)
+            cuts.append((len(out), tuple(stack)))
+    return out, stack, in_string, cuts, trailing_commas, False
+
+
+def _closers(stack):
+    return "".join("}" if bracket == "{" else "]" for bracket in reversed(stack))
+
+
+def repair_json(text):
+    """
+    Recovers the JSON object from a truncated or slightly malformed response.
+
+    Skips fences and any text before the first "{", drops trailing commas, closes an
+    unterminated string and the open brackets. If that doesn't parse (the response was
+    cut off mid-field), the incomplete trailing fields are dropped one at a time.
+
+    Returns:
+        tuple: (dict, repairs) with the names of the fixes applied (see ParseResult),
+        or (None, ()) if no non-empty object could be recovered.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None, ()
+    out, stack, in_string, cuts, trailing_commas, closed = _scan_json(text[start:])
+
+    repairs = []
+    if text[:start].strip():
+        repairs.append("preamble")
+    if not closed and not in_string:
+        # Cut off right after a comma: '[1, 2,'
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ",":
+            out.pop()
+            trailing_commas += 1
+            cuts = [cut for cut in cuts if cut[0] < len(out)]
+    if trailing_commas:
+        repairs.append("trailing_commas")
+    body = "".join(out)
+    if in_string:
+        body += '"'
+        repairs.append("closed_string")
+
+    candidates = [(body, stack, 0)]
+    if not closed:
+        # Back off to the end of the last complete field, then the one before, ...
+        candidates += [("".join(out[:length]), cut_stack, dropped)
+                       for dropped, (length, cut_stack) in enumerate(reversed(cuts), 1)]
+    for candidate, open_brackets, dropped in candidates:
+        try:
+            data = _loads(candidate + _closers(open_brackets))
+        except _DECODE_ERRORS:
+            continue
+        if not isinstance(data, dict) or not data:
+            return None, ()
+        if dropped:
+            if in_string:
+                repairs.remove("closed_string")
+            repairs.append(f"dropped_fields={dropped}")
+        if open_brackets:
+            repairs.append(f"closed_brackets={len(open_brackets)}")
+        return data, tuple(repairs)
+    return None, ()
+
+
+def extract_subscores(data, raw=False):
+    """
+    Returns category -> score from the "subscores" object of a parsed response.
+
+    Scores are rounded to ints in range (as ParseResult.subscores); with raw=True they
+    are the numbers as given (3.7 stays 3.7, out-of-range values are kept), e.g. for
+    regression features.
+    """
+    subscores = {}
+    if not isinstance(data, dict) or not isinstance(data.get("subscores"), dict):
+        return subscores
+    convert = _as_number if raw else _as_score
+    for category, value in data["subscores"].items():
+        score = convert(value)
+        if score is not None:
+            subscores[category] = score
+    return subscores
+
+
+def parse_response(text, bare_digits=False, required=()):
+    """
+    Extracts the score, subscores and JSON payload from a model response.
+
+    JSON is preferred; a truncated or malformed object is recovered with repair_json()
+    as long as it still has the `required` keys. When there is no JSON (or it has no
+    score) the text patterns are tried in order of reliability. They skip the text of
+    a broken object, so a subscore in a response cut off before its "score" key isn't
+    reported as the overall score; the score is None then.
+
+    Args:
+        text: Raw response text.
+        bare_digits: Fall back to the first lone digit 1-5 in the text.
+        required: Keys a repaired object must contain to be used (e.g. ("score",)).
+
+    Returns:
+        ParseResult
+    """
+    if not text:
+        return ParseResult(None, {}, "none", 0.0, None)
+
+    data, method, repairs, broken = _find_json(text, required)
+
+    if data is not None:
+        subscores = extract_subscores(data)
+        for key in SCORE_KEYS:
+            score = _as_score(data.get(key))
+            if score is not None:
+                return ParseResult(score, subscores, method, METHOD_CONFIDENCE[method], data, repairs)
+    else:
+        subscores = {}
+
+    if broken is not None:
+        text = text[:broken[0]] + text[broken[1]:]
+    patterns = _TEXT_PATTERNS + ((("bare_digit", _BARE_DIGIT_RE),) if bare_digits else ())
+    for name, pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return ParseResult(int(match.group(1)), subscores, name, METHOD_CONFIDENCE[name], data, repairs)
+
+    if data is not None:
+        # JSON without a usable score (e.g. the quality-check schema)
+        return ParseResult(None, subscores, method, METHOD_CONFIDENCE[method], data, repairs)
+    return ParseResult(None, {}, "none", 0.0, None)
+
+
+def extract_score(text, bare_digits=False):
+    """Shortcut for parse_response(text).score."""
+    return parse_response(text, bare_digits=bare_digits).score
+
+
+class ScoreStream:
+    """
+    Finds the overall score in a response while it is being streamed.
+
+    Only the forms a prompt puts first are accepted ("OVERALL DSM SCORE: 3", or JSON
+    whose first key is the score), so a subscore earlier in the text can't be taken for
+    it. A match is only accepted once the next character has arrived ("3" could still
+    become "30"), and each feed() rescans just the new text plus a short overlap.
+
+    Example:
+        stream = ScoreStream()
+        for chunk in chunks:
+            if stream.feed(chunk) is not None:
+                break  # stream.score, stream.method
+    """
+
+    # Longest stretch of an accepted pattern that can precede a chunk boundary
+    OVERLAP = 64
+
+    def __init__(self):
+        self.text = ""
+        self.score = None
+        self.method = None
+        self._scanned = 0
+
+    def feed(self, chunk):
+        """Adds a chunk of text; returns the score once it is known, else None."""
+        self.text += chunk
+        if self.score is not None:
+            return self.score
+
+        text = self.text
+        if self._scanned < self.OVERLAP:
+            match = _JSON_LEADING_RE.match(text)
+            if match and match.end() < len(text):
+                return self._found(match, "json_leading")
+        match = _OVERALL_RE.search(text, max(0, self._scanned - self.OVERLAP))
+        if match and match.end() < len(text):
+            return self._found(match, "overall_label")
+        self._scanned = len(text)
+        return None
+
+    def finish(self):
+        """Call when the stream has ended: a score right at the end of the text counts too."""
+        if self.score is None:
+            match = _JSON_LEADING_RE.match(self.text)
+            if match:
+                return self._found(match, "json_leading")
+            match = _OVERALL_RE.search(self.text, max(0, self._scanned - self.OVERLAP))
+            if match:
+                return self._found(match, "overall_label")
+        return self.score
+
+    def _found(self, match, method):
+        self.score = int(match.group(1))
+        self.method = method
+        return self.score
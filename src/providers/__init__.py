@@ -1,18 +1,79 @@
-from src.providers.local import LocalVLM
-from src.providers.openai import OpenAIVLM
-from src.providers.google import GoogleVLM
-from src.providers.together import TogetherVLM
-from src.config import Config
+import importlib
+from importlib.metadata import entry_points
 
-def get_provider(provider_name):
-    if provider_name == "local":
-        return LocalVLM()
-    elif provider_name == "openai":
-        return OpenAIVLM()
-    elif provider_name == "google":
-        return GoogleVLM()
-    elif provider_name == "together":
-        return TogetherVLM()
-    else:
+# Provider name -> "module:ClassName". Modules are imported the first time the provider
+# is requested, so a run that only uses Ollama never loads the openai/google SDKs.
+_REGISTRY = {
+    "local": "src.providers.local:LocalVLM",
+    "openai": "src.providers.openai:OpenAIVLM",
+    "google": "src.providers.google:GoogleVLM",
+    "together": "src.providers.together:TogetherVLM",
+}
+
+# Third-party packages add providers by declaring an entry point in this group, e.g.
+#   [project.entry-points."dsm_vlm.providers"]
+#   myvlm = "my_package.vlm:MyVLM"
+ENTRY_POINT_GROUP = "dsm_vlm.providers"
+
+_loaded = {}
+_entry_points_loaded = False
+
+# Kept importable as `from src.providers import LocalVLM`; resolved lazily by __getattr__
+_CLASS_NAMES = {target.split(":")[1]: name for name, target in _REGISTRY.items()}
+
+
+def register_provider(name, target):
+    """
+    Registers a provider under `name`.
+
+    Args:
+        name: Name passed to get_provider().
+        target: A BaseVLM subclass, or a "module:ClassName" string imported on first use.
+    """
+    _REGISTRY[name] = target
+    _loaded.pop(name, None)
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        # Built-in providers take precedence over plugins with the same name
+        _REGISTRY.setdefault(ep.name, ep.value)
+
+
+def available_providers():
+    """Returns the names of all built-in and entry-point providers (without importing them)."""
+    _load_entry_points()
+    return sorted(_REGISTRY)
+
+
+def get_provider_class(provider_name):
+    """Returns the class registered as `provider_name`, importing its module if needed."""
+    cls = _loaded.get(provider_name)
+    if cls is not None:
+        return cls
+    if provider_name not in _REGISTRY:
+        _load_entry_points()
+    target = _REGISTRY.get(provider_name)
+    if target is None:
         raise ValueError(f"Unknown provider: {provider_name}")
+    if isinstance(target, str):
+        module_name, _, class_name = target.partition(":")
+        cls = getattr(importlib.import_module(module_name), class_name)
+    else:
+        cls = target
+    _loaded[provider_name] = cls
+    return cls
+
+
+def get_provider(provider_name):
+    return get_provider_class(provider_name)()
+
 
+def __getattr__(name):
+    if name in _CLASS_NAMES:
+        return get_provider_class(_CLASS_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
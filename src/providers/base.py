@@ -1,20 +1,543 @@
+import asyncio
+import base64
+import os
+import time
+import threading
+import contextlib
+import contextvars
+from functools import partial
 from abc import ABC, abstractmethod
+from src.providers.retry import RetryPolicy, describe_error
+from src.rate_limit import get_rate_limiter, estimate_tokens
+from src.cache import get_payload_cache, get_response_cache, make_cache_key, remember_digest
+from src.image_prep import ImagePolicy, UploadStats, load_payload, prefetch_payload
+from src.parsing import ScoreStream
+
+# Per-call bookkeeping (retries, final error, usage, cache hits). A ContextVar keeps it separate for
+# every worker thread and every asyncio task calling the same provider instance.
+_call_info = contextvars.ContextVar("vlm_call_info", default=None)
+
+
+async def _anext(stream):
+    # anext(stream, None) for Python < 3.10
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
 
 class BaseVLM(ABC):
-    def __init__(self, model_name):
+    # Name used by get_provider() and as the key for per-provider Config settings
+    provider_name = None
+    # Human-readable provider name used in log messages
+    display_name = "VLM"
+    # Completion budget per request (counted against tokens-per-minute limits)
+    max_output_tokens = 0
+
+    def __init__(self, model_name, retry_policy=None):
         self.model_name = model_name
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Shared across all instances with the same provider and model (None = unthrottled)
+        self.rate_limiter = get_rate_limiter(self.provider_name, model_name)
+        # Persistent response cache shared by all providers; set to None to bypass it
+        self.cache = get_response_cache()
+        # Skip cache lookups but still store responses, replacing stale entries
+        self.cache_refresh = False
+        # Async clients are bound to the event loop they were created on
+        self._async_clients = {}
+        # Downscale/re-encode settings applied to every uploaded image (None = original files)
+        self.image_policy = ImagePolicy.for_provider(self.provider_name)
+        self.upload_stats = UploadStats()
+        # Prepared payloads shared across runs and providers; set to None to re-encode every time
+        self.payload_cache = get_payload_cache()
+        # Payloads prepared ahead of time by a StagedExecutor, by image path (see prefetched())
+        self._prefetched = {}
+        self._prefetched_lock = threading.Lock()
+
+    @property
+    def sampling_params(self):
+        """Generation settings that change the output; part of the response cache key."""
+        return {}
 
     @abstractmethod
-    def analyze(self, image_path, prompt):
+    def _request(self, image_path, prompt, exemplars=None):
+        """
+        Performs a single request to the provider.
+
+        Implementations raise on failure; analyze() decides whether to retry.
+        `exemplars` (an ExemplarBank) is only passed when the caller gave one; its
+        prefix goes before the prompt and the target image.
+
+        Returns:
+            str: The raw text response from the model.
+        """
+        pass
+
+    async def _request_async(self, image_path, prompt, exemplars=None):
+        """
+        Async version of _request().
+
+        Providers override this with a native async client. The default runs the
+        blocking _request() in a worker thread so every provider can be awaited.
+        """
+        return await asyncio.to_thread(self._request, image_path, prompt, **self._exemplar_kwargs(exemplars))
+
+    def _stream_request(self, image_path, prompt, exemplars=None):
+        """
+        Streaming version of _request(): yields the response text as it is generated.
+
+        Closing the generator must abandon the request so the provider stops generating.
+        Providers without a streaming API keep this default, which yields the complete
+        response as a single chunk.
+        """
+        yield self._request(image_path, prompt, **self._exemplar_kwargs(exemplars))
+
+    async def _stream_request_async(self, image_path, prompt, exemplars=None):
+        """Async version of _stream_request()."""
+        yield await self._request_async(image_path, prompt, **self._exemplar_kwargs(exemplars))
+
+    def analyze(self, image_path, prompt, exemplars=None, stop_at_score=False):
         """
         Sends an image and prompt to the VLM.
-        
+
+        Retryable errors (429, 5xx, timeouts) are retried according to
+        self.retry_policy; details of the call are available from last_call_info().
+
         Args:
             image_path (str): Path to the image file.
             prompt (str): The text prompt.
-            
+            exemplars (ExemplarBank): Optional few-shot images sent before the prompt.
+            stop_at_score (bool): Stream the response and cancel it as soon as the overall
+                score has been generated (see analyze_stream()). The text returned then
+                ends shortly after the score.
+
         Returns:
-            str: The raw text response from the model.
+            str: The raw text response from the model, or None if the call failed.
         """
-        pass
+        if stop_at_score:
+            text = "".join(self.analyze_stream(image_path, prompt, exemplars, stop_at_score=True))
+            return None if _call_info.get()["error"] else text
+
+        info = self._start_call()
+        cache_key = self._cache_key(image_path, prompt, exemplars)
+        cached = self._cache_lookup(info, cache_key)
+        if cached is not None:
+            return cached
+
+        tokens = self._estimate_tokens(image_path, prompt, exemplars)
+        kwargs = self._exemplar_kwargs(exemplars)
+        start = time.monotonic()
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(tokens)
+            attempt_start = time.monotonic()
+            try:
+                response = self._request(image_path, prompt, **kwargs)
+            except Exception as e:
+                delay = self._handle_error(info, e, time.monotonic() - start)
+                if delay is None:
+                    return None
+                time.sleep(delay)
+                continue
+            self._settle_tokens(info, tokens)
+            self._cache_store(info, cache_key, response, time.monotonic() - attempt_start)
+            return response
+
+    async def analyze_async(self, image_path, prompt, exemplars=None, stop_at_score=False):
+        """
+        Async version of analyze(), with the same retry behaviour.
+
+        Returns:
+            str: The raw text response from the model, or None if the call failed.
+        """
+        if stop_at_score:
+            chunks = [chunk async for chunk in self.analyze_stream_async(image_path, prompt, exemplars, True)]
+            return None if _call_info.get()["error"] else "".join(chunks)
+
+        info = self._start_call()
+        # Hashing the image reads the whole file; keep it off the event loop
+        cache_key = await asyncio.to_thread(self._cache_key, image_path, prompt, exemplars)
+        cached = self._cache_lookup(info, cache_key)
+        if cached is not None:
+            return cached
+
+        tokens = self._estimate_tokens(image_path, prompt, exemplars)
+        kwargs = self._exemplar_kwargs(exemplars)
+        start = time.monotonic()
+        while True:
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async(tokens)
+            attempt_start = time.monotonic()
+            try:
+                response = await self._request_async(image_path, prompt, **kwargs)
+            except Exception as e:
+                delay = self._handle_error(info, e, time.monotonic() - start)
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+                continue
+            self._settle_tokens(info, tokens)
+            self._cache_store(info, cache_key, response, time.monotonic() - attempt_start)
+            return response
+
+    def analyze_stream(self, image_path, prompt, exemplars=None, stop_at_score=False):
+        """
+        Streams the response to an image and prompt, yielding text chunks as they arrive.
+
+        last_call_info()["score"] is set as soon as the overall score has appeared in the
+        stream (see src.parsing.ScoreStream), before the chunk holding it is yielded. With
+        stop_at_score the request is cancelled right there, which saves the time and output
+        tokens of the justification; the provider usually hasn't reported usage by then.
+        Breaking out of the loop cancels the request as well.
+
+        Errors before the first chunk are retried as in analyze(). A failure after that
+        ends the stream and is recorded in last_call_info()["error"].
+
+        Args:
+            image_path (str): Path to the image file.
+            prompt (str): The text prompt.
+            exemplars (ExemplarBank): Optional few-shot images sent before the prompt.
+            stop_at_score (bool): Cancel the request once the score is known.
+
+        Yields:
+            str: Chunks of the response text.
+        """
+        info = self._start_call()
+        cache_key = self._cache_key(image_path, prompt, exemplars, stop_at_score)
+        cached = self._stream_cache_lookup(info, cache_key, image_path, prompt, exemplars, stop_at_score)
+        if cached is not None:
+            yield cached
+            return
+
+        tokens = self._estimate_tokens(image_path, prompt, exemplars)
+        kwargs = self._exemplar_kwargs(exemplars)
+        start = time.monotonic()
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(tokens)
+            attempt_start = time.monotonic()
+            stream = self._stream_request(image_path, prompt, **kwargs)
+            try:
+                chunk = next(stream, None)
+            except Exception as e:
+                stream.close()
+                delay = self._handle_error(info, e, time.monotonic() - start)
+                if delay is None:
+                    return
+                time.sleep(delay)
+                continue
+            break
+
+        scores = ScoreStream()
+        try:
+            while chunk is not None:
+                stop = self._stream_chunk(info, scores, chunk, attempt_start, stop_at_score)
+                yield chunk
+                if stop:
+                    break
+                chunk = next(stream, None)
+        except Exception as e:
+            self._stream_failed(info, e)
+            return
+        finally:
+            stream.close()
+        self._settle_tokens(info, tokens)
+        self._stream_done(info, scores, attempt_start, image_path, prompt, exemplars)
+
+    async def analyze_stream_async(self, image_path, prompt, exemplars=None, stop_at_score=False):
+        """Async version of analyze_stream(), an async generator of text chunks."""
+        info = self._start_call()
+        cache_key = await asyncio.to_thread(self._cache_key, image_path, prompt, exemplars, stop_at_score)
+        cached = self._stream_cache_lookup(info, cache_key, image_path, prompt, exemplars, stop_at_score)
+        if cached is not None:
+            yield cached
+            return
+
+        tokens = self._estimate_tokens(image_path, prompt, exemplars)
+        kwargs = self._exemplar_kwargs(exemplars)
+        start = time.monotonic()
+        while True:
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async(tokens)
+            attempt_start = time.monotonic()
+            stream = self._stream_request_async(image_path, prompt, **kwargs)
+            try:
+                chunk = await _anext(stream)
+            except Exception as e:
+                await stream.aclose()
+                delay = self._handle_error(info, e, time.monotonic() - start)
+                if delay is None:
+                    return
+                await asyncio.sleep(delay)
+                continue
+            break
+
+        scores = ScoreStream()
+        try:
+            while chunk is not None:
+                stop = self._stream_chunk(info, scores, chunk, attempt_start, stop_at_score)
+                yield chunk
+                if stop:
+                    break
+                chunk = await _anext(stream)
+        except Exception as e:
+            self._stream_failed(info, e)
+            return
+        finally:
+            await stream.aclose()
+        self._settle_tokens(info, tokens)
+        self._stream_done(info, scores, attempt_start, image_path, prompt, exemplars)
+
+    @staticmethod
+    def last_call_info():
+        """
+        Returns details of the most recent analyze() call made by the current thread/task.
+
+        Returns:
+            dict: {"retries": int, "error": str or None, "cached": bool,
+                   "usage": dict or None, "latency": float or None,
+                   "score": int or None, "score_latency": float or None, "stopped_early": bool}
+            The last three are only filled in by streamed calls (analyze_stream() and
+            analyze(..., stop_at_score=True)).
+        """
+        info = _call_info.get()
+        if info is None:
+            return BaseVLM._new_call_info()
+        return dict(info)
+
+    @staticmethod
+    def _record_usage(prompt_tokens=None, completion_tokens=None):
+        """Called by providers from _request() to report the token usage of the call."""
+        info = _call_info.get()
+        if info is not None:
+            info["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def load_image(self, image_path):
+        """
+        Applies self.image_policy to an image, going through the payload cache.
+
+        Returns:
+            tuple: (size of the original file in bytes, image bytes to upload)
+        """
+        with self._prefetched_lock:
+            prefetched = self._prefetched.get(image_path)
+        if prefetched is not None:
+            return prefetched
+        original_size, data, _ = load_payload(image_path, self.image_policy, self.payload_cache)
+        return original_size, data
+
+    def payload_loader(self):
+        """
+        Returns a picklable function that prepares one image for this provider in another
+        process (StagedExecutor's `prepare`), or None when images are sent unchanged.
+        """
+        if self.image_policy is None:
+            return None
+        return partial(prefetch_payload, policy=self.image_policy, use_cache=self.payload_cache is not None)
+
+    @contextlib.contextmanager
+    def prefetched(self, image_path, payload):
+        """
+        Makes a payload from payload_loader() available to the requests for image_path
+        inside the `with` block (StagedExecutor's `with_prepared`).
+        """
+        original_size, data, cache_hit, digest = payload
+        if cache_hit is not None and self.payload_cache is not None:
+            self.payload_cache.count(cache_hit)
+        if digest is not None:
+            remember_digest(digest)
+        with self._prefetched_lock:
+            self._prefetched[image_path] = (original_size, data)
+        try:
+            yield
+        finally:
+            with self._prefetched_lock:
+                self._prefetched.pop(image_path, None)
+
+    def _prepare_image(self, image_path):
+        """Returns the image bytes to upload after applying self.image_policy, and counts them."""
+        original_size, data = self.load_image(image_path)
+        self.upload_stats.add(original_size, len(data))
+        return data
+
+    def report_uploads(self):
+        """Prints the bytes uploaded by this provider and the payload cache hit rate."""
+        self.upload_stats.report()
+        if self.payload_cache is not None:
+            self.payload_cache.report()
+
+    def _encode_image(self, image_path):
+        """Base64 version of _prepare_image(), or None if the image doesn't exist."""
+        if not os.path.exists(image_path):
+            return None
+        return base64.b64encode(self._prepare_image(image_path)).decode("utf-8")
+
+    def _build_exemplar_prefix(self, bank):
+        """
+        Turns an ExemplarBank into the request parts sent before every prompt.
+
+        Called once per bank. The default is the OpenAI-compatible chat format
+        (text and image_url content parts) used by OpenAI and Together.
+
+        Returns:
+            tuple: Immutable sequence of content parts.
+        """
+        parts = []
+        if bank.header:
+            parts.append({"type": "text", "text": bank.header})
+        for item in bank.items:
+            parts.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{item.base64}"}})
+            if item.caption:
+                parts.append({"type": "text", "text": item.caption})
+        return tuple(parts)
+
+    def _exemplar_prefix(self, exemplars):
+        """Returns the bank's prefix for one request (empty without a bank) and counts its upload."""
+        if exemplars is None:
+            return ()
+        if exemplars.provider_name != self.provider_name:
+            raise ValueError(f"ExemplarBank was built for {exemplars.provider_name}, not {self.provider_name}")
+        self.upload_stats.add(exemplars.original_bytes, exemplars.payload_bytes, images=len(exemplars))
+        return exemplars.prefix
+
+    @staticmethod
+    def _exemplar_kwargs(exemplars):
+        # Only pass `exemplars` when given, so _request() overrides without it keep working
+        return {} if exemplars is None else {"exemplars": exemplars}
+
+    def _cache_key(self, image_path, prompt, exemplars=None, stop_at_score=False):
+        if self.cache is None:
+            return None
+        params = self.sampling_params
+        if stop_at_score:
+            # Cut-off responses are kept apart from complete ones
+            params = {**params, "stop_at_score": True}
+        if self.image_policy is not None:
+            # A different resize/quality shows the model a different image
+            params = {**params, "image_policy": self.image_policy.as_dict()}
+        if exemplars is not None:
+            params = {**params, "exemplars": exemplars.fingerprint}
+        return make_cache_key(image_path, prompt, self.provider_name, self.model_name, params)
+
+    def _cache_lookup(self, info, cache_key):
+        if cache_key is None or self.cache_refresh:
+            return None
+        hit = self.cache.get(cache_key)
+        if hit is None:
+            return None
+        info.update(cached=True, usage=hit["usage"], latency=hit["latency"])
+        return hit["response"]
+
+    def _cache_store(self, info, cache_key, response, latency):
+        info["latency"] = latency
+        if cache_key is None or not response:
+            return
+        self.cache.put(cache_key, response, provider=self.provider_name, model=self.model_name,
+                       usage=info["usage"], latency=latency)
+
+    def _stream_cache_lookup(self, info, cache_key, image_path, prompt, exemplars, stop_at_score):
+        # A complete cached response answers a stop_at_score call as well
+        cached = self._cache_lookup(info, cache_key)
+        if cached is None and stop_at_score and cache_key is not None:
+            cached = self._cache_lookup(info, self._cache_key(image_path, prompt, exemplars))
+        if cached is not None:
+            scores = ScoreStream()
+            scores.feed(cached)
+            info["score"] = scores.finish()
+        return cached
+
+    @staticmethod
+    def _stream_chunk(info, scores, chunk, attempt_start, stop_at_score):
+        """Feeds a streamed chunk to the score parser; returns True when the stream should stop."""
+        # Every chunk is fed so scores.text holds the whole response, not just up to the score
+        if scores.feed(chunk) is None or info["score"] is not None:
+            return False
+        info["score"] = scores.score
+        info["score_latency"] = time.monotonic() - attempt_start
+        info["stopped_early"] = stop_at_score
+        return stop_at_score
+
+    def _stream_failed(self, info, exc):
+        info["error"] = describe_error(exc)
+        print(f"Error streaming from {self.display_name}: {info['error']}")
+
+    def _stream_done(self, info, scores, attempt_start, image_path, prompt, exemplars):
+        if info["score"] is None and scores.finish() is not None:
+            info["score"] = scores.score
+            info["score_latency"] = time.monotonic() - attempt_start
+        # Only a response that ran to completion goes under the full-response key
+        cache_key = self._cache_key(image_path, prompt, exemplars, stop_at_score=info["stopped_early"])
+        self._cache_store(info, cache_key, scores.text, time.monotonic() - attempt_start)
+
+    def _estimate_tokens(self, image_path, prompt, exemplars=None):
+        if not self.rate_limiter or not self.rate_limiter.tokens:
+            return 0
+        output_tokens = self.rate_limiter.expected_output_tokens(self.max_output_tokens)
+        tokens = estimate_tokens(prompt, image_path, output_tokens)
+        return tokens + (exemplars.tokens if exemplars is not None else 0)
+
+    def _settle_tokens(self, info, tokens):
+        """Corrects the rate limiter's reservation with the usage the provider reported."""
+        usage = info["usage"]
+        if not tokens or not usage or usage["prompt_tokens"] is None or usage["completion_tokens"] is None:
+            return
+        self.rate_limiter.settle(tokens, usage["prompt_tokens"] + usage["completion_tokens"],
+                                 usage["completion_tokens"])
+
+    @staticmethod
+    def _new_call_info():
+        return {"retries": 0, "error": None, "cached": False, "usage": None, "latency": None,
+                "score": None, "score_latency": None, "stopped_early": False}
+
+    @staticmethod
+    def _start_call():
+        info = BaseVLM._new_call_info()
+        _call_info.set(info)
+        return info
+
+    def _handle_error(self, info, exc, elapsed):
+        """Returns the delay before retrying, or None after recording a final failure."""
+        delay = self.retry_policy.next_delay(exc, info["retries"], elapsed)
+        if delay is None:
+            info["error"] = describe_error(exc)
+            print(f"Error calling {self.display_name}: {info['error']}")
+            return None
+        info["retries"] += 1
+        print(f"{self.display_name}: {type(exc).__name__}, retry {info['retries']} in {delay:.1f}s")
+        return delay
+
+    async def _get_async_client(self, name, factory):
+        """
+        Returns a cached async client for the running event loop, creating it if needed.
+
+        The client is closed when the loop shuts down its async generators (asyncio.run
+        does this before closing the loop), or by aclose().
+        """
+        loop = asyncio.get_running_loop()
+        cached = self._async_clients.get(name)
+        if cached is None or cached[0] is not loop:
+            client = factory()
+            closer = self._close_with_loop(name, client)
+            # Runs up to its yield; the loop finalizes it on shutdown
+            await _anext(closer)
+            # The loop only keeps a weak reference to the generator
+            cached = (loop, client, closer)
+            self._async_clients[name] = cached
+        return cached[1]
+
+    async def _close_with_loop(self, name, client):
+        try:
+            yield
+        finally:
+            cached = self._async_clients.get(name)
+            if cached is not None and cached[1] is client:
+                del self._async_clients[name]
+            close = getattr(client, "aclose", None) or client.close
+            await close()
 
+    async def aclose(self):
+        """Closes the async clients this provider opened on the running event loop."""
+        loop = asyncio.get_running_loop()
+        for name, (client_loop, _, closer) in list(self._async_clients.items()):
+            if client_loop is loop:
+                await closer.aclose()
@@ -0,0 +1,35 @@
+import requests
+import httpx
+from requests.adapters import HTTPAdapter
+from src.config import Config
+from src.executor import get_provider_limit
+
+# Shared HTTP plumbing for the providers that talk to REST endpoints directly
+# (LocalVLM and TogetherVLM). Each provider instance owns one keep-alive pool sized
+# to the provider's configured concurrency, so concurrent workers reuse open
+# TCP/TLS connections instead of reconnecting for every image.
+
+
+def get_timeout(provider_name):
+    """Returns the (connect, read) timeout tuple for a provider."""
+    return (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT.get(provider_name, 120))
+
+
+def create_session(provider_name):
+    """Creates a requests.Session with a keep-alive pool matching the provider concurrency."""
+    pool_size = get_provider_limit(provider_name)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def create_async_client(provider_name):
+    """Creates an httpx.AsyncClient with the same pool size and timeouts as create_session."""
+    pool_size = get_provider_limit(provider_name)
+    connect_timeout, read_timeout = get_timeout(provider_name)
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+    )
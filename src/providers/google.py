@@ -1,3 +1,5 @@
+import asyncio
+import io
 import base64
 import PIL.Image
 from src.providers.base import BaseVLM
@@ -18,6 +20,9 @@ except ImportError:
         print("Warning: Google Generative AI package not found. Install with: pip install google-generativeai")
 
 class GoogleVLM(BaseVLM):
+    provider_name = "google"
+    display_name = "Google Gemini"
+
     def __init__(self, model_name=Config.MODEL_GOOGLE):
         super().__init__(model_name)
         
@@ -37,35 +42,113 @@ class GoogleVLM(BaseVLM):
             self.model = genai.GenerativeModel(model_name)
             self.use_new_api = False
 
-    def analyze(self, image_path, prompt):
-        try:
+    def _build_exemplar_prefix(self, bank):
+        parts = []
+        if bank.header:
+            parts.append(types.Part(text=bank.header) if self.use_new_api else bank.header)
+        for item in bank.items:
             if self.use_new_api:
-                # New API format
-                with open(image_path, "rb") as f:
-                    image_bytes = f.read()
-                
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=[
-                        types.Content(
-                            parts=[
-                                types.Part(text=prompt),
-                                types.Part(
-                                    inline_data=types.Blob(
-                                        mime_type="image/jpeg",
-                                        data=image_bytes,
-                                    )
-                                )
-                            ]
-                        )
-                    ]
-                )
-                return response.text
+                parts.append(types.Part(inline_data=types.Blob(mime_type="image/jpeg", data=item.data)))
             else:
-                # Standard API format
-                img = PIL.Image.open(image_path)
-                response = self.model.generate_content([prompt, img])
-                return response.text
-        except Exception as e:
-            print(f"Error calling Google Gemini: {e}")
+                # Decoded once here rather than for every request
+                img = PIL.Image.open(io.BytesIO(item.data))
+                img.load()
+                parts.append(img)
+            if item.caption:
+                parts.append(types.Part(text=item.caption) if self.use_new_api else item.caption)
+        return tuple(parts)
+
+    def _build_contents(self, image_path, prompt, exemplars=None):
+        image_bytes = self._prepare_image(image_path)
+
+        return [
+            types.Content(
+                parts=[
+                    # Few-shot exemplars (shared, prebuilt parts) come first
+                    *self._exemplar_prefix(exemplars),
+                    types.Part(text=prompt),
+                    types.Part(
+                        inline_data=types.Blob(
+                            mime_type="image/jpeg",
+                            data=image_bytes,
+                        )
+                    )
+                ]
+            )
+        ]
+
+    def _parse_response(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self._record_usage(getattr(usage, "prompt_token_count", None),
+                               getattr(usage, "candidates_token_count", None))
+        return response.text
+
+    def _request(self, image_path, prompt, exemplars=None):
+        if self.use_new_api:
+            # New API format
+            response = self.client.models.generate_content(
+                model=self.model_name,
+                contents=self._build_contents(image_path, prompt, exemplars)
+            )
+            return self._parse_response(response)
+        else:
+            # Standard API format
+            img = PIL.Image.open(io.BytesIO(self._prepare_image(image_path)))
+            response = self.model.generate_content([*self._exemplar_prefix(exemplars), prompt, img])
+            return self._parse_response(response)
+
+    async def _request_async(self, image_path, prompt, exemplars=None):
+        if self.use_new_api:
+            # New API format - native async client lives under client.aio
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name,
+                contents=await asyncio.to_thread(self._build_contents, image_path, prompt, exemplars)
+            )
+            return self._parse_response(response)
+        else:
+            # Standard API format
+            img = PIL.Image.open(io.BytesIO(await asyncio.to_thread(self._prepare_image, image_path)))
+            response = await self.model.generate_content_async([*self._exemplar_prefix(exemplars), prompt, img])
+            return self._parse_response(response)
+
+    def _parse_chunk(self, chunk):
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage is not None and getattr(usage, "candidates_token_count", None):
+            self._record_usage(getattr(usage, "prompt_token_count", None), usage.candidates_token_count)
+        try:
+            return chunk.text
+        except ValueError:
+            # A chunk without text parts (e.g. only finish_reason) raises on the old API
             return None
+
+    def _stream_request(self, image_path, prompt, exemplars=None):
+        if self.use_new_api:
+            stream = self.client.models.generate_content_stream(
+                model=self.model_name,
+                contents=self._build_contents(image_path, prompt, exemplars)
+            )
+        else:
+            img = PIL.Image.open(io.BytesIO(self._prepare_image(image_path)))
+            stream = self.model.generate_content([*self._exemplar_prefix(exemplars), prompt, img], stream=True)
+        # Stopping the iteration closes the underlying stream
+        for chunk in stream:
+            text = self._parse_chunk(chunk)
+            if text:
+                yield text
+
+    async def _stream_request_async(self, image_path, prompt, exemplars=None):
+        if self.use_new_api:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=self.model_name,
+                contents=await asyncio.to_thread(self._build_contents, image_path, prompt, exemplars)
+            )
+        else:
+            img = PIL.Image.open(io.BytesIO(await asyncio.to_thread(self._prepare_image, image_path)))
+            stream = await self.model.generate_content_async(
+                [*self._exemplar_prefix(exemplars), prompt, img], stream=True
+            )
+        async for chunk in stream:
+            text = self._parse_chunk(chunk)
+            if text:
+                yield text
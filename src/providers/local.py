@@ -1,32 +1,94 @@
-import requests
+import asyncio
 import json
-import base64
 from src.providers.base import BaseVLM
+from src.providers.connections import create_session, create_async_client, get_timeout
+from src.providers.request_body import Splice, StreamingJSONBody
 from src.config import Config
 
 class LocalVLM(BaseVLM):
+    provider_name = "local"
+    display_name = "Local VLM"
+
     def __init__(self, model_name=Config.MODEL_LOCAL):
         super().__init__(model_name)
         self.api_url = f"{Config.OLLAMA_BASE_URL}/api/generate"
+        self.session = create_session("local")
+        self.timeout = get_timeout("local")
+
+    @property
+    def sampling_params(self):
+        return {"format": "json"}
 
-    def analyze(self, image_path, prompt):
-        # Encode image
-        with open(image_path, "rb") as f:
-            img_b64 = base64.b64encode(f.read()).decode("utf-8")
+    def _build_exemplar_prefix(self, bank):
+        # /api/generate takes one prompt and a flat list of images, so exemplars are named by position
+        lines = [bank.header] if bank.header else []
+        for i, item in enumerate(bank.items, 1):
+            lines.append(f"Image {i}: {item.caption or 'Example'}")
+        lines.append(f"Image {len(bank.items) + 1}: The image to analyze.")
+        return "\n\n".join(lines), tuple(Splice(item.base64, encoded=True) for item in bank.items)
 
-        payload = {
+    def _build_payload(self, image_path, prompt, exemplars=None, stream=False):
+        # Image downscaled per Config.IMAGE_POLICIES; base64-encoded only while the body is sent
+        image = Splice(self._prepare_image(image_path))
+        splices = [image]
+        if exemplars is not None:
+            prefix_text, prefix_images = self._exemplar_prefix(exemplars)
+            prompt = f"{prefix_text}\n\n{prompt}"
+            splices = [*prefix_images, image]
+
+        return StreamingJSONBody({
             "model": self.model_name,
             "prompt": prompt,
-            "images": [img_b64],
-            "stream": False,
+            "images": [splice.token for splice in splices],
+            # Streamed as one JSON object per line, the last one with "done": true
+            "stream": stream,
             "format": "json"  # Enforce JSON output for structured data
-        }
+        }, splices)
+
+    def _parse_response(self, data):
+        self._record_usage(data.get("prompt_eval_count"), data.get("eval_count"))
+        return data.get("response", "")
 
-        try:
-            response = requests.post(self.api_url, json=payload)
+    def _request(self, image_path, prompt, exemplars=None):
+        body = self._build_payload(image_path, prompt, exemplars)
+        response = self.session.post(self.api_url, data=body, headers=body.headers, timeout=self.timeout)
+        response.raise_for_status()
+        return self._parse_response(response.json())
+
+    async def _request_async(self, image_path, prompt, exemplars=None):
+        body = await asyncio.to_thread(self._build_payload, image_path, prompt, exemplars)
+        client = await self._get_async_client("httpx", lambda: create_async_client("local"))
+        response = await client.post(self.api_url, content=body.async_chunks(), headers=body.headers)
+        response.raise_for_status()
+        return self._parse_response(response.json())
+
+    def _parse_line(self, line):
+        data = json.loads(line)
+        if data.get("done"):
+            self._record_usage(data.get("prompt_eval_count"), data.get("eval_count"))
+        return data.get("response")
+
+    def _stream_request(self, image_path, prompt, exemplars=None):
+        body = self._build_payload(image_path, prompt, exemplars, stream=True)
+        response = self.session.post(self.api_url, data=body, headers=body.headers, timeout=self.timeout,
+                                     stream=True)
+        # Closing the response drops the connection, which makes Ollama stop generating
+        with response:
             response.raise_for_status()
-            return response.json().get("response", "")
-        except requests.exceptions.RequestException as e:
-            print(f"Error calling Local VLM: {e}")
-            return None
+            for line in response.iter_lines():
+                text = self._parse_line(line) if line else None
+                if text:
+                    yield text
 
+    async def _stream_request_async(self, image_path, prompt, exemplars=None):
+        body = await asyncio.to_thread(self._build_payload, image_path, prompt, exemplars, True)
+        client = await self._get_async_client("httpx", lambda: create_async_client("local"))
+        async with client.stream("POST", self.api_url, content=body.async_chunks(), headers=body.headers) as response:
+            if response.is_error:
+                # Read the error body so describe_error() can include it
+                await response.aread()
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                text = self._parse_line(line) if line else None
+                if text:
+                    yield text
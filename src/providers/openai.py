@@ -1,39 +1,121 @@
-from openai import OpenAI
+import asyncio
+from openai import OpenAI, AsyncOpenAI
 from src.providers.base import BaseVLM
 from src.config import Config
-from src.data_loader import DataLoader
 
 class OpenAIVLM(BaseVLM):
+    provider_name = "openai"
+    display_name = "OpenAI"
+    max_output_tokens = 2000  # Increased for complete subcategory scores
+
     def __init__(self, model_name=Config.MODEL_OPENAI):
         super().__init__(model_name)
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+        # Retries are handled by BaseVLM.retry_policy, so disable the SDK's own
+        self.client = OpenAI(api_key=Config.OPENAI_API_KEY, max_retries=0)
+
+    @property
+    def sampling_params(self):
+        return {"max_tokens": self.max_output_tokens}
+
+    def _build_request(self, base64_image, prompt, prefix=()):
+        return dict(
+            model=self.model_name,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        # Few-shot exemplars (shared, prebuilt parts) come first
+                        *prefix,
+                        {"type": "text", "text": prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{base64_image}"
+                            },
+                        },
+                    ],
+                }
+            ],
+            **self.sampling_params,
+        )
+
+    def _parse_response(self, response):
+        if response.usage is not None:
+            self._record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content
 
-    def analyze(self, image_path, prompt):
-        base64_image = DataLoader.encode_image(image_path)
+    def _request(self, image_path, prompt, exemplars=None):
+        base64_image = self._encode_image(image_path)
         if not base64_image:
             return "Error: Image not found"
 
+        response = self.client.chat.completions.create(
+            **self._build_request(base64_image, prompt, self._exemplar_prefix(exemplars))
+        )
+        return self._parse_response(response)
+
+    async def _request_async(self, image_path, prompt, exemplars=None):
+        base64_image = await asyncio.to_thread(self._encode_image, image_path)
+        if not base64_image:
+            return "Error: Image not found"
+
+        client = await self._get_async_client(
+            "openai", lambda: AsyncOpenAI(api_key=Config.OPENAI_API_KEY, max_retries=0)
+        )
+
+        response = await client.chat.completions.create(
+            **self._build_request(base64_image, prompt, self._exemplar_prefix(exemplars))
+        )
+        return self._parse_response(response)
+
+    def _stream_params(self):
+        # The usage chunk comes last, so a stream cancelled at the score never gets it
+        return {"stream": True, "stream_options": {"include_usage": True}}
+
+    def _parse_chunk(self, chunk):
+        if chunk.usage is not None:
+            self._record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+        if chunk.choices:
+            return chunk.choices[0].delta.content
+        return None
+
+    def _stream_request(self, image_path, prompt, exemplars=None):
+        base64_image = self._encode_image(image_path)
+        if not base64_image:
+            yield "Error: Image not found"
+            return
+
+        stream = self.client.chat.completions.create(
+            **self._build_request(base64_image, prompt, self._exemplar_prefix(exemplars)),
+            **self._stream_params()
+        )
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                },
-                            },
-                        ],
-                    }
-                ],
-                max_tokens=2000,  # Increased for complete subcategory scores
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Error calling OpenAI: {e}")
-            return None
+            for chunk in stream:
+                text = self._parse_chunk(chunk)
+                if text:
+                    yield text
+        finally:
+            # Closing the connection makes the API stop generating
+            stream.close()
+
+    async def _stream_request_async(self, image_path, prompt, exemplars=None):
+        base64_image = await asyncio.to_thread(self._encode_image, image_path)
+        if not base64_image:
+            yield "Error: Image not found"
+            return
 
+        client = await self._get_async_client(
+            "openai", lambda: AsyncOpenAI(api_key=Config.OPENAI_API_KEY, max_retries=0)
+        )
+
+        stream = await client.chat.completions.create(
+            **self._build_request(base64_image, prompt, self._exemplar_prefix(exemplars)),
+            **self._stream_params()
+        )
+        try:
+            async for chunk in stream:
+                text = self._parse_chunk(chunk)
+                if text:
+                    yield text
+        finally:
+            await stream.close()
@@ -0,0 +1,103 @@
+import base64
+import itertools
+import json
+import re
+import secrets
+
+# Raw bytes encoded per chunk; a multiple of 3 so chunks concatenate to valid base64
+ENCODE_CHUNK = 48 * 1024
+
+# Placeholder tokens look like "<tag><n>@"; the random tag can't occur in a prompt by accident
+_TAG = "img" + secrets.token_hex(8) + "_"
+_TOKEN_RE = re.compile(f"({re.escape(_TAG)}\\d+@)")
+_counter = itertools.count()
+
+
+class Splice:
+    """
+    Base64 content referenced from a request payload by a placeholder token.
+
+    Put `splice.token` in the payload where the base64 string goes (e.g. after
+    "data:image/jpeg;base64,"); StreamingJSONBody writes the content there while the
+    body is sent.
+
+    Args:
+        data: Raw image bytes (base64-encoded chunk by chunk when sent), or an already
+            encoded base64 str/bytes with encoded=True (e.g. exemplars encoded once per run).
+        encoded: Whether `data` is already base64.
+    """
+
+    def __init__(self, data, encoded=False):
+        if encoded and isinstance(data, str):
+            data = data.encode("ascii")
+        self.data = data
+        self.encoded = encoded
+        self.token = f"{_TAG}{next(_counter)}@"
+
+    def __len__(self):
+        if self.encoded:
+            return len(self.data)
+        return 4 * ((len(self.data) + 2) // 3)
+
+    def chunks(self):
+        if self.encoded:
+            yield self.data
+            return
+        view = memoryview(self.data)
+        for start in range(0, len(view), ENCODE_CHUNK):
+            yield base64.b64encode(view[start:start + ENCODE_CHUNK])
+
+
+class StreamingJSONBody:
+    """
+    JSON request body with large base64 images spliced in as it is sent.
+
+    The payload is serialized with placeholder tokens instead of the images, so only the
+    small JSON text is built up front. Iterating yields the body in chunks and len() is
+    the exact byte length, so requests and httpx send it with a Content-Length header
+    without ever holding the base64 string, a data URL or the full serialized body.
+
+    Example:
+        image = Splice(image_bytes)
+        payload = {"images": [image.token], ...}
+        body = StreamingJSONBody(payload, [image])
+        session.post(url, data=body, headers=body.headers)
+
+    Args:
+        payload: JSON-serializable request payload containing splice tokens.
+        splices: The Splice objects whose tokens appear in the payload.
+    """
+
+    def __init__(self, payload, splices):
+        by_token = {splice.token: splice for splice in splices}
+        self.segments = []
+        for i, part in enumerate(_TOKEN_RE.split(json.dumps(payload))):
+            # split() with a capture group alternates text, token, text, ...
+            if i % 2:
+                self.segments.append(by_token[part])
+            elif part:
+                self.segments.append(part.encode("utf-8"))
+        self.length = sum(len(segment) for segment in self.segments)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for segment in self.segments:
+            if isinstance(segment, Splice):
+                yield from segment.chunks()
+            else:
+                yield segment
+
+    async def async_chunks(self):
+        """
+        Async iterator over the same chunks, for httpx.AsyncClient (content=body.async_chunks()).
+
+        httpx treats any plain iterable as a sync stream, which AsyncClient refuses.
+        """
+        for chunk in self:
+            yield chunk
+
+    @property
+    def headers(self):
+        return {"Content-Type": "application/json", "Content-Length": str(self.length)}
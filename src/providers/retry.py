@@ -0,0 +1,121 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from src.config import Config
+
+# HTTP statuses worth retrying: timeouts, rate limits and server-side failures
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Transient network errors, matched by class name so the SDKs (requests, httpx,
+# openai, google) don't have to be imported here
+RETRYABLE_ERROR_NAMES = {
+    "TimeoutError", "ConnectionError",                   # builtins / requests
+    "Timeout", "ConnectTimeout", "ReadTimeout",          # requests
+    "TransportError", "TimeoutException",                # httpx
+    "APIConnectionError", "APITimeoutError",             # openai
+    "ServiceUnavailable", "DeadlineExceeded",            # google.api_core
+    "ResourceExhausted", "InternalServerError",
+}
+
+
+def get_status_code(exc):
+    """Returns the HTTP status code carried by an SDK/HTTP exception, if any."""
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    if response is not None:
+        value = getattr(response, "status_code", None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def get_retry_after(exc):
+    """Returns the server-requested delay in seconds from a Retry-After header, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP-date form
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc):
+    """True for rate limits (429), server errors (5xx) and network timeouts; False otherwise."""
+    status = get_status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    return bool(names & RETRYABLE_ERROR_NAMES)
+
+
+def describe_error(exc):
+    """Formats an exception for logs and result rows, including the HTTP body when present."""
+    message = f"{type(exc).__name__}: {exc}"
+    response = getattr(exc, "response", None)
+    text = getattr(response, "text", None)
+    if isinstance(text, str) and text and text not in message:
+        message += f" | {text[:500]}"
+    return message
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter for transient provider errors.
+    
+    Args:
+        max_retries: Maximum number of retries after the first attempt.
+        base_delay: Backoff base in seconds (attempt n waits up to base * 2**n).
+        max_delay: Upper bound for a single wait, in seconds.
+        max_total_time: Cap on the total time spent on one call, including waits.
+    """
+
+    def __init__(self, max_retries=None, base_delay=None, max_delay=None, max_total_time=None):
+        self.max_retries = Config.RETRY_MAX_RETRIES if max_retries is None else max_retries
+        self.base_delay = Config.RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = Config.RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.max_total_time = Config.RETRY_MAX_TOTAL_TIME if max_total_time is None else max_total_time
+
+    def next_delay(self, exc, retries, elapsed):
+        """
+        Decides whether to retry after `exc`.
+        
+        Args:
+            exc: The exception raised by the last attempt.
+            retries: Number of retries already made.
+            elapsed: Seconds spent on this call so far.
+            
+        Returns:
+            float: Seconds to wait before the next attempt, or None to give up.
+        """
+        if retries >= self.max_retries or not is_retryable(exc):
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retries))
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            delay = retry_after
+
+        if elapsed + delay > self.max_total_time:
+            return None
+        return delay
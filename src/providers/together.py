@@ -1,66 +1,172 @@
+import asyncio
 import os
+import json
 import base64
-import requests
 from src.providers.base import BaseVLM
+from src.providers.connections import create_session, create_async_client, get_timeout
+from src.providers.request_body import Splice, StreamingJSONBody
 from src.config import Config
-from src.data_loader import DataLoader
 
 class TogetherVLM(BaseVLM):
+    provider_name = "together"
+    display_name = "Together AI"
+    max_output_tokens = 512
+
     def __init__(self, model_name=Config.MODEL_TOGETHER):
         super().__init__(model_name)
         self.api_key = Config.TOGETHER_API_KEY
         self.url = "https://api.together.xyz/v1/chat/completions"
+        self.session = create_session("together")
+        self.timeout = get_timeout("together")
 
-    def analyze(self, image_path, prompt):
-        # Together AI Llama Vision requires a specific format
-        # Note: Implementation details for Together's Vision API might vary, 
-        # this follows their standard chat completion with image support pattern.
-        
-        # We need to verify if the specific model supports local file upload or URL only.
-        # Assuming standard OpenAI-compatible format for Vision which Together often supports.
-        
-        base64_image = DataLoader.encode_image(image_path)
-        if not base64_image:
-            return "Error: Image not found"
+    @property
+    def sampling_params(self):
+        return {
+            "max_tokens": self.max_output_tokens,
+            "temperature": 0.7,
+            "top_p": 0.7,
+            "top_k": 50,
+            "repetition_penalty": 1,
+            "stop": ["<|eot_id|>"]
+        }
+
+    def _build_exemplar_prefix(self, bank):
+        # Same parts as the default, but the images are spliced into the streamed body
+        splices = []
+        parts = []
+        if bank.header:
+            parts.append({"type": "text", "text": bank.header})
+        for item in bank.items:
+            splice = Splice(item.base64, encoded=True)
+            splices.append(splice)
+            parts.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{splice.token}"}})
+            if item.caption:
+                parts.append({"type": "text", "text": item.caption})
+        return tuple(parts), tuple(splices)
 
-        payload = {
+    def _build_payload(self, image_data, prompt, prefix=((), ()), stream=False):
+        # base64 is written straight into the request body as it is sent (see request_body.py)
+        prefix_parts, prefix_splices = prefix
+        image = Splice(image_data)
+        return StreamingJSONBody({
             "model": self.model_name,
             "messages": [
                 {
                     "role": "user",
                     "content": [
+                        # Few-shot exemplars (shared, prebuilt parts) come first
+                        *prefix_parts,
                         {"type": "text", "text": prompt},
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": f"data:image/jpeg;base64,{image.token}"
                             }
                         }
                     ]
                 }
             ],
-            "max_tokens": 512,
-            "temperature": 0.7,
-            "top_p": 0.7,
-            "top_k": 50,
-            "repetition_penalty": 1,
-            "stop": ["<|eot_id|>"]
-        }
-        headers = {
+            **self.sampling_params,
+            # Server-sent events, one "data: {...}" line per token (see _parse_event)
+            **({"stream": True} if stream else {})
+        }, [*prefix_splices, image])
+
+    def _build_headers(self, body):
+        return {
             "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
+            **body.headers
         }
 
-        try:
-            response = requests.post(self.url, json=payload, headers=headers)
-            response.raise_for_status()
-            return response.json()['choices'][0]['message']['content']
-        except Exception as e:
-            print(f"Error calling Together AI: {e}")
-            # Print detailed error if available
-            try:
-                print(response.text)
-            except:
-                pass
+    def _exemplar_prefix(self, exemplars):
+        # Without a bank: no parts and no splices
+        return super()._exemplar_prefix(exemplars) or ((), ())
+
+    def _parse_response(self, data):
+        usage = data.get("usage") or {}
+        self._record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        return data['choices'][0]['message']['content']
+
+    def _parse_event(self, line):
+        """Returns the text of one server-sent event line of a streamed completion, if any."""
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
             return None
+        data = json.loads(data)
+        usage = data.get("usage")
+        if usage:
+            self._record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        choices = data.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content")
+
+    def _request(self, image_path, prompt, exemplars=None):
+        # Together AI Llama Vision requires a specific format
+        # Note: Implementation details for Together's Vision API might vary, 
+        # this follows their standard chat completion with image support pattern.
+        
+        # We need to verify if the specific model supports local file upload or URL only.
+        # Assuming standard OpenAI-compatible format for Vision which Together often supports.
+        
+        if not os.path.exists(image_path):
+            return "Error: Image not found"
+
+        body = self._build_payload(self._prepare_image(image_path), prompt, self._exemplar_prefix(exemplars))
+        headers = self._build_headers(body)
 
+        # HTTP errors carry the response body, which describe_error() includes in the log
+        response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return self._parse_response(response.json())
+
+    async def _request_async(self, image_path, prompt, exemplars=None):
+        if not os.path.exists(image_path):
+            return "Error: Image not found"
+
+        # Decode/resize/encode off the event loop
+        image_data = await asyncio.to_thread(self._prepare_image, image_path)
+        body = self._build_payload(image_data, prompt, self._exemplar_prefix(exemplars))
+        headers = self._build_headers(body)
+        client = await self._get_async_client("httpx", lambda: create_async_client("together"))
+
+        response = await client.post(self.url, content=body.async_chunks(), headers=headers)
+        response.raise_for_status()
+        return self._parse_response(response.json())
+
+    def _stream_request(self, image_path, prompt, exemplars=None):
+        if not os.path.exists(image_path):
+            yield "Error: Image not found"
+            return
+
+        body = self._build_payload(self._prepare_image(image_path), prompt, self._exemplar_prefix(exemplars),
+                                   stream=True)
+        headers = self._build_headers(body)
+
+        response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout, stream=True)
+        # Closing the response drops the connection, which stops the generation
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                text = self._parse_event(line.decode("utf-8")) if line else None
+                if text:
+                    yield text
+
+    async def _stream_request_async(self, image_path, prompt, exemplars=None):
+        if not os.path.exists(image_path):
+            yield "Error: Image not found"
+            return
+
+        image_data = await asyncio.to_thread(self._prepare_image, image_path)
+        body = self._build_payload(image_data, prompt, self._exemplar_prefix(exemplars), stream=True)
+        headers = self._build_headers(body)
+        client = await self._get_async_client("httpx", lambda: create_async_client("together"))
+
+        async with client.stream("POST", self.url, content=body.async_chunks(), headers=headers) as response:
+            if response.is_error:
+                # Read the error body so describe_error() can include it
+                await response.aread()
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                text = self._parse_event(line) if line else None
+                if text:
+                    yield text
@@ -0,0 +1,187 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from src.config import Config
+
+# Rough characters-per-token ratio for English prompts
+CHARS_PER_TOKEN = 4
+# Used when the image dimensions can't be read (a 1024x1024 image in high detail)
+DEFAULT_IMAGE_TOKENS = 765
+
+
+def estimate_image_tokens(image_path):
+    """
+    Estimates the input tokens of an image from its pixel size (header read only).
+    
+    Follows the OpenAI high-detail rule: fit within 2048x2048, scale the short side
+    to 768, then 170 tokens per 512px tile plus 85 base tokens. Other providers
+    bill images differently but in the same order of magnitude.
+    """
+    try:
+        import PIL.Image
+        with PIL.Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        return DEFAULT_IMAGE_TOKENS
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def estimate_tokens(prompt, image_path=None, max_output_tokens=0):
+    """
+    Estimates the tokens a request counts against a tokens-per-minute limit.
+    
+    Args:
+        prompt (str): The text prompt.
+        image_path (str): Optional image sent with the prompt.
+        max_output_tokens (int): Completion tokens to reserve (see RateLimiter.expected_output_tokens()).
+        
+    Returns:
+        int: Estimated token count.
+    """
+    tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+    if image_path and os.path.exists(image_path):
+        tokens += estimate_image_tokens(image_path)
+    return tokens + (max_output_tokens or 0)
+
+
+class TokenBucket:
+    """A bucket of `capacity` units refilled continuously at `rate` units per second."""
+
+    def __init__(self, capacity, rate):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if available now)."""
+        missing = amount - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+
+class RateLimiter:
+    """
+    Client-side limiter for a requests-per-minute and a tokens-per-minute budget.
+    
+    Both budgets are scaled by `headroom` so throughput settles just below the
+    provider limit instead of bouncing off it with 429s. Safe to share across threads.
+
+    A request reserves its prompt plus the expected completion (the running mean of the
+    completions reported so far, max_output_tokens until there is one) rather than the
+    whole max_output_tokens; settle() corrects the reservation once the usage is known.
+    
+    Args:
+        rpm: Requests per minute, or None for no request limit.
+        tpm: Tokens per minute, or None for no token limit.
+        headroom: Fraction of the published limit to use.
+    """
+
+    def __init__(self, rpm=None, tpm=None, headroom=None):
+        if headroom is None:
+            headroom = Config.RATE_LIMIT_HEADROOM
+        self.requests = TokenBucket(rpm * headroom, rpm * headroom / 60) if rpm else None
+        self.tokens = TokenBucket(tpm * headroom, tpm * headroom / 60) if tpm else None
+        self._lock = threading.Lock()
+        self._mean_output = None
+
+    def _try_acquire(self, tokens):
+        """Takes the budget for one request if available; otherwise returns the wait in seconds."""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.requests:
+                self.requests.refill(now)
+                wait = max(wait, self.requests.wait_time(1))
+            if self.tokens:
+                self.tokens.refill(now)
+                # A single request larger than the whole bucket would never fit
+                tokens = min(tokens, self.tokens.capacity)
+                wait = max(wait, self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            if self.requests:
+                self.requests.level -= 1
+            if self.tokens:
+                self.tokens.level -= tokens
+            return 0.0
+
+    def expected_output_tokens(self, max_output_tokens):
+        """Completion tokens to reserve for a request capped at `max_output_tokens`."""
+        if self._mean_output is None or not max_output_tokens:
+            return max_output_tokens or 0
+        return min(max_output_tokens, math.ceil(self._mean_output))
+
+    def settle(self, reserved, used, output_tokens=None):
+        """
+        Replaces a request's reserved tokens with the tokens it actually used.
+
+        Unused tokens go back into the budget; an underestimate is taken out of it, so
+        the next requests wait for it.
+
+        Args:
+            reserved: Tokens passed to acquire().
+            used: Prompt plus completion tokens reported by the provider.
+            output_tokens: Completion tokens, used to update expected_output_tokens().
+        """
+        with self._lock:
+            if output_tokens is not None:
+                # Exponential moving average; recent responses weigh most
+                if self._mean_output is None:
+                    self._mean_output = float(output_tokens)
+                else:
+                    self._mean_output += 0.1 * (output_tokens - self._mean_output)
+            if self.tokens:
+                self.tokens.refill(time.monotonic())
+                reserved = min(reserved, self.tokens.capacity)
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved - used)
+
+    def acquire(self, tokens=0):
+        """Blocks until one request of `tokens` estimated tokens fits in both budgets."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """Async version of acquire() that doesn't block the event loop."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+# One limiter per (provider, model), shared by every provider instance in the process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider_name, model_name):
+    """
+    Returns the shared RateLimiter for a provider/model pair, or None if no limits are configured.
+    
+    Limits are looked up in Config.RATE_LIMITS, first under "provider:model", then under
+    the provider name alone.
+    """
+    limits = Config.RATE_LIMITS.get(f"{provider_name}:{model_name}") or Config.RATE_LIMITS.get(provider_name)
+    if not limits:
+        return None
+
+    key = (provider_name, model_name)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(rpm=limits.get("rpm"), tpm=limits.get("tpm"))
+        return _limiters[key]
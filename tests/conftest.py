@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.config import Config
+
+
+@pytest.fixture
+def no_shared_caches(monkeypatch, tmp_path):
+    """Keeps BaseVLM from opening the response and payload caches under data/cache."""
+    monkeypatch.setattr(Config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(Config, "PAYLOAD_CACHE_ENABLED", False)
+    monkeypatch.setattr(Config, "CACHE_DIR", str(tmp_path / "cache"))
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.dedup import cluster_near_duplicates
+
+# Each hash is 3 bits from the next, so at max_distance=4 they chain from ATT1 into ATT2
+HASHES = {
+    "NHTyp1/ATT1_1.jpg": (0b0, 0),
+    "NHTyp1/ATT1_2.jpg": (0b111, 0),
+    "NHTyp1/ATT2_1.jpg": (0b111111, 0),
+    "NHTyp1/ATT2_2.jpg": (0b111111111, 0),
+}
+
+
+def test_clusters_stay_within_a_property():
+    clusters = cluster_near_duplicates(HASHES, max_distance=4)
+    assert clusters == {
+        "NHTyp1/ATT1_1.jpg": ["NHTyp1/ATT1_1.jpg", "NHTyp1/ATT1_2.jpg"],
+        "NHTyp1/ATT2_1.jpg": ["NHTyp1/ATT2_1.jpg", "NHTyp1/ATT2_2.jpg"],
+    }
+
+
+def test_ungrouped_clusters_chain_across_properties():
+    clusters = cluster_near_duplicates(HASHES, max_distance=4, group=None)
+    assert list(clusters.values()) == [list(HASHES)]
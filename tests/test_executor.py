@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.config import Config
+from src.executor import BatchExecutor, get_provider_semaphore
+from src.providers.base import BaseVLM
+
+pytestmark = pytest.mark.usefixtures("no_shared_caches")
+
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+
+class AsyncVLM(BaseVLM):
+    provider_name = "async_test"
+    display_name = "Async test"
+
+    def __init__(self):
+        super().__init__("test-model")
+        self.rate_limiter = None
+        self.image_policy = None
+        self.clients = []
+
+    def _request(self, image_path, prompt, exemplars=None):
+        return "OVERALL DSM SCORE: 3"
+
+    async def _request_async(self, image_path, prompt, exemplars=None):
+        client = await self._get_async_client("fake", self._new_client)
+        assert not client.closed
+        return "OVERALL DSM SCORE: 3"
+
+    def _new_client(self):
+        self.clients.append(FakeAsyncClient())
+        return self.clients[-1]
+
+
+def test_map_async_respects_the_shared_provider_limit(monkeypatch):
+    monkeypatch.setitem(Config.PROVIDER_CONCURRENCY, "limit_test", 2)
+    shared = get_provider_semaphore("limit_test")
+    in_flight = peak = 0
+
+    async def call(item):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return item
+
+    # A sync run elsewhere in the process holds one of the two slots
+    shared.acquire()
+    try:
+        executor = BatchExecutor("limit_test", progress_every=0)
+        assert asyncio.run(executor.map_async(call, range(8))) == list(range(8))
+    finally:
+        shared.release()
+    assert peak == 1
+    # Every slot taken by the run was given back
+    assert shared.acquire(blocking=False) and shared.acquire(blocking=False)
+    shared.release()
+    shared.release()
+
+def test_async_clients_are_closed_with_their_loop():
+    provider = AsyncVLM()
+    asyncio.run(provider.analyze_async(None, "Score this."))
+    asyncio.run(provider.analyze_async(None, "Score this."))
+    assert len(provider.clients) == 2
+    assert all(client.closed for client in provider.clients)
+    assert provider._async_clients == {}
+
+
+def test_aclose_closes_the_loop_clients():
+    provider = AsyncVLM()
+
+    async def run():
+        await provider.analyze_async(None, "Score this.")
+        await provider.analyze_async(None, "Score this.")
+        await provider.aclose()
+
+    asyncio.run(run())
+    assert len(provider.clients) == 1
+    assert provider.clients[0].closed
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.providers.base import BaseVLM
+from src.rate_limit import RateLimiter
+
+pytestmark = pytest.mark.usefixtures("no_shared_caches")
+
+
+class UsageVLM(BaseVLM):
+    provider_name = "usage_test"
+    display_name = "Usage test"
+
+    def __init__(self, rate_limiter, completion_tokens):
+        super().__init__("test-model")
+        self.cache = None
+        self.rate_limiter = rate_limiter
+        self.image_policy = None
+        self.payload_cache = None
+        self.max_output_tokens = 2000
+        self.completion_tokens = completion_tokens
+
+    def _request(self, image_path, prompt, exemplars=None):
+        self._record_usage(100, self.completion_tokens)
+        return "OVERALL DSM SCORE: 3"
+
+
+def test_settle_refunds_unused_tokens():
+    limiter = RateLimiter(tpm=30000, headroom=1.0)
+    limiter.acquire(2500)
+    limiter.settle(2500, 600)
+    assert limiter.tokens.level > 30000 - 2500 + 1800
+
+
+def test_settle_charges_an_underestimate():
+    limiter = RateLimiter(tpm=30000, headroom=1.0)
+    limiter.acquire(1000)
+    limiter.settle(1000, 3000)
+    assert limiter.tokens.level < 30000 - 2900
+
+
+def test_reservation_follows_reported_completions():
+    limiter = RateLimiter(tpm=30000, headroom=1.0)
+    provider = UsageVLM(limiter, completion_tokens=400)
+    prompt = "x" * 400  # 100 tokens
+
+    assert provider._estimate_tokens(None, prompt) == 100 + 2000
+    provider.analyze(None, prompt)
+    assert provider._estimate_tokens(None, prompt) == 100 + 400
+    # Everything reserved beyond the 500 tokens used was given back
+    assert limiter.tokens.level > 30000 - 500 - 1
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.cache import ResponseCache
+from src.providers.base import BaseVLM
+
+pytestmark = pytest.mark.usefixtures("no_shared_caches")
+
+CHUNKS = ["OVERALL DSM SCORE: 3\n", "JUSTIFICATION: The paint is peeling ", "and the gutters sag."]
+
+
+class StreamingVLM(BaseVLM):
+    provider_name = "stream_test"
+    display_name = "Stream test"
+
+    def __init__(self, cache):
+        super().__init__("test-model")
+        self.cache = cache
+        self.rate_limiter = None
+        self.image_policy = None
+        self.payload_cache = None
+        self.requests = 0
+
+    def _request(self, image_path, prompt, exemplars=None):
+        self.requests += 1
+        return "".join(CHUNKS)
+
+    def _stream_request(self, image_path, prompt, exemplars=None):
+        self.requests += 1
+        yield from CHUNKS
+
+
+def make_provider(tmp_path):
+    image_path = tmp_path / "house.jpg"
+    image_path.write_bytes(b"not really a jpeg")
+    return StreamingVLM(ResponseCache(str(tmp_path / "responses.db"))), str(image_path)
+
+
+def test_streamed_response_is_cached_in_full(tmp_path):
+    provider, image_path = make_provider(tmp_path)
+
+    streamed = "".join(provider.analyze_stream(image_path, "Score this."))
+    assert streamed == "".join(CHUNKS)
+    assert provider.last_call_info()["score"] == 3
+
+    assert provider.analyze(image_path, "Score this.") == "".join(CHUNKS)
+    assert provider.last_call_info()["cached"]
+    assert provider.requests == 1
+
+
+def test_stopped_response_is_not_cached_as_complete(tmp_path):
+    provider, image_path = make_provider(tmp_path)
+
+    stopped = provider.analyze(image_path, "Score this.", stop_at_score=True)
+    assert stopped == CHUNKS[0]
+    assert provider.last_call_info()["stopped_early"]
+
+    # A full analyze() must not be answered with the cut-off text
+    assert provider.analyze(image_path, "Score this.") == "".join(CHUNKS)
+    assert not provider.last_call_info()["cached"]
+    assert provider.requests == 2
+
+
+def test_cache_refresh_replaces_the_cached_response(tmp_path):
+    provider, image_path = make_provider(tmp_path)
+    cache_key = provider._cache_key(image_path, "Score this.")
+    provider.cache.put(cache_key, "I can't tell.", provider=provider.provider_name, model=provider.model_name)
+
+    provider.cache_refresh = True
+    assert provider.analyze(image_path, "Score this.") == "".join(CHUNKS)
+    assert not provider.last_call_info()["cached"]
+
+    provider.cache_refresh = False
+    assert provider.analyze(image_path, "Score this.") == "".join(CHUNKS)
+    assert provider.last_call_info()["cached"]
+    assert provider.requests == 1
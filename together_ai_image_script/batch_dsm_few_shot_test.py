@@ -7,12 +7,15 @@ import requests
 import base64
 import json
 import os
+import sys
 import random
 import csv
-import re
 from datetime import datetime
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.parsing import extract_score
+
 # Load environment variables from config.env
 load_dotenv('config.env')
 
@@ -78,24 +81,8 @@ def encode_image_to_base64(image_path):
 
 def extract_score_from_response(response_text):
     """Extract the DSM score from AI response"""
-    # Look for patterns like "Score: 4" or "OVERALL DSM SCORE: 3"
-    patterns = [
-        r'OVERALL DSM SCORE:\s*(\d+)',
-        r'Score:\s*(\d+)',
-        r'SCORE:\s*(\d+)',
-        r'(\d+)\s*-\s*SLIPPING',
-        r'(\d+)\s*-\s*HEALTHY',
-        r'(\d+)\s*-\s*UNHEALTHY',
-        r'(\d+)\s*-\s*IN-BETWEEN'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, response_text, re.IGNORECASE)
-        if match:
-            return int(match.group(1))
-    
-    # If no pattern found, return None
-    return None
+    return extract_score(response_text)
+
 
 def analyze_property_with_few_shot_dsm_scoring(image_path, example_images):
     """Send property image to Gemma 3N with DSM Neighborhood Scoring System using few-shot learning"""
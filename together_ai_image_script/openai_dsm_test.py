@@ -6,14 +6,17 @@ OpenAI GPT-4 Vision DSM Property Condition Assessment Test
 import base64
 import json
 import os
+import sys
 import csv
-import re
 from datetime import datetime
 from dotenv import load_dotenv
 from openai import OpenAI
 from PIL import Image
 import io
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.parsing import extract_score
+
 # Load environment variables from config.env
 load_dotenv('config.env')
 
@@ -85,38 +88,9 @@ def encode_image_to_base64(image_path, max_size=512):
 
 def extract_score_from_response(response_text):
     """Extract the DSM score from AI response"""
-    # Look for patterns like "Score: 4" or "OVERALL DSM SCORE: 3"
-    patterns = [
-        r'OVERALL DSM SCORE:\s*(\d+)',
-        r'Score:\s*(\d+)',
-        r'SCORE:\s*(\d+)',
-        r'(\d+)\s*-\s*SLIPPING',
-        r'(\d+)\s*-\s*HEALTHY',
-        r'(\d+)\s*-\s*UNHEALTHY',
-        r'(\d+)\s*-\s*IN-BETWEEN',
-        r'(\d+)\s*-\s*VERY HEALTHY',
-        r'DSM SCORE:\s*(\d+)',
-        r'Property Score:\s*(\d+)',
-        r'Assessment Score:\s*(\d+)',
-        r'Rating:\s*(\d+)',
-        r'(\d+)\s*out of 5',
-        r'(\d+)/5'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, response_text, re.IGNORECASE)
-        if match:
-            score = int(match.group(1))
-            if 1 <= score <= 5:  # Validate score is in valid range
-                return score
-    
-    # Look for any number 1-5 in the response as fallback
-    numbers = re.findall(r'\b([1-5])\b', response_text)
-    if numbers:
-        return int(numbers[0])
-    
-    # If no pattern found, return None
-    return None
+    # Fall back to any lone number 1-5 in the response
+    return extract_score(response_text, bare_digits=True)
+
 
 def analyze_property_with_openai_gpt5(image_path):
     """Send property image to OpenAI GPT-5 with DSM Neighborhood Scoring System"""